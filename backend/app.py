@@ -1,8 +1,55 @@
-import joblib
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 import numpy as np
-import pandas as pd
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
+
+from batch_io import (
+    RESULT_FORMATS,
+    STREAM_FORMATS,
+    InputFormatError,
+    count_rows,
+    detach_upload,
+    detect_input_format,
+    encode_chunk,
+    encode_result,
+    negotiate_result_format,
+    parse_flag,
+    read_chunks,
+    read_frame,
+)
+from batching import MicroBatcher
+from cache import PredictionCache, parse_quantum
+from contract import FEATURE_COLUMNS, output_columns, top_k_columns
+from inference import top_k
+from jobs import JobNotReadyError, JobQueue, UnknownJobError
+from memory import process_memory
+from metrics import MetricsRegistry, finish_stages, mark, stages, start_stages
+from profiling import ProfiledChunks, ProfileStore, RequestProfiler, UnknownProfileError, request_id
+from registry import (
+    ArtifactWatcher,
+    ModelRegistry,
+    ModelValidationError,
+    ModelVersion,
+    UnknownVersionError,
+    load_artifact,
+    load_golden_set,
+    validate_version,
+    version_name,
+)
+from startup import StartupTracker
+from sweep import SweepError, build_grid, decision_map
+from thread_policy import (
+    ThreadTunedPredictor,
+    available_cpus,
+    calibrate,
+    parse_policy,
+    thread_budget,
+)
+from validation import parse_ranges, validate_frame, validate_values
 
 # --------------------------------------------------
 # 1. Initialize Flask app
@@ -12,13 +59,513 @@ app = Flask("Crop Recommendation API")
 # --------------------------------------------------
 # 2. Load trained model + label encoder
 # --------------------------------------------------
-artifacts = joblib.load("crop_recommendation_model.joblib")
+startup = StartupTracker()
+
+MODEL_PATH = os.environ.get("MODEL_PATH", "crop_recommendation_model.joblib")
+
+# MODEL_NATIVE_DIR points at the output of `python native_model.py`. The
+# model then loads from xgboost's native format (or flattened trees for
+# INFERENCE_ENGINE=numpy) without unpickling the sklearn Pipeline, which
+# keeps pandas, scikit-learn and, for numpy, xgboost out of startup.
+MODEL_NATIVE_DIR = os.environ.get("MODEL_NATIVE_DIR")
+
+# Inference engine: "pipeline" (sklearn Pipeline as trained),
+# "compiled" (scaler + booster called directly, no pandas) or
+# "numpy" (flattened trees evaluated without xgboost). Non-pipeline
+# engines are parity-checked against the pipeline here at startup.
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "pipeline")
+
+# CASCADE_THRESHOLD=0.8 scores rows with the artifact's small fast_model
+# first and sends only rows less confident than this to the engine above
+# (see cascade.py). Unset: every row goes to the full model.
+CASCADE_THRESHOLD = os.environ.get("CASCADE_THRESHOLD")
+CASCADE_THRESHOLD = float(CASCADE_THRESHOLD) if CASCADE_THRESHOLD else None
+
+# Model versions (see registry.py)
+#   MODEL_WATCH_DIR=...            poll this directory for new artifacts and
+#                                  routing.json; unset disables hot reload
+#   MODEL_WATCH_INTERVAL=5         seconds between polls
+#   MODEL_MAX_VERSIONS=3           versions kept loaded at once
+#   GOLDEN_SET_PATH=golden_inputs.csv
+#   GOLDEN_MIN_ACCURACY=0.95       share of golden rows a new version must
+#                                  get right before it is swapped in
+MODEL_WATCH_DIR = os.environ.get("MODEL_WATCH_DIR")
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", 5))
+MODEL_MAX_VERSIONS = int(os.environ.get("MODEL_MAX_VERSIONS", 3))
+GOLDEN_SET_PATH = os.environ.get("GOLDEN_SET_PATH", "golden_inputs.csv")
+GOLDEN_MIN_ACCURACY = float(os.environ.get("GOLDEN_MIN_ACCURACY", 0.95))
+
+golden_inputs = None
+if os.path.exists(GOLDEN_SET_PATH):
+    golden_inputs = load_golden_set(GOLDEN_SET_PATH, FEATURE_COLUMNS)
+else:
+    app.logger.warning("No golden set at %s; model versions are not validated", GOLDEN_SET_PATH)
+
+
+# --------------------------------------------------
+# Inference threads (see thread_policy.py)
+#   INFERENCE_THREADS=auto        calibrate a policy at startup, or give one
+#                                 such as "1:1,512:2,8192:4"; unset keeps
+#                                 xgboost's default (all cores, every call)
+#   INFERENCE_THREAD_BUDGET=...   most threads per call; default: the cores
+#                                 divided by WEB_CONCURRENCY
+#   CPU_AFFINITY=1                pin each gunicorn worker to its share of
+#                                 the cores (applied in gunicorn.conf.py)
+# --------------------------------------------------
+INFERENCE_THREADS = os.environ.get("INFERENCE_THREADS")
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+INFERENCE_THREAD_BUDGET = int(
+    os.environ.get("INFERENCE_THREAD_BUDGET") or thread_budget(WEB_CONCURRENCY)
+)
+CPU_AFFINITY = os.environ.get("CPU_AFFINITY", "0") == "1"
+
+thread_policy = None            # set once the initial model is loaded
+thread_calibration = None       # "rows/nthread" -> seconds, for INFERENCE_THREADS=auto
+
+
+def configure_thread_policy(predictor):
+    """The ThreadPolicy asked for by INFERENCE_THREADS (calibrated on predictor for "auto")."""
+    global thread_calibration
+    if not INFERENCE_THREADS:
+        return None
+    if not hasattr(predictor, "with_threads"):
+        app.logger.warning(
+            "INFERENCE_THREADS ignored: the %s engine does not use xgboost threads", predictor.name
+        )
+        return None
+    if INFERENCE_THREADS != "auto":
+        return parse_policy(INFERENCE_THREADS)
+
+    with startup.phase("calibrate_threads"):
+        policy, thread_calibration = calibrate(predictor, FEATURE_COLUMNS, INFERENCE_THREAD_BUDGET)
+    app.logger.info(
+        "Calibrated thread policy %s (budget %d threads)", policy, INFERENCE_THREAD_BUDGET
+    )
+    return policy
+
+
+def tune_threads(predictor):
+    """Wrap an engine in the thread policy, if there is one and the engine has threads."""
+    if thread_policy is None or not hasattr(predictor, "with_threads"):
+        return predictor
+    return ThreadTunedPredictor(predictor, thread_policy)
+
+
+def load_model_version(path):
+    """Load a joblib artifact or an exported native directory as a ModelVersion."""
+    predictor, fingerprint = load_artifact(
+        path, INFERENCE_ENGINE, FEATURE_COLUMNS,
+        cascade_threshold=CASCADE_THRESHOLD, logger=app.logger,
+    )
+    predictor = tune_threads(predictor)
+    return ModelVersion(version_name(path), predictor, fingerprint, os.path.abspath(path))
+
+
+def check_golden(version):
+    """Raise ModelValidationError unless the version passes the golden set."""
+    if golden_inputs is not None:
+        X, expected = golden_inputs
+        validate_version(version, X, expected, GOLDEN_MIN_ACCURACY)
+
+
+def load_checked_version(path):
+    version = load_model_version(path)
+    check_golden(version)
+    return version
+
+
+registry = ModelRegistry(MODEL_MAX_VERSIONS, logger=app.logger)
+
+with startup.phase("load_model"):
+    initial_path = MODEL_NATIVE_DIR or MODEL_PATH
+    initial_version = load_model_version(initial_path)
+    try:
+        check_golden(initial_version)
+    except ModelValidationError as e:
+        # Nothing to fall back to at startup: serve it, but say so
+        app.logger.warning("Serving a model that failed validation: %s", e)
+
+thread_policy = configure_thread_policy(initial_version.predictor)
+initial_version.predictor = tune_threads(initial_version.predictor)
+registry.add(initial_version)
+
+watcher = None
+if MODEL_WATCH_DIR:
+    watcher = ArtifactWatcher(
+        MODEL_WATCH_DIR, load_checked_version, registry,
+        interval=MODEL_WATCH_INTERVAL, logger=app.logger,
+    )
+    watcher.mark_loaded(initial_path)
+    with startup.phase("load_versions"):
+        watcher.scan()
+    watcher.start()
+
+
+def resolve_version(requested=None):
+    """
+    Pick the model version for this request: the one asked for by name,
+    else the default or the canary/shadow split. Remembered for the
+    response headers. Raises UnknownVersionError.
+    """
+    version, shadow = registry.route(requested)
+    g.model_version = version
+    return version, shadow
+
+
+def score_rows(version, X):
+    """Uncached model call over a 2D array of rows in FEATURE_COLUMNS order."""
+    indices = version.predictor.predict(X)
+    mark("predict")
+    labels = version.predictor.decode(indices)
+    mark("decode")
+    return labels
+
+
+# --------------------------------------------------
+# Micro-batching for /predict (opt-in)
+#   MICROBATCH=1               enable
+#   MICROBATCH_MAX_SIZE=64     rows per model call
+#   MICROBATCH_MAX_WAIT_MS=2   how long the first row waits for company
+# --------------------------------------------------
+MICROBATCH_ENABLED = os.environ.get("MICROBATCH", "0") == "1"
+MICROBATCH_MAX_SIZE = int(os.environ.get("MICROBATCH_MAX_SIZE", 64))
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get("MICROBATCH_MAX_WAIT_MS", 2.0))
+
+batcher_lock = threading.Lock()
 
-model = artifacts["model"]            # XGBoost pipeline (preprocessor + model)
-label_encoder = artifacts["label_encoder"]
 
-# Features expected by the model
-FEATURE_COLUMNS = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
+def version_batcher(version):
+    """The micro-batcher of a model version (each version batches separately)."""
+    if version.batcher is None:
+        with batcher_lock:
+            if version.batcher is None:
+                version.batcher = MicroBatcher(
+                    version.predictor.predict_labels,
+                    n_features=len(FEATURE_COLUMNS),
+                    max_batch_size=MICROBATCH_MAX_SIZE,
+                    max_wait_ms=MICROBATCH_MAX_WAIT_MS,
+                )
+    return version.batcher
+
+
+def score_rows_batched(version, X):
+    """Hand each row to the micro-batcher (used for single-row requests)."""
+    batcher = version_batcher(version)
+    return [batcher.submit(row) for row in np.asarray(X)]
+
+
+# --------------------------------------------------
+# Prediction cache (opt-in)
+#   PREDICTION_CACHE_SIZE=0        max cached rows, 0 disables
+#   PREDICTION_CACHE_QUANTUM=...   rounding step, e.g. "0.1" or "ph=0.05,N=5"
+# --------------------------------------------------
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 0))
+
+prediction_cache = None
+if PREDICTION_CACHE_SIZE > 0:
+    prediction_cache = PredictionCache(
+        PREDICTION_CACHE_SIZE,
+        parse_quantum(os.environ.get("PREDICTION_CACHE_QUANTUM"), FEATURE_COLUMNS),
+    )
+
+
+def predict_crops(version, X, score=score_rows):
+    """
+    Vectorized prediction over a 2D array of rows in FEATURE_COLUMNS order.
+    Returns an array of crop names, one per row.
+    """
+    if prediction_cache is None:
+        return score(version, X)
+    # Keyed by fingerprint, so versions never share cached predictions
+    return prediction_cache.predict(X, lambda rows: score(version, rows), version.fingerprint)
+
+
+def predict_crop(version, values):
+    """Prediction for one row of feature values."""
+    score = score_rows_batched if MICROBATCH_ENABLED else score_rows
+    return predict_crops(version, [values], score)[0]
+
+
+def predict_top_k(version, X, k):
+    """
+    The k most likely crops per row with their probabilities, best first.
+    Computed from predict_proba over the whole batch (not cached).
+    """
+    predictor = version.predictor
+    proba = predictor.predict_proba(X)
+    mark("predict")
+    result = top_k(proba, predictor.classes, k)
+    mark("decode")
+    return result
+
+
+def prediction_columns(version, X, k=None):
+    """
+    Prediction columns for a batch: recommended_crop, plus
+    top{i}_crop / top{i}_probability for i = 1..k when top-k is requested.
+    """
+    if not k:
+        return {"recommended_crop": predict_crops(version, X)}
+
+    return top_k_columns(*predict_top_k(version, X, k))
+
+
+def parse_top_k(value, version):
+    """Validate a top_k option: None when absent, else an int in [1, n_classes]."""
+    if value is None or value == "":
+        return None
+    try:
+        k = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"top_k must be an integer, got {value!r}")
+    if k < 1:
+        raise ValueError("top_k must be at least 1")
+    return min(k, len(version.predictor.classes))
+
+
+# --------------------------------------------------
+# Row validation (see validation.py)
+#   FEATURE_RANGES=...   physical range overrides, e.g. "ph=3:10,rainfall=0:5000"
+# --------------------------------------------------
+FEATURE_LOW, FEATURE_HIGH = parse_ranges(os.environ.get("FEATURE_RANGES"), FEATURE_COLUMNS)
+
+
+def validate_rows(df):
+    """Coerce and check the feature columns of a batch, column by column."""
+    return validate_frame(df, FEATURE_COLUMNS, FEATURE_LOW, FEATURE_HIGH)
+
+
+def validated_prediction_columns(version, validation, k=None, errors=False):
+    """
+    prediction_columns for the valid rows of a batch, spread back over all
+    rows: invalid rows get no crop (None) and NaN probabilities. With
+    errors, also the "error" column (see contract.output_columns).
+    """
+    scored = None
+    if validation.n_valid:
+        scored = prediction_columns(version, validation.valid_rows(), k)
+    return output_columns(validation, scored, k, errors)
+
+
+def valid_labels(predictions, validation):
+    """recommended_crop of the valid rows only (what shadow scoring compares)."""
+    labels = predictions["recommended_crop"]
+    return labels[validation.valid] if validation.n_invalid else labels
+
+
+# --------------------------------------------------
+# Shadow scoring
+#   SHADOW_MAX_PENDING=64   shadow jobs queued at once; more are dropped
+# --------------------------------------------------
+shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+shadow_slots = threading.BoundedSemaphore(int(os.environ.get("SHADOW_MAX_PENDING", 64)))
+
+
+def shadow_score(shadow, X, labels):
+    """Re-score rows on the shadow version off the request path and count agreement."""
+    if shadow is None or not shadow_slots.acquire(blocking=False):
+        return
+    X = np.array(X, dtype=np.float64)      # own copy; the request may reuse its frame
+    labels = np.asarray(labels)
+
+    def run():
+        try:
+            agreed = int(np.sum(score_rows(shadow, X) == labels))
+            registry.record_shadow(len(X), agreed)
+        except Exception:
+            app.logger.exception("Shadow scoring on %s failed", shadow.name)
+        finally:
+            shadow_slots.release()
+
+    shadow_executor.submit(run)
+
+# Rows per chunk when /batch_predict streams its results
+BATCH_CHUNK_ROWS = int(os.environ.get("BATCH_CHUNK_ROWS", 50000))
+
+# Largest grid /sweep will score in one request (200 x 200 by default)
+MAX_SWEEP_CELLS = int(os.environ.get("MAX_SWEEP_CELLS", 40000))
+
+
+# --------------------------------------------------
+# Warm-up and readiness
+# --------------------------------------------------
+def warm_up():
+    """
+    Run each loaded model once on a small batch so lazy initialisation
+    (xgboost's predictor setup, OpenMP threads, first-touch page faults)
+    happens before traffic does. Bypasses the prediction cache. Called at
+    import and again in each pre-forked worker (see gunicorn.conf.py).
+    """
+    with startup.phase("warm_up"):
+        for version in registry.versions():
+            predictor = version.predictor
+            # Training-set means where the engine knows them, else zeros
+            center = getattr(predictor, "mean", np.zeros(len(FEATURE_COLUMNS)))
+            X = np.tile(center, (8, 1))
+            score_rows(version, X[:1])
+            predictor.predict_proba(X)
+            # A cascade answers rows like these without its full engine
+            full = getattr(predictor, "full", None)
+            if full is not None:
+                full.predict_proba(X)
+    startup.mark_ready()
+    app.logger.info("Model ready after %.2fs: %s", startup.ready_after, startup.phases)
+
+
+warm_up()
+
+
+@app.after_request
+def record_first_request(response):
+    seconds = startup.request_served() if request.path != "/ready" else None
+    if seconds is not None:
+        app.logger.info("First request served %.2fs after process start", seconds)
+    return response
+
+
+@app.after_request
+def add_model_version_headers(response):
+    version = g.get("model_version")
+    if version is not None:
+        response.headers["X-Model-Version"] = version.name
+        response.headers["X-Model-Fingerprint"] = version.fingerprint
+    return response
+
+
+# --------------------------------------------------
+# Request metrics (see metrics.py), served at GET /metrics
+# --------------------------------------------------
+metrics = MetricsRegistry("crop_api")
+
+requests_total = metrics.counter(
+    "requests_total", "HTTP requests by endpoint, method and status.",
+    ("endpoint", "method", "status"),
+)
+errors_total = metrics.counter(
+    "errors_total", "Requests answered with a 4xx or 5xx status.", ("endpoint", "status")
+)
+request_seconds = metrics.histogram(
+    "request_duration_seconds",
+    "Time from request start to response (first byte for streamed responses).",
+    ("endpoint",),
+)
+stage_seconds = metrics.histogram(
+    "stage_duration_seconds",
+    "Time per request (or streamed chunk / job chunk) spent in each stage: "
+    "read, validate, predict, decode, assemble, serialize, respond.",
+    ("endpoint", "stage"),
+)
+rows_total = metrics.counter("rows_scored_total", "Rows scored.", ("endpoint",))
+rows_rejected = metrics.counter(
+    "rows_rejected_total", "Rows not scored because a feature value failed validation.",
+    ("endpoint",),
+)
+batch_rows = metrics.histogram(
+    "batch_rows", "Rows per scored request, streamed chunk or job chunk.", ("endpoint",),
+    buckets=(1, 10, 100, 1000, 10000, 100000, 1000000),
+)
+startup_seconds = metrics.gauge(
+    "startup_seconds", "Startup timings of this process (see GET /ready).", ("phase",)
+)
+
+
+def endpoint_label():
+    # The URL rule, not the path, so ids in URLs do not create new series
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def record_batch(endpoint, n_rows, n_invalid=0):
+    rows_total.inc(endpoint, amount=n_rows)
+    batch_rows.observe(n_rows, endpoint)
+    if n_invalid:
+        rows_rejected.inc(endpoint, amount=n_invalid)
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    start_stages(stage_seconds, endpoint_label())
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Whatever follows the last marked stage (jsonify, headers) is "respond"
+    finish_stages(last_stage="respond")
+    endpoint = endpoint_label()
+    status = str(response.status_code)
+    requests_total.inc(endpoint, request.method, status)
+    if response.status_code >= 400:
+        errors_total.inc(endpoint, status)
+    started = g.get("request_started")
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, endpoint)
+    return response
+
+
+# --------------------------------------------------
+# Request profiling (see profiling.py), listed at GET /admin/profiles
+# --------------------------------------------------
+request_profiler = RequestProfiler(
+    ProfileStore(
+        os.environ.get("PROFILE_DIR", "profiles"),
+        keep=int(os.environ.get("PROFILE_KEEP", 50)),
+    ),
+    token=os.environ.get("PROFILE_TOKEN"),
+    sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+    mode=os.environ.get("PROFILE_MODE", "cprofile"),
+    interval=float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 5)) / 1000,
+)
+
+
+def profiled(view):
+    """Profile requests to view that send the admin token or are sampled."""
+    if not request_profiler.enabled:
+        return view             # profiling off: nothing added to the request path
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        profile = request_profiler.start(request.headers.get("X-Profile-Token"))
+        if profile is None:
+            return view(*args, **kwargs)
+
+        meta = {
+            "request_id": request_id(request.headers.get("X-Request-ID")),
+            "endpoint": endpoint_label(),
+            "method": request.method,
+            "query": request.query_string.decode("latin-1"),
+            "content_length": request.content_length,
+            "started_at": time.time(),
+        }
+        started = time.perf_counter()
+
+        def finish(status, version):
+            meta["status"] = status
+            meta["model_version"] = version.name if version is not None else None
+            meta["duration_seconds"] = round(time.perf_counter() - started, 6)
+            try:
+                request_profiler.finish(profile, meta)
+            except OSError as e:
+                app.logger.warning("Could not save profile %s: %s", meta["request_id"], e)
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            finish(500, g.get("model_version"))
+            raise
+
+        response.headers["X-Profile-Id"] = meta["request_id"]
+        if response.is_streamed:
+            # Keep profiling while the body is produced; saved when it ends
+            profile.disable()
+            status, version = response.status_code, g.get("model_version")
+            response.response = ProfiledChunks(
+                response.response, profile, lambda: finish(status, version)
+            )
+        else:
+            finish(response.status_code, g.get("model_version"))
+        return response
+
+    return wrapper
 
 
 # --------------------------------------------------
@@ -33,6 +580,7 @@ def home():
 # 4. Single prediction endpoint (JSON)
 # --------------------------------------------------
 @app.route("/predict", methods=["GET","POST"])
+@profiled
 def predict_single():
     if request.method == "GET":
         return "Use POST with JSON body to get predictions.", 200
@@ -49,10 +597,19 @@ def predict_single():
         "ph": 6.5,
         "rainfall": 120.0
     }
+
+    An optional "top_k" field (or ?top_k= query parameter) adds the k most
+    likely crops with their probabilities to the response. An optional
+    "model_version" field (or query parameter) picks a loaded model
+    version; the response names the version that served it.
+
+    Values must be numbers (or numeric strings) within the physical range
+    of each feature; otherwise the response is a 400 naming the fields.
     """
 
     try:
         data = request.get_json()
+        mark("read")
 
         if data is None:
             return jsonify({"error": "Request body must be JSON"}), 400
@@ -65,17 +622,53 @@ def predict_single():
                 "missing_fields": missing
             }), 400
 
-        # Build input DataFrame in correct feature order
-        values = [[data[col] for col in FEATURE_COLUMNS]]
-        input_df = pd.DataFrame(values, columns=FEATURE_COLUMNS)
+        try:
+            version, shadow = resolve_version(
+                data.get("model_version", request.args.get("model_version"))
+            )
+        except UnknownVersionError as e:
+            return jsonify({"error": str(e)}), 404
+
+        try:
+            k = parse_top_k(data.get("top_k", request.args.get("top_k")), version)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Build input row in correct feature order
+        validation = validate_values(
+            [data[col] for col in FEATURE_COLUMNS], FEATURE_COLUMNS, FEATURE_LOW, FEATURE_HIGH
+        )
+        if validation.n_invalid:
+            record_batch("/predict", 0, 1)
+            return jsonify({
+                "error": "Invalid feature values",
+                "invalid_fields": validation.row_errors()[0]["errors"]
+            }), 400
+        values = validation.X[0].tolist()
+        mark("validate")
+        record_batch("/predict", 1)
+
+        if not k:
+            crop_name = predict_crop(version, values)
+            mark("predict")         # cache lookup or micro-batch wait, if any
+            shadow_score(shadow, [values], [crop_name])
 
-        # Predict (encoded)
-        encoded_pred = model.predict(input_df)
-        crop_name = label_encoder.inverse_transform(encoded_pred)[0]
+            return jsonify({
+                "input": data,
+                "recommended_crop": crop_name,
+                "model_version": version.name
+            })
 
+        labels, probabilities = predict_top_k(version, [values], k)
+        shadow_score(shadow, [values], labels[:, 0])
         return jsonify({
             "input": data,
-            "recommended_crop": crop_name
+            "recommended_crop": labels[0, 0],
+            "model_version": version.name,
+            "top_k": [
+                {"crop": crop, "probability": float(p)}
+                for crop, p in zip(labels[0], probabilities[0])
+            ]
         })
 
     except Exception as e:
@@ -86,14 +679,46 @@ def predict_single():
 # 5. Batch prediction endpoint (CSV upload)
 # --------------------------------------------------
 @app.route("/batch_predict", methods=["POST"])
+@profiled
 def batch_predict():
     """
-    Batch crop recommendation via CSV upload.
+    Batch crop recommendation via file upload.
 
     Expects a form-data request with a file field called 'file'.
 
-    The CSV must contain the following columns:
+    The file must contain the following columns:
     N, P, K, temperature, humidity, ph, rainfall
+
+    CSV, Parquet and Arrow IPC files are matched by column name. A .npy
+    upload is a 2D numeric matrix with the columns in that order. The
+    format comes from the file's content type, extension or magic bytes.
+
+    Options (query string or form field):
+      format=records|columnar|csv|arrow|parquet
+                      response encoding; without it the Accept header
+                      decides (application/json, text/csv,
+                      application/vnd.apache.arrow.stream,
+                      application/vnd.apache.parquet), default records
+      include_inputs=false
+                      return only the prediction columns
+      top_k=<k>       add top{i}_crop / top{i}_probability columns for
+                      the k most likely crops
+      stream=csv|ndjson
+                      read the file in chunks and stream the scored rows
+                      back as they are ready
+      model_version=<name>
+                      score with a specific loaded model version
+      partial=false   reject the whole batch (400) if any row is invalid
+
+    Every value is checked (numeric, not NaN/inf, within the feature's
+    physical range). Valid rows are scored; invalid rows are returned with
+    an empty recommended_crop and an "error" column naming the failed
+    fields, e.g. "ph: not_a_number; rainfall: missing". The "error" column
+    is only added when a row failed, and X-Invalid-Rows counts them. A
+    batch without any valid row is rejected with a 400 report.
+
+    The version that served the batch is named in the X-Model-Version
+    response header.
     """
 
     try:
@@ -109,26 +734,243 @@ def batch_predict():
         if file.filename == "":
             return jsonify({"error": "No file selected."}), 400
 
-        # 3. Read CSV into DataFrame
-        df = pd.read_csv(file)
+        try:
+            version, shadow = resolve_version(request_param("model_version"))
+        except UnknownVersionError as e:
+            return jsonify({"error": str(e)}), 404
+
+        input_format = detect_input_format(file.stream, file.mimetype, file.filename)
+        include_inputs = parse_flag(request_param("include_inputs"))
+        try:
+            k = parse_top_k(request_param("top_k"), version)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        stream_format = request_param("stream")
+        if stream_format:
+            return stream_batch_predict(
+                version, file, input_format, stream_format, include_inputs, k
+            )
+
+        result_format = negotiate_result_format(
+            request_param("format"), request.accept_mimetypes
+        )
+        if result_format is None:
+            return jsonify({
+                "error": f"Unknown format '{request_param('format')}'.",
+                "supported_formats": list(RESULT_FORMATS)
+            }), 400
+
+        # 3. Read upload into DataFrame
+        df = read_frame(file.stream, input_format, FEATURE_COLUMNS)
+        mark("read")
 
         # 4. Validate required columns
         missing_cols = [col for col in FEATURE_COLUMNS if col not in df.columns]
         if missing_cols:
             return jsonify({
-                "error": "Missing required columns in CSV.",
+                "error": "Missing required columns in uploaded file.",
                 "missing_columns": missing_cols
             }), 400
 
-        # 5. Predict using the model
-        encoded_preds = model.predict(df[FEATURE_COLUMNS])
-        crop_names = label_encoder.inverse_transform(encoded_preds)
+        # 5. Validate every value; invalid rows are reported, not scored
+        validation = validate_rows(df)
+        if validation.n_invalid and (
+            not validation.n_valid or not parse_flag(request_param("partial"))
+        ):
+            report = validation.report()
+            report["error"] = "Invalid values in uploaded file."
+            return jsonify(report), 400
+        mark("validate")
+
+        # 6. Predict the valid rows using the model
+        record_batch("/batch_predict", validation.n_valid, validation.n_invalid)
+        predictions = validated_prediction_columns(version, validation, k,
+                                                   errors=bool(validation.n_invalid))
+        mark("predict")
+        shadow_score(shadow, validation.valid_rows(), valid_labels(predictions, validation))
+
+        # 7. Add predictions to DataFrame (or return them on their own)
+        df = attach_predictions(df, predictions, include_inputs, validation)
+        mark("assemble")
+
+        # 8. Encode the response
+        headers = {"X-Invalid-Rows": str(validation.n_invalid)}
+        if validation.n_invalid and result_format in ("records", "columnar"):
+            # NaN is not valid JSON: unscored and missing values become null
+            df = df.astype(object).where(df.notna(), None)
+        if result_format == "records":
+            result = df.to_dict(orient="records")
+            mark("serialize")
+            return jsonify(result), 200, headers
+
+        body, mimetype = encode_result(df, result_format)
+        mark("serialize")
+        return Response(body, mimetype=mimetype, headers=headers), 200
+
+    except InputFormatError as e:
+        return jsonify({"error": str(e), "input_format": input_format}), 400
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def request_param(name):
+    """Read an option from the query string, falling back to form fields."""
+    return request.args.get(name) or request.form.get(name)
+
+
+def attach_predictions(df, predictions, include_inputs, validation):
+    """
+    Append prediction columns to the inputs, or return them on their own.
+    Feature columns read as text (one unparseable cell turns a whole CSV or
+    JSON column into strings) are echoed as the validated numbers; the
+    error column names the cells that did not parse.
+    """
+    if not include_inputs:
+        import pandas as pd
+        return pd.DataFrame(predictions)
+    for j, col in enumerate(FEATURE_COLUMNS):
+        if df[col].dtype.kind not in "iuf":
+            df[col] = validation.X[:, j]
+    for name, values in predictions.items():
+        df[name] = values
+    return df
+
+
+def stream_batch_predict(version, file, input_format, stream_format, include_inputs=True, k=None):
+    """
+    Chunked variant of /batch_predict: parse, score and send chunks one at
+    a time so memory use does not grow with the size of the upload. The
+    whole stream is scored by the version picked at the start, even if the
+    default changes meanwhile.
+
+    Invalid rows cannot reject a stream whose headers are already sent, so
+    they are passed through unscored; since later chunks are not known in
+    advance, the "error" column is always present (empty for valid rows).
+    """
+    if stream_format not in STREAM_FORMATS:
+        return jsonify({
+            "error": f"Unknown stream format '{stream_format}'.",
+            "supported_formats": list(STREAM_FORMATS)
+        }), 400
+
+    upload = detach_upload(file)
+    try:
+        chunks = read_chunks(upload, input_format, BATCH_CHUNK_ROWS, FEATURE_COLUMNS)
+        first_chunk = next(chunks, None)
+    except InputFormatError:
+        upload.close()
+        raise
+    mark("read")
+
+    # Validate before the 200 status line is sent
+    if first_chunk is None:
+        upload.close()
+        return jsonify({"error": "Uploaded file has no rows."}), 400
+
+    missing_cols = [col for col in FEATURE_COLUMNS if col not in first_chunk.columns]
+    if missing_cols:
+        upload.close()
+        return jsonify({
+            "error": "Missing required columns in uploaded file.",
+            "missing_columns": missing_cols
+        }), 400
+
+    def generate():
+        chunk = first_chunk
+        first = True
+        try:
+            while chunk is not None:
+                # Stages are recorded per chunk; reading the next chunk
+                # is timed at the end of the previous one
+                with stages(stage_seconds, "/batch_predict"):
+                    validation = validate_rows(chunk)
+                    mark("validate")
+                    record_batch("/batch_predict", validation.n_valid, validation.n_invalid)
+                    predictions = validated_prediction_columns(version, validation, k, errors=True)
+                    chunk = attach_predictions(chunk, predictions, include_inputs, validation)
+                    mark("assemble")
+                    encoded = encode_chunk(chunk, stream_format, first)
+                    mark("serialize")
+                yield encoded
+                first = False
+                with stages(stage_seconds, "/batch_predict"):
+                    chunk = next(chunks, None)
+                    mark("read")
+        except Exception as e:
+            # Headers are already sent; report the failure in-band and stop
+            app.logger.exception("Streaming batch prediction failed")
+            if stream_format == "ndjson":
+                yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            upload.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=STREAM_FORMATS[stream_format],
+    )
+
+
+# --------------------------------------------------
+# 6. What-if sweep endpoint (JSON)
+# --------------------------------------------------
+@app.post("/sweep")
+def sweep():
+    """
+    Vary one or two features around a base input and score the full grid.
+
+    Expects JSON like:
+    {
+        "base": {"N": 50, "P": 40, "K": 40, "temperature": 25.0,
+                 "humidity": 80.0, "ph": 6.5, "rainfall": 120.0},
+        "vary": [
+            {"feature": "rainfall", "start": 0.8, "stop": 1.2, "steps": 41,
+             "relative": true},
+            {"feature": "temperature", "values": [20, 25, 30]}
+        ],
+        "include_probabilities": false
+    }
+
+    Returns the axis values, the crops that appear, and a grid of indices
+    into that crop list (axis 0 = first varied feature). An optional
+    "model_version" picks a loaded model version.
+    """
+    try:
+        data = request.get_json()
+
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
 
-        # 6. Add predictions to DataFrame
-        df["recommended_crop"] = crop_names
+        try:
+            version, _ = resolve_version(data.get("model_version"))
+        except UnknownVersionError as e:
+            return jsonify({"error": str(e)}), 404
 
-        # 7. Convert to list of dicts for JSON response
-        result = df.to_dict(orient="records")
+        try:
+            X, axis_values = build_grid(
+                data.get("base") or {}, data.get("vary"), FEATURE_COLUMNS, MAX_SWEEP_CELLS
+            )
+        except (SweepError, TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        mark("validate")
+        record_batch("/sweep", len(X))
+
+        proba = version.predictor.predict_proba(X)
+        mark("predict")
+        shape = tuple(len(values) for values in axis_values)
+        result = decision_map(
+            proba, version.predictor.classes, shape,
+            include_probabilities=bool(data.get("include_probabilities")),
+        )
+        mark("decode")
+
+        result["axes"] = [
+            {"feature": axis["feature"], "values": values.tolist()}
+            for axis, values in zip(data["vary"], axis_values)
+        ]
+        result["base"] = data["base"]
+        result["model_version"] = version.name
         return jsonify(result), 200
 
     except Exception as e:
@@ -136,7 +978,301 @@ def batch_predict():
 
 
 # --------------------------------------------------
-# 6. Run app locally (for development)
+# 7. Asynchronous batch jobs (see jobs.py)
+#   JOB_DIR=batch_jobs          where uploads and results are spooled
+#   JOB_WORKERS=2               jobs processed at once per server process
+#   JOB_CHUNK_ROWS=50000        rows scored (and checkpointed) per step
+#   JOB_RETENTION_HOURS=24      finished jobs are removed after this long
+# --------------------------------------------------
+JOB_DIR = os.environ.get("JOB_DIR", "batch_jobs")
+JOB_CHUNK_ROWS = int(os.environ.get("JOB_CHUNK_ROWS", 50000))
+
+
+def check_job_input(path, options):
+    """Reject unreadable uploads or missing columns before a job is queued."""
+    with open(path, "rb") as f:
+        options["input_format"] = detect_input_format(
+            f, options.pop("mimetype"), options["filename"]
+        )
+        options["rows_total"] = count_rows(f, options["input_format"])
+        first_chunk = next(read_chunks(f, options["input_format"], 1, FEATURE_COLUMNS), None)
+
+    if first_chunk is None:
+        raise InputFormatError("Uploaded file has no rows.")
+    missing_cols = [col for col in FEATURE_COLUMNS if col not in first_chunk.columns]
+    if missing_cols:
+        raise InputFormatError(
+            f"Missing required columns in uploaded file: {', '.join(missing_cols)}"
+        )
+
+
+def read_job_chunks(stream, job):
+    return read_chunks(stream, job["input_format"], job["chunk_rows"], FEATURE_COLUMNS)
+
+
+def score_job_chunk(chunk, job, first):
+    # A resumed job must be finished by the model that started it
+    version = registry.get(job["model_version"])
+    if version.fingerprint != job["model_fingerprint"]:
+        raise RuntimeError(
+            f"Model version {version.name} was replaced while the job was running"
+        )
+    with stages(stage_seconds, "/jobs"):
+        # Like a streamed batch: invalid rows are kept, unscored, with an error
+        validation = validate_rows(chunk)
+        mark("validate")
+        record_batch("/jobs", validation.n_valid, validation.n_invalid)
+        predictions = validated_prediction_columns(version, validation, job["top_k"], errors=True)
+        chunk = attach_predictions(chunk, predictions, job["include_inputs"], validation)
+        mark("assemble")
+        encoded = encode_chunk(chunk, job["format"], first)
+        mark("serialize")
+    return encoded
+
+
+job_queue = JobQueue(
+    JOB_DIR,
+    read_job_chunks,
+    score_job_chunk,
+    max_workers=int(os.environ.get("JOB_WORKERS", 2)),
+    retention=float(os.environ.get("JOB_RETENTION_HOURS", 24)) * 3600,
+    logger=app.logger,
+)
+
+
+@app.before_request
+def start_job_queue():
+    # Cheap after the first call; also called per worker from gunicorn.conf.py
+    job_queue.start()
+
+
+@app.post("/jobs")
+def submit_job():
+    """
+    Queue a batch prediction and return at once with a job id.
+
+    Takes the same upload and options as /batch_predict (file, include_inputs,
+    top_k, model_version), plus format=csv|ndjson for the result file.
+    Poll GET /jobs/<job_id> and fetch GET /jobs/<job_id>/result when done.
+    """
+    if "file" not in request.files:
+        return jsonify({
+            "error": "No file part in the request. Please upload a CSV with key 'file'."
+        }), 400
+
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "No file selected."}), 400
+
+    result_format = request_param("format") or "csv"
+    if result_format not in STREAM_FORMATS:
+        return jsonify({
+            "error": f"Unknown format '{result_format}'.",
+            "supported_formats": list(STREAM_FORMATS)
+        }), 400
+
+    try:
+        # Named versions only: the canary split is for interactive traffic
+        name = request_param("model_version")
+        version = registry.get(name) if name else registry.default
+    except UnknownVersionError as e:
+        return jsonify({"error": str(e)}), 404
+    g.model_version = version
+
+    try:
+        k = parse_top_k(request_param("top_k"), version)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    options = {
+        "filename": file.filename,
+        "mimetype": file.mimetype,
+        "format": result_format,
+        "include_inputs": parse_flag(request_param("include_inputs")),
+        "top_k": k,
+        "chunk_rows": JOB_CHUNK_ROWS,
+        "model_version": version.name,
+        "model_fingerprint": version.fingerprint,
+    }
+    try:
+        job = job_queue.submit(file, options, check=check_job_input)
+    except InputFormatError as e:
+        return jsonify({"error": str(e)}), 400
+
+    status = job_status_body(job_queue.status(job["job_id"]))
+    return jsonify(status), 202, {"Location": status["status_url"]}
+
+
+def job_status_body(job):
+    job["status_url"] = f"/jobs/{job['job_id']}"
+    job["result_url"] = f"/jobs/{job['job_id']}/result" if job["state"] == "done" else None
+    return job
+
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    """State (queued, running, done, failed) and progress of a batch job."""
+    try:
+        return jsonify(job_status_body(job_queue.status(job_id))), 200
+    except UnknownJobError:
+        return jsonify({"error": f"Unknown job '{job_id}'."}), 404
+
+
+@app.get("/jobs/<job_id>/result")
+def job_result(job_id):
+    """Download the scored file of a finished job (supports Range requests)."""
+    try:
+        path = job_queue.result_path(job_id)
+        job = job_queue.status(job_id)
+    except UnknownJobError:
+        return jsonify({"error": f"Unknown job '{job_id}'."}), 404
+    except JobNotReadyError as e:
+        return jsonify({"error": str(e)}), 409
+
+    return send_file(
+        path,
+        mimetype=STREAM_FORMATS[job["format"]],
+        as_attachment=True,
+        download_name=f"{os.path.splitext(job['filename'])[0]}_predictions.{job['format']}",
+        conditional=True,
+    )
+
+
+@app.delete("/jobs/<job_id>")
+def delete_job(job_id):
+    """Cancel a job (before its next chunk) and remove its files."""
+    try:
+        job_queue.delete(job_id)
+    except UnknownJobError:
+        return jsonify({"error": f"Unknown job '{job_id}'."}), 404
+    return jsonify({"job_id": job_id, "deleted": True}), 200
+
+
+# --------------------------------------------------
+# 8. Readiness, model versions, micro-batcher, cache and memory statistics,
+#    request profiles
+# --------------------------------------------------
+@app.get("/ready")
+def ready():
+    """503 until the model is loaded and warmed up, then 200 with startup timings."""
+    summary = startup.summary()
+    summary["model_version"] = registry.default.name
+    summary["model_fingerprint"] = registry.default.fingerprint
+    summary["inference_engine"] = registry.default.predictor.name
+    summary["inference_threads"] = {
+        "policy": thread_policy.describe() if thread_policy is not None else None,
+        "budget": INFERENCE_THREAD_BUDGET,
+        "cpus": available_cpus(),
+        "calibration": thread_calibration,
+    }
+    return jsonify(summary), 200 if summary["ready"] else 503
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Request, stage, row and startup metrics in the Prometheus text format."""
+    for phase, seconds in startup.phases.items():
+        startup_seconds.set(seconds, phase)
+    if startup.ready_after is not None:
+        startup_seconds.set(startup.ready_after, "ready")
+    if startup.first_request_after is not None:
+        startup_seconds.set(startup.first_request_after, "first_request")
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.get("/models")
+def models():
+    """Loaded model versions, the default, and the canary/shadow split."""
+    result = registry.describe()
+    result["watch_dir"] = MODEL_WATCH_DIR
+    return jsonify(result), 200
+
+
+@app.get("/batcher/stats")
+def batcher_stats():
+    """How full the /predict micro-batches have been (?model_version=, default: the default)."""
+    name = request.args.get("model_version")
+    try:
+        version = registry.get(name) if name else registry.default
+    except UnknownVersionError as e:
+        return jsonify({"error": str(e)}), 404
+    stats = version_batcher(version).stats()
+    stats["enabled"] = MICROBATCH_ENABLED
+    stats["model_version"] = version.name
+    return jsonify(stats), 200
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Prediction cache hit/miss counters (shared by all model versions)."""
+    if prediction_cache is None:
+        return jsonify({"enabled": False}), 200
+    stats = prediction_cache.stats()
+    stats["enabled"] = True
+    stats["model_fingerprint"] = registry.default.fingerprint
+    return jsonify(stats), 200
+
+
+@app.get("/memory")
+def memory_stats():
+    """RSS / PSS / shared / private memory of the worker serving this request."""
+    stats = process_memory()
+    stats["pid"] = os.getpid()
+    return jsonify(stats), 200
+
+
+def profiles_denied():
+    """Error response for the admin profile routes, or None if the token is valid."""
+    if request_profiler.token is None:
+        return jsonify({"error": "Profile access is disabled; set PROFILE_TOKEN."}), 404
+    if not request_profiler.authorized(request.headers.get("X-Profile-Token")):
+        return jsonify({"error": "Missing or wrong X-Profile-Token."}), 403
+    return None
+
+
+@app.get("/admin/profiles")
+def list_profiles():
+    """Recently saved request profiles, newest first (see profiling.py)."""
+    denied = profiles_denied()
+    if denied is not None:
+        return denied
+    return jsonify({
+        "enabled": request_profiler.enabled,
+        "mode": request_profiler.mode,
+        "sample_rate": request_profiler.sample_rate,
+        "profiles": request_profiler.store.list(),
+    }), 200
+
+
+@app.get("/admin/profiles/<profile_id>")
+def get_profile(profile_id):
+    """
+    Download one profile: the raw .prof (cprofile) or collapsed stacks
+    (sample). ?format=text returns a readable pstats report instead,
+    sorted by ?sort= (default cumulative) and cut to ?limit= rows.
+    """
+    denied = profiles_denied()
+    if denied is not None:
+        return denied
+    store = request_profiler.store
+    try:
+        if request.args.get("format") == "text":
+            report = store.text(
+                profile_id,
+                sort=request.args.get("sort", "cumulative"),
+                limit=int(request.args.get("limit", 40)),
+            )
+            return Response(report, mimetype="text/plain"), 200
+        path, mode = store.path(profile_id)
+    except UnknownProfileError:
+        return jsonify({"error": f"Unknown profile '{profile_id}'."}), 404
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"Invalid sort or limit: {e}"}), 400
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+
+# --------------------------------------------------
+# 9. Run app locally (for development)
 # --------------------------------------------------
 if __name__ == "__main__":
      
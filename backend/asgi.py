@@ -0,0 +1,178 @@
+"""
+ASGI serving mode for the Flask app.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+    python asgi.py
+
+Connections are handled by the asyncio event loop: request bodies are read
+without blocking (spooled to disk past ASGI_SPOOL_BYTES), so idle or slow
+clients cost no thread. Only once a request is complete is it dispatched
+to the same Flask routes in a bounded thread pool of ASGI_WORKER_THREADS.
+The response is written back through the event loop, so streamed
+responses keep working.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app as flask_app
+
+ASGI_WORKER_THREADS = int(
+    os.environ.get("ASGI_WORKER_THREADS", min(32, (os.cpu_count() or 1) + 4))
+)
+ASGI_SPOOL_BYTES = int(os.environ.get("ASGI_SPOOL_BYTES", 1 << 20))
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class AsyncWSGIAdapter:
+    def __init__(self, wsgi_app, max_threads, spool_bytes):
+        self.wsgi_app = wsgi_app
+        self.spool_bytes = spool_bytes
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_threads, thread_name_prefix="asgi-worker"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise NotImplementedError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    # --------------------------------------------------
+    # Lifespan
+    # --------------------------------------------------
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # --------------------------------------------------
+    # HTTP
+    # --------------------------------------------------
+    async def _read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                raise ClientDisconnected()
+            body.write(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        size = body.tell()
+        body.seek(0)
+        return body, size
+
+    async def _http(self, scope, receive, send):
+        try:
+            body, size = await self._read_body(receive)
+        except ClientDisconnected:
+            return
+
+        loop = asyncio.get_running_loop()
+
+        def send_sync(message):
+            # Called from the worker thread; blocks it on client backpressure
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        try:
+            await loop.run_in_executor(
+                self.executor, self._run_wsgi, build_environ(scope, body, size), send_sync
+            )
+        finally:
+            body.close()
+
+    def _run_wsgi(self, environ, send_sync):
+        # The whole WSGI call, including iterating a streamed body, stays on
+        # one thread: Flask's stream_with_context must enter and exit its
+        # context in the same thread.
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers
+            ]
+
+        def send_start():
+            if "started" not in response:
+                response["started"] = True
+                send_sync({
+                    "type": "http.response.start",
+                    "status": response["status"],
+                    "headers": response["headers"],
+                })
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                if chunk:
+                    send_start()
+                    send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+            send_start()
+            send_sync({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+
+def build_environ(scope, body, size):
+    """Translate an ASGI HTTP scope into a PEP 3333 environ."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(size),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,      # body is fully buffered
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue            # already set from the bytes actually received
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+app = AsyncWSGIAdapter(flask_app, ASGI_WORKER_THREADS, ASGI_SPOOL_BYTES)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.environ.get("PORT", 8000))
+    uvicorn.run(app, host="0.0.0.0", port=port)
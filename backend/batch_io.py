@@ -0,0 +1,329 @@
+"""
+Reading and writing batch prediction data.
+
+Streaming mode reads an uploaded CSV in fixed-size chunks and encodes each
+scored chunk as soon as it is ready, so memory stays bounded by the chunk
+size instead of the file size.
+
+Uploads can be CSV, Parquet, Arrow IPC (stream or file) or a raw .npy
+matrix whose columns are in FEATURE_COLUMNS order. The format is taken from
+the part's content type, then the file extension, then the leading magic
+bytes, and CSV is assumed otherwise.
+
+Whole-batch results can be returned as row records (the default), columnar
+JSON, CSV, Arrow IPC or Parquet. Arrow and Parquet need pyarrow, which is
+imported only when one of them is requested. pandas is likewise imported on
+the first batch rather than at startup.
+"""
+import io
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+# Streaming output formats -> response mimetype
+STREAM_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# Whole-batch result formats -> response mimetype
+RESULT_FORMATS = {
+    "records": "application/json",
+    "columnar": "application/json",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Accept header mimetypes -> result format (first entry wins on */*)
+ACCEPT_FORMATS = {
+    "application/json": "records",
+    "text/csv": "csv",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.parquet": "parquet",
+}
+
+
+def negotiate_result_format(requested, accept_mimetypes):
+    """
+    Pick the result format: an explicit ``format`` parameter wins, then the
+    best match from the Accept header, then row records.
+    Returns None for an unknown explicit format.
+    """
+    if requested:
+        return requested if requested in RESULT_FORMATS else None
+
+    best = accept_mimetypes.best_match(list(ACCEPT_FORMATS), default="application/json")
+    return ACCEPT_FORMATS[best]
+
+
+def parse_flag(value, default=True):
+    """Interpret a query/form flag such as include_inputs=false."""
+    if value is None or value == "":
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+def _arrow_table(df):
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise RuntimeError("Arrow and Parquet output require the pyarrow package") from e
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def encode_result(df, fmt):
+    """
+    Encode a scored DataFrame in one of the non-record RESULT_FORMATS.
+    Returns (body, mimetype).
+    """
+    if fmt == "columnar":
+        # One list per column instead of repeating every key on every row
+        body = json.dumps({col: df[col].tolist() for col in df.columns})
+    elif fmt == "csv":
+        body = df.to_csv(index=False)
+    elif fmt == "arrow":
+        import pyarrow as pa
+
+        table = _arrow_table(df)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        body = sink.getvalue().to_pybytes()
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        table = _arrow_table(df)
+        sink = io.BytesIO()
+        pq.write_table(table, sink)
+        body = sink.getvalue()
+    else:
+        raise ValueError(f"Unknown result format {fmt!r}")
+
+    return body, RESULT_FORMATS[fmt]
+
+
+def detach_upload(file):
+    """
+    Take ownership of an uploaded file's stream. Werkzeug closes request
+    files on teardown, which happens before a streamed response has been
+    fully sent; the caller is responsible for closing the returned stream.
+    """
+    stream = file.stream
+    file.stream = io.BytesIO()
+    return stream
+
+
+class InputFormatError(ValueError):
+    """The uploaded file cannot be read as a feature table."""
+
+
+# --------------------------------------------------
+# Input format detection
+# --------------------------------------------------
+INPUT_FORMATS = ("csv", "parquet", "arrow", "npy")
+
+_INPUT_MIMETYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+    "application/x-npy": "npy",
+}
+
+_INPUT_EXTENSIONS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".arrows": "arrow",
+    ".feather": "arrow",
+    ".npy": "npy",
+}
+
+_ARROW_FILE_MAGIC = b"ARROW1"
+
+_INPUT_MAGIC = (
+    (b"PAR1", "parquet"),
+    (b"\x93NUMPY", "npy"),
+    (_ARROW_FILE_MAGIC, "arrow"),
+    (b"\xff\xff\xff\xff", "arrow"),     # IPC stream continuation marker
+)
+
+
+def _peek(stream, n):
+    head = stream.read(n)
+    stream.seek(0)
+    return head
+
+
+def detect_input_format(stream, mimetype=None, filename=None):
+    """Guess the upload format from content type, extension, then magic bytes."""
+    if mimetype in _INPUT_MIMETYPES:
+        return _INPUT_MIMETYPES[mimetype]
+
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension in _INPUT_EXTENSIONS:
+        return _INPUT_EXTENSIONS[extension]
+
+    head = _peek(stream, 8)
+    for magic, fmt in _INPUT_MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return "csv"
+
+
+# --------------------------------------------------
+# Readers
+# --------------------------------------------------
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet  # noqa: F401  (registers pa.parquet)
+    except ImportError as e:
+        raise InputFormatError("Parquet and Arrow input require the pyarrow package") from e
+    return pa
+
+
+@contextmanager
+def _arrow_errors(fmt):
+    """Re-raise pyarrow's errors on a corrupt or truncated upload as InputFormatError."""
+    pa = _import_pyarrow()
+    try:
+        yield pa
+    except InputFormatError:
+        raise
+    except (pa.ArrowException, ValueError, OSError) as e:
+        raise InputFormatError(f"Invalid {fmt} upload: {e}") from e
+
+
+def _checked(batches, fmt):
+    """Iterate over pyarrow batches, with read errors reported as InputFormatError."""
+    with _arrow_errors(fmt):
+        yield from batches
+
+
+def _arrow_reader(stream):
+    with _arrow_errors("arrow") as pa:
+        if _peek(stream, len(_ARROW_FILE_MAGIC)) == _ARROW_FILE_MAGIC:
+            return pa.ipc.open_file(stream)
+        return pa.ipc.open_stream(stream)
+
+
+def _arrow_batches(reader):
+    if hasattr(reader, "num_record_batches"):          # IPC file format
+        return (reader.get_batch(i) for i in range(reader.num_record_batches))
+    return iter(reader)                                  # IPC stream format
+
+
+def _load_npy(stream, feature_columns):
+    try:
+        matrix = np.load(stream, allow_pickle=False)
+    except ValueError as e:
+        raise InputFormatError(f"Invalid .npy upload: {e}") from e
+
+    if matrix.ndim != 2 or matrix.shape[1] != len(feature_columns):
+        raise InputFormatError(
+            f".npy upload must be a 2D matrix with {len(feature_columns)} columns "
+            f"({', '.join(feature_columns)}), got shape {matrix.shape}"
+        )
+    if matrix.dtype.kind not in "fiu":
+        raise InputFormatError(f".npy upload must be numeric, got dtype {matrix.dtype}")
+    return matrix
+
+
+def _npy_frame(matrix, feature_columns):
+    import pandas as pd
+
+    # Wrap the matrix without copying it
+    return pd.DataFrame(matrix, columns=feature_columns, copy=False)
+
+
+def read_frame(stream, fmt, feature_columns):
+    """Read a whole upload into a DataFrame."""
+    if fmt == "csv":
+        import pandas as pd
+        return pd.read_csv(stream)
+    if fmt == "parquet":
+        with _arrow_errors(fmt) as pa:
+            table = pa.parquet.read_table(stream)
+        return table.to_pandas()
+    if fmt == "arrow":
+        reader = _arrow_reader(stream)
+        with _arrow_errors(fmt):
+            table = reader.read_all()
+        return table.to_pandas()
+    if fmt == "npy":
+        return _npy_frame(_load_npy(stream, feature_columns), feature_columns)
+    raise InputFormatError(f"Unknown input format {fmt!r}")
+
+
+def read_chunks(stream, fmt, chunk_rows, feature_columns):
+    """Iterate over an upload as DataFrames of at most chunk_rows rows."""
+    if fmt == "csv":
+        import pandas as pd
+        return pd.read_csv(stream, chunksize=chunk_rows)
+    if fmt == "parquet":
+        with _arrow_errors(fmt) as pa:
+            batches = pa.parquet.ParquetFile(stream).iter_batches(batch_size=chunk_rows)
+        return (batch.to_pandas() for batch in _checked(batches, fmt))
+    if fmt == "arrow":
+        return _rebatch(_checked(_arrow_batches(_arrow_reader(stream)), fmt), chunk_rows)
+    if fmt == "npy":
+        matrix = _load_npy(stream, feature_columns)
+        return (
+            _npy_frame(matrix[start:start + chunk_rows], feature_columns)
+            for start in range(0, matrix.shape[0], chunk_rows)
+        )
+    raise InputFormatError(f"Unknown input format {fmt!r}")
+
+
+def count_rows(stream, fmt):
+    """
+    Number of data rows in an upload, read from metadata where the format
+    has it (CSV lines are counted). None when it cannot be had cheaply.
+    """
+    try:
+        if fmt == "csv":
+            newlines, last = 0, b"\n"
+            for block in iter(lambda: stream.read(1 << 20), b""):
+                newlines += block.count(b"\n")
+                last = block[-1:]
+            lines = newlines + (last != b"\n")
+            return max(lines - 1, 0)        # minus the header
+        if fmt == "parquet":
+            with _arrow_errors(fmt) as pa:
+                return pa.parquet.ParquetFile(stream).metadata.num_rows
+        if fmt == "npy":
+            fmt_module = np.lib.format
+            if fmt_module.read_magic(stream) == (1, 0):
+                shape, _, _ = fmt_module.read_array_header_1_0(stream)
+            else:
+                shape, _, _ = fmt_module.read_array_header_2_0(stream)
+            return shape[0] if shape else None
+        return None                         # Arrow IPC: only known after reading
+    finally:
+        stream.seek(0)
+
+
+def _rebatch(batches, chunk_rows):
+    # IPC record batches can be any size; cut them down to chunk_rows
+    for batch in batches:
+        for start in range(0, batch.num_rows, chunk_rows):
+            yield batch.slice(start, chunk_rows).to_pandas()
+
+
+def encode_chunk(df, fmt, first):
+    """
+    Encode one scored chunk for a streaming response.
+    The CSV header is only written for the first chunk.
+    """
+    if fmt == "csv":
+        return df.to_csv(index=False, header=first)
+    if fmt == "ndjson":
+        return df.to_json(orient="records", lines=True)
+    raise ValueError(f"Unknown stream format {fmt!r}")
@@ -0,0 +1,163 @@
+"""
+Dynamic micro-batching for single-row predictions.
+
+Concurrent callers hand one feature row each to ``MicroBatcher.submit``.
+A background thread collects rows for at most ``max_wait_ms`` (or until
+``max_batch_size`` rows are waiting), runs one vectorized prediction over
+the whole batch and hands every caller its own result.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, n_features, max_batch_size=64, max_wait_ms=2.0):
+        """
+        predict_fn : callable taking a float64 array of shape (n, n_features)
+                     and returning a sequence of n results (one per row).
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+
+        self.predict_fn = predict_fn
+        self.n_features = n_features
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._closed = False
+
+        # Fill statistics
+        self._batches = 0
+        self._rows = 0
+        self._size_histogram = {}
+
+    # --------------------------------------------------
+    # Public API
+    # --------------------------------------------------
+    def submit(self, row, timeout=None):
+        """
+        Queue one feature row and block until its prediction is ready.
+        Exceptions raised by predict_fn are re-raised in the caller.
+        """
+        row = np.asarray(row, dtype=np.float64).reshape(-1)
+        if row.shape[0] != self.n_features:
+            raise ValueError(
+                f"Expected {self.n_features} features, got {row.shape[0]}"
+            )
+
+        self._ensure_worker()
+        future = Future()
+        with self._lock:
+            # Checked under the lock so no row can be queued behind the stop marker
+            closed = self._closed
+            if not closed:
+                self._queue.put((row, future))
+
+        if closed:
+            # Retired (e.g. its model version was unloaded): serve stragglers directly
+            return self.predict_fn(row.reshape(1, -1))[0]
+        return future.result(timeout=timeout)
+
+    def close(self):
+        """Stop the worker thread once the rows already queued are served."""
+        with self._lock:
+            self._closed = True
+            self._queue.put(_STOP)
+
+    def stats(self):
+        """Report how full the batches have been since startup."""
+        with self._lock:
+            batches = self._batches
+            rows = self._rows
+            histogram = dict(sorted(self._size_histogram.items()))
+
+        mean_size = rows / batches if batches else 0.0
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "rows": rows,
+            "mean_batch_size": round(mean_size, 3),
+            "mean_fill_ratio": round(mean_size / self.max_batch_size, 4),
+            "batch_size_histogram": histogram,
+            "queue_depth": self._queue.qsize(),
+        }
+
+    # --------------------------------------------------
+    # Worker thread
+    # --------------------------------------------------
+    def _ensure_worker(self):
+        # Threads do not survive fork(), so a pre-forked worker process
+        # starts its own batching thread on first use.
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid:
+            return
+
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid:
+                return
+            if self._worker_pid != pid:
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(
+                target=self._run, name="micro-batcher", daemon=True
+            )
+            self._worker_pid = pid
+            self._worker.start()
+
+    def _collect(self):
+        # Block until the first row arrives, then keep collecting until the
+        # batch is full or the wait budget of the first row is used up.
+        items = [self._queue.get()]
+        if items[0] is _STOP:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)      # stop after this batch
+                break
+            items.append(item)
+
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if not items:
+                return
+            futures = [future for _, future in items]
+
+            try:
+                batch = np.vstack([row for row, _ in items])
+                results = self.predict_fn(batch)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+
+            with self._lock:
+                self._batches += 1
+                self._rows += len(items)
+                size = len(items)
+                self._size_histogram[size] = self._size_histogram.get(size, 0) + 1
@@ -0,0 +1,315 @@
+"""
+In-process micro-benchmark of the prediction path.
+
+    python benchmark.py crop_recommendation_model.joblib
+    python benchmark.py model.joblib --engines compiled --nthreads 1,2,4,0
+    python benchmark.py model.joblib --output run.json --baseline baseline.json
+    python benchmark.py model.joblib --baseline baseline.json --update-baseline
+
+For every inference engine, xgboost thread count and batch size, times
+predict_proba, predict and decode (for the pipeline engine: the Pipeline's
+own predict_proba / predict and LabelEncoder.inverse_transform). Inputs
+are drawn uniformly from each feature's range in the training data
+(model/Crop_recommendation.csv), with a fixed seed.
+
+Each configuration is called once untimed, while the growth of the
+process RSS during the call is recorded, then repeatedly until --min-time
+seconds and --repeats calls have passed (or --max-time is reached). The
+median call time gives rows/s. A first call longer than --max-time is
+used as the only timing, so million-row batches are scored twice at most.
+The default batch sizes stop at 10,000 rows for the numpy engine, which
+would need minutes per million-row call; sizes given with --batch-sizes
+are run for every engine.
+
+With --baseline, every configuration whose rows/s fell by more than
+--tolerance against the baseline is reported and the exit status is 1.
+--update-baseline writes this run as the new baseline instead. Baselines
+are only comparable on the same machine.
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import numpy as np
+
+from contract import FEATURE_COLUMNS
+from inference import ENGINES, build_predictor
+
+DEFAULT_DATASET = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "model", "Crop_recommendation.csv"
+)
+DEFAULT_BATCH_SIZES = "1,10,100,1000,10000,100000,1000000"
+
+# Largest of the default batch sizes run per engine (others: all of them)
+DEFAULT_MAX_BATCH_SIZE = {"numpy": 10000}
+
+OPERATIONS = ("predict_proba", "predict", "decode")
+
+
+def feature_ranges(dataset_path):
+    """(min, max) of every feature column in the training CSV."""
+    data = np.genfromtxt(dataset_path, delimiter=",", names=True, usecols=FEATURE_COLUMNS)
+    return np.array([(data[col].min(), data[col].max()) for col in FEATURE_COLUMNS])
+
+
+def generate_rows(ranges, n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(ranges[:, 0], ranges[:, 1], size=(n_rows, len(ranges)))
+
+
+# --------------------------------------------------
+# Measurement
+# --------------------------------------------------
+def _resident_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def peak_rss_growth(fn, interval=0.001):
+    """Call fn once; return how far RSS rose above its starting point (None without /proc)."""
+    start = _resident_bytes()
+    if start is None:
+        fn()
+        return None
+
+    peak = [start]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], _resident_bytes())
+            done.wait(interval)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak[0], _resident_bytes()) - start
+
+
+def time_calls(fn, repeats=3, min_time=0.5, max_time=10.0):
+    """Per-call seconds of repeated fn() calls, with the garbage collector off."""
+    times = []
+    total = 0.0
+    gc.collect()
+    gc.disable()
+    try:
+        while len(times) < repeats or total < min_time:
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            times.append(elapsed)
+            total += elapsed
+            if total >= max_time:
+                break
+    finally:
+        gc.enable()
+    return times
+
+
+def set_threads(pipeline, nthread):
+    """Thread count for the fitted booster (0 = xgboost's default, all cores)."""
+    classifier = pipeline.named_steps["classifier"]
+    classifier.set_params(n_jobs=nthread)
+    classifier.get_booster().set_param("nthread", nthread)
+
+
+def benchmark_operation(predictor, operation, X, indices):
+    if operation == "predict_proba":
+        return lambda: predictor.predict_proba(X)
+    if operation == "predict":
+        return lambda: predictor.predict(X)
+    return lambda: predictor.decode(indices)
+
+
+def run(artifacts, engines, nthreads, batch_sizes, ranges, repeats, min_time, max_time,
+        seed=0, max_batch_size=None):
+    """max_batch_size maps engines to the largest batch size to run for them."""
+    pipeline = artifacts["model"]
+    label_encoder = artifacts["label_encoder"]
+    rows = generate_rows(ranges, max(batch_sizes), seed)
+    results = []
+
+    for engine in engines:
+        predictor = build_predictor(engine, pipeline, label_encoder, FEATURE_COLUMNS)
+        if predictor.name != engine:
+            print(f"Skipping engine {engine!r}: it failed its parity check", file=sys.stderr)
+            continue
+        # The NumPy tree engine does not use xgboost threads
+        engine_threads = nthreads if engine in ("pipeline", "compiled") else [None]
+        limit = (max_batch_size or {}).get(engine)
+        engine_sizes = [n for n in batch_sizes if limit is None or n <= limit]
+        if len(engine_sizes) < len(batch_sizes):
+            print(f"Skipping batch sizes above {limit:,} rows for engine {engine!r}; "
+                  f"pass --batch-sizes to run them", file=sys.stderr)
+
+        for nthread, batch_size in itertools.product(engine_threads, engine_sizes):
+            if nthread is not None:
+                set_threads(pipeline, nthread)
+            X = rows[:batch_size]
+            indices = predictor.predict(X[:min(batch_size, 1000)])
+            indices = np.resize(indices, batch_size)
+
+            for operation in OPERATIONS:
+                fn = benchmark_operation(predictor, operation, X, indices)
+                start = time.perf_counter()
+                memory = peak_rss_growth(fn)
+                first = time.perf_counter() - start
+                # A call that already takes longer than max_time is not repeated
+                times = [first] if first >= max_time else time_calls(
+                    fn, repeats, min_time, max_time
+                )
+                median = float(np.median(times))
+                result = {
+                    "engine": engine,
+                    "operation": operation,
+                    "batch_size": batch_size,
+                    "nthread": nthread,
+                    "calls": len(times),
+                    "median_seconds": median,
+                    "min_seconds": float(min(times)),
+                    "rows_per_second": batch_size / median if median > 0 else float("inf"),
+                    "peak_rss_growth_bytes": memory,
+                }
+                results.append(result)
+                print(format_result(result), flush=True)
+
+    # Leave the booster as it was loaded
+    set_threads(pipeline, 0)
+    return results
+
+
+# --------------------------------------------------
+# Reporting and baselines
+# --------------------------------------------------
+def result_key(result):
+    return (result["engine"], result["operation"], result["batch_size"], result["nthread"])
+
+
+def describe(result):
+    threads = "" if result["nthread"] is None else f" nthread={result['nthread']}"
+    return f"{result['engine']}/{result['operation']} rows={result['batch_size']}{threads}"
+
+
+def format_result(result):
+    memory = result["peak_rss_growth_bytes"]
+    memory = "n/a" if memory is None else f"{memory / 2**20:.1f}MiB"
+    return (
+        f"{describe(result):<48} {result['rows_per_second']:>14,.0f} rows/s  "
+        f"{result['median_seconds'] * 1000:>10.3f} ms/call  RSS +{memory}"
+    )
+
+
+def find_regressions(results, baseline, tolerance):
+    """Results whose rows/s dropped by more than tolerance against the baseline."""
+    before = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+        change = result["rows_per_second"] / old["rows_per_second"] - 1
+        if change < -tolerance:
+            regressions.append((result, old, change))
+    return regressions
+
+
+def machine():
+    return {
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the prediction path in-process")
+    parser.add_argument("artifact", help="crop_recommendation_model.joblib")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET,
+                        help="training CSV the input ranges are taken from")
+    parser.add_argument("--engines", default=",".join(ENGINES),
+                        help=f"comma-separated, from {', '.join(ENGINES)}")
+    parser.add_argument("--batch-sizes", default=None,
+                        help=f"comma-separated (default {DEFAULT_BATCH_SIZES}, "
+                             f"up to {DEFAULT_MAX_BATCH_SIZE['numpy']} for numpy)")
+    parser.add_argument("--nthreads", default="1,0",
+                        help="xgboost thread counts to try; 0 means all cores (default 1,0)")
+    parser.add_argument("--repeats", type=int, default=3, help="minimum timed calls")
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="minimum timed seconds per configuration")
+    parser.add_argument("--max-time", type=float, default=10.0,
+                        help="stop repeating a configuration after this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="write this run to --baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed rows/s drop before a regression is flagged (default 0.10)")
+    args = parser.parse_args(argv)
+
+    import joblib
+
+    engines = [e for e in args.engines.split(",") if e]
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(sorted(unknown))}")
+    max_batch_size = None
+    if args.batch_sizes is None:
+        args.batch_sizes, max_batch_size = DEFAULT_BATCH_SIZES, DEFAULT_MAX_BATCH_SIZE
+    batch_sizes = [int(n) for n in args.batch_sizes.split(",") if n]
+    nthreads = [int(n) for n in args.nthreads.split(",") if n]
+
+    artifacts = joblib.load(args.artifact)
+    results = run(artifacts, engines, nthreads, batch_sizes, feature_ranges(args.dataset),
+                  args.repeats, args.min_time, args.max_time, args.seed, max_batch_size)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "artifact": os.path.basename(args.artifact),
+        "machine": machine(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if not args.baseline:
+        return 0
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != report["machine"]:
+        print("Warning: the baseline was recorded on a different machine", file=sys.stderr)
+
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for result, old, change in regressions:
+        print(f"REGRESSION {describe(result)}: {old['rows_per_second']:,.0f} -> "
+              f"{result['rows_per_second']:,.0f} rows/s ({change:+.1%})")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""
+Offline bulk scoring of large local files, without HTTP.
+
+    python bulk_score.py fields/*.csv --output scored/
+    python bulk_score.py registry.parquet --output scored/ --format parquet --workers 4
+    python bulk_score.py registry.parquet --output scored/ --model model_native/ --engine numpy
+
+Every input (CSV, Parquet, Arrow IPC or .npy, see batch_io.py) is read in
+chunks of --chunk-rows, and the chunks are scored by a pool of --workers
+processes. Each worker loads the model once, the same way the server does
+(registry.load_artifact, with MODEL_PATH / MODEL_NATIVE_DIR,
+INFERENCE_ENGINE and CASCADE_THRESHOLD as defaults), and limits xgboost to --threads-per-worker
+threads so that N workers keep N cores busy without oversubscribing them.
+
+Rows are validated like /batch_predict (see validation.py; FEATURE_RANGES
+applies). As in batch jobs, invalid rows are kept unscored and an "error"
+column says why. Each chunk becomes one shard:
+
+    scored/
+        run.json                        options, model fingerprint, finished shards
+        fields_a.csv/part-00000.csv
+        fields_a.csv/part-00001.csv
+        ...
+
+Workers write a shard under a temporary name and rename it into place;
+run.json lists a shard once it is complete. Re-running the same command
+after an interruption scores only the missing shards (the inputs are still
+parsed up to them). A resume with a different model or different shard
+options is refused; --restart discards the previous output instead.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from batch_io import InputFormatError, detect_input_format, encode_result, read_chunks
+from contract import FEATURE_COLUMNS, output_columns, top_k_columns
+from inference import ENGINES, top_k
+from native_model import native_files
+from registry import artifact_fingerprint, load_artifact
+from validation import parse_ranges, validate_frame
+
+OUTPUT_FORMATS = ("csv", "parquet")
+
+RUN_FILE = "run.json"
+
+# Options that change what the shards contain; a resume must match them
+SHARD_OPTIONS = ("fingerprint", "chunk_rows", "format", "top_k", "include_inputs",
+                 "feature_ranges", "cascade_threshold")
+
+
+# --------------------------------------------------
+# Worker processes
+# --------------------------------------------------
+_worker = {}
+
+
+def limit_threads(predictor, nthread):
+    """Cap the xgboost threads of a pipeline or compiled engine (numpy has none)."""
+    predictor = getattr(predictor, "full", predictor)        # behind a cascade
+    booster = getattr(predictor, "booster", None)
+    if predictor.name == "pipeline":
+        classifier = predictor.pipeline.named_steps["classifier"]
+        classifier.set_params(n_jobs=nthread)
+        booster = classifier.get_booster()
+    if booster is not None:
+        booster.set_param("nthread", nthread)
+
+
+def init_worker(options):
+    predictor, _ = load_artifact(options["model"], options["engine"], FEATURE_COLUMNS,
+                                 cascade_threshold=options["cascade_threshold"])
+    if options["threads_per_worker"]:
+        limit_threads(predictor, options["threads_per_worker"])
+    low, high = parse_ranges(options["feature_ranges"], FEATURE_COLUMNS)
+    _worker.update(predictor=predictor, low=low, high=high, options=options)
+
+
+def prediction_columns(predictor, validation, k=None):
+    """
+    recommended_crop (plus top{i}_crop / top{i}_probability) for the valid
+    rows, spread back over all rows, and the error column (see contract.py).
+    """
+    if k:
+        k = min(k, len(predictor.classes))
+    scored = None
+    X = validation.valid_rows()
+    if len(X) and not k:
+        scored = {"recommended_crop": predictor.predict_labels(X)}
+    elif len(X):
+        scored = top_k_columns(*top_k(predictor.predict_proba(X), predictor.classes, k))
+    return output_columns(validation, scored, k, errors=True)
+
+
+def score_shard(chunk, path):
+    """Validate, score and write one chunk. Returns (rows, invalid rows)."""
+    import pandas as pd
+
+    options = _worker["options"]
+    validation = validate_frame(chunk, FEATURE_COLUMNS, _worker["low"], _worker["high"])
+    predictions = prediction_columns(_worker["predictor"], validation, options["top_k"])
+
+    if options["include_inputs"]:
+        df = chunk
+        if options["format"] == "parquet":
+            # One numeric type per feature column in every shard; the
+            # error column says which values did not parse
+            for j, col in enumerate(FEATURE_COLUMNS):
+                df[col] = validation.X[:, j]
+        for name, values in predictions.items():
+            df[name] = values
+    else:
+        df = pd.DataFrame(predictions)
+
+    if options["format"] == "parquet":
+        # Text columns that are all None in this shard are still strings
+        for name in predictions:
+            if not name.endswith("_probability"):
+                df[name] = df[name].astype("string")
+    body, _ = encode_result(df, options["format"])
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, path)
+    return validation.n_rows, validation.n_invalid
+
+
+# --------------------------------------------------
+# Run state
+# --------------------------------------------------
+def read_run(output):
+    try:
+        with open(os.path.join(output, RUN_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_run(output, run):
+    path = os.path.join(output, RUN_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(run, f, indent=2)
+    os.replace(tmp, path)
+
+
+def discard_run(output, run):
+    """Remove the shards and run.json of a previous run."""
+    for name in run["shard_dirs"]:
+        shutil.rmtree(os.path.join(output, name), ignore_errors=True)
+    os.remove(os.path.join(output, RUN_FILE))
+
+
+def model_fingerprint(model, engine):
+    if os.path.isdir(model):
+        return artifact_fingerprint(*native_files(model, engine))
+    return artifact_fingerprint(model)
+
+
+def check_input(path):
+    """The input format of path; raises InputFormatError if it cannot be scored."""
+    with open(path, "rb") as f:
+        fmt = detect_input_format(f, filename=path)
+        first_chunk = next(read_chunks(f, fmt, 1, FEATURE_COLUMNS), None)
+    if first_chunk is None:
+        raise InputFormatError(f"{path} has no rows")
+    missing_cols = [col for col in FEATURE_COLUMNS if col not in first_chunk.columns]
+    if missing_cols:
+        raise InputFormatError(f"{path} is missing columns: {', '.join(missing_cols)}")
+    return fmt
+
+
+# --------------------------------------------------
+# Driver
+# --------------------------------------------------
+def score_files(inputs, output, options, workers, run):
+    """
+    Fan the chunks of every input out over the worker pool, at most two
+    chunks per worker in flight. Updates run["shards"] as shards finish.
+    Returns (rows scored, invalid rows, rows skipped as already done).
+    """
+    totals = {"rows": 0, "invalid": 0, "skipped": 0}
+    pending = set()
+
+    def collect(futures):
+        for future in futures:
+            rows, invalid = future.result()
+            run["shards"][future.shard] = {"rows": rows, "invalid_rows": invalid}
+            totals["rows"] += rows
+            totals["invalid"] += invalid
+            write_run(output, run)
+
+    # Spawned, not forked: the reading side may already run pyarrow or
+    # OpenMP threads, which do not survive fork()
+    pool = ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker, initargs=(options,),
+    )
+    try:
+        for path, fmt, name in inputs:
+            os.makedirs(os.path.join(output, name), exist_ok=True)
+            with open(path, "rb") as f:
+                for index, chunk in enumerate(read_chunks(f, fmt, options["chunk_rows"],
+                                                          FEATURE_COLUMNS)):
+                    shard = f"{name}/part-{index:05d}.{options['format']}"
+                    if shard in run["shards"] and os.path.exists(os.path.join(output, shard)):
+                        totals["skipped"] += len(chunk)
+                        continue
+                    while len(pending) >= 2 * workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    future = pool.submit(score_shard, chunk, os.path.join(output, shard))
+                    future.shard = shard
+                    pending.add(future)
+            print(f"Read {path}", flush=True)
+
+        done, pending = wait(pending)
+        collect(done)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return totals["rows"], totals["invalid"], totals["skipped"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score large local files with a process pool")
+    parser.add_argument("inputs", nargs="+", help="CSV, Parquet, Arrow IPC or .npy files")
+    parser.add_argument("--output", required=True, help="directory for the shards and run.json")
+    parser.add_argument("--model",
+                        default=os.environ.get("MODEL_NATIVE_DIR")
+                        or os.environ.get("MODEL_PATH", "crop_recommendation_model.joblib"),
+                        help="joblib artifact or native model directory "
+                             "(default: MODEL_NATIVE_DIR, else MODEL_PATH)")
+    parser.add_argument("--engine", choices=ENGINES,
+                        default=os.environ.get("INFERENCE_ENGINE", "pipeline"),
+                        help="inference engine (default: INFERENCE_ENGINE, else pipeline)")
+    parser.add_argument("--cascade-threshold", type=float,
+                        default=os.environ.get("CASCADE_THRESHOLD") or None,
+                        help="serve the artifact's fast_model first (see cascade.py; "
+                             "default: CASCADE_THRESHOLD)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", help="shard format")
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="rows per shard")
+    parser.add_argument("--top-k", type=int, default=None,
+                        help="also write the k most likely crops with their probabilities")
+    parser.add_argument("--no-inputs", action="store_true",
+                        help="write only the prediction columns, not the input columns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads-per-worker", type=int, default=1,
+                        help="xgboost threads per worker; 0 keeps xgboost's default")
+    parser.add_argument("--restart", action="store_true",
+                        help="discard the previous run in --output instead of resuming it")
+    args = parser.parse_args(argv)
+
+    if args.chunk_rows < 1 or args.workers < 1:
+        parser.error("--chunk-rows and --workers must be at least 1")
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet requires the pyarrow package")
+
+    inputs = []
+    names = set()
+    for path in args.inputs:
+        name = os.path.basename(path)
+        if name in names:
+            parser.error(f"two inputs are named {name}; shards are grouped by file name")
+        names.add(name)
+        try:
+            inputs.append((path, check_input(path), name))
+        except (OSError, InputFormatError) as e:
+            parser.error(str(e))
+
+    feature_ranges = os.environ.get("FEATURE_RANGES")
+    try:
+        parse_ranges(feature_ranges, FEATURE_COLUMNS)
+        fingerprint = model_fingerprint(args.model, args.engine)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    options = {
+        "model": os.path.abspath(args.model),
+        "engine": args.engine,
+        "fingerprint": fingerprint,
+        "chunk_rows": args.chunk_rows,
+        "format": args.format,
+        "top_k": args.top_k,
+        "include_inputs": not args.no_inputs,
+        "feature_ranges": feature_ranges,
+        "cascade_threshold": args.cascade_threshold,
+        "threads_per_worker": args.threads_per_worker,
+    }
+
+    os.makedirs(args.output, exist_ok=True)
+    run = read_run(args.output)
+    if run is not None and args.restart:
+        discard_run(args.output, run)
+        run = None
+    if run is not None:
+        changed = [key for key in SHARD_OPTIONS if run["options"].get(key) != options[key]]
+        if changed:
+            print(f"{args.output} holds a run with different {', '.join(changed)}; "
+                  f"use --restart to discard it", file=sys.stderr)
+            return 2
+        run["shard_dirs"] = sorted(set(run["shard_dirs"]) | names)
+        run.update(options=options, state="running")
+    else:
+        run = {"options": options, "state": "running", "shard_dirs": sorted(names), "shards": {}}
+    write_run(args.output, run)
+
+    start = time.perf_counter()
+    try:
+        rows, invalid, skipped = score_files(inputs, args.output, options, args.workers, run)
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        return 130
+    except BrokenProcessPool:
+        print("A worker process died (could the model be loaded?); "
+              "run the same command again to resume", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+
+    run.update(state="done", finished_at=time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+    write_run(args.output, run)
+
+    print(f"Scored {rows:,} rows ({invalid:,} invalid) in {elapsed:.1f}s: "
+          f"{rows / elapsed if elapsed > 0 else 0:,.0f} rows/s with {args.workers} workers")
+    if skipped:
+        print(f"Skipped {skipped:,} rows already scored by an earlier run")
+    print(f"{len(run['shards'])} shards in {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Bounded in-process prediction cache.
+
+Rows are keyed on their features rounded to a per-feature quantum (sensor
+precision), so repeated readings skip the model entirely. Keys also carry
+the fingerprint of the model that produced the result, so entries from a
+previously loaded artifact can never be returned. Eviction is LRU.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Default rounding step per feature
+DEFAULT_QUANTUM = {
+    "N": 1.0,
+    "P": 1.0,
+    "K": 1.0,
+    "temperature": 0.1,
+    "humidity": 0.1,
+    "ph": 0.01,
+    "rainfall": 0.1,
+}
+
+
+def parse_quantum(spec, feature_columns):
+    """
+    Parse PREDICTION_CACHE_QUANTUM into one step per feature.
+
+    Accepts either a single number ("0.01", applied to every feature) or
+    per-feature overrides on top of DEFAULT_QUANTUM ("ph=0.05,rainfall=1").
+    """
+    quantum = {col: DEFAULT_QUANTUM.get(col, 0.01) for col in feature_columns}
+    spec = (spec or "").strip()
+
+    if spec and "=" not in spec:
+        quantum = {col: float(spec) for col in feature_columns}
+    elif spec:
+        for item in spec.split(","):
+            name, _, value = item.partition("=")
+            name = name.strip()
+            if name not in quantum:
+                raise ValueError(f"Unknown feature {name!r} in cache quantum")
+            quantum[name] = float(value)
+
+    steps = np.array([quantum[col] for col in feature_columns], dtype=np.float64)
+    if (steps <= 0).any():
+        raise ValueError("Cache quantum steps must be positive")
+    return steps
+
+
+class PredictionCache:
+    def __init__(self, max_size, steps):
+        self.max_size = int(max_size)
+        self.steps = np.asarray(steps, dtype=np.float64)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def quantize(self, X):
+        """
+        Round rows to the cache grid. Returns (keys, cacheable) where
+        rows with NaN/inf values are marked as not cacheable.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        scaled = X / self.steps
+        cacheable = np.isfinite(scaled).all(axis=1)
+        grid = np.zeros(X.shape, dtype=np.int64)
+        grid[cacheable] = np.floor(scaled[cacheable] + 0.5)
+        return grid, cacheable
+
+    def predict(self, X, predict_fn, model_key):
+        """
+        Return one result per row of X, calling predict_fn only for rows
+        that are not cached. Duplicate rows among the misses are scored once.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        grid, cacheable = self.quantize(X)
+        keys = [(model_key,) + row for row in map(tuple, grid.tolist())]
+        results = np.empty(len(keys), dtype=object)
+        missing = ~cacheable
+
+        with self._lock:
+            for i in np.flatnonzero(cacheable):
+                value = self._entries.get(keys[i])
+                if value is None:
+                    missing[i] = True
+                else:
+                    self._entries.move_to_end(keys[i])
+                    results[i] = value
+            n_missing = int(missing.sum())
+            self.hits += len(keys) - n_missing
+            self.misses += n_missing
+
+        if not n_missing:
+            return results
+
+        # Score each distinct missing grid cell once
+        miss_rows = np.flatnonzero(missing & cacheable)
+        uncacheable_rows = np.flatnonzero(~cacheable)
+
+        if miss_rows.size:
+            _, first, inverse = np.unique(
+                grid[miss_rows], axis=0, return_index=True, return_inverse=True
+            )
+            unique_rows = miss_rows[first]
+            scored = np.asarray(predict_fn(X[unique_rows]), dtype=object)
+            results[miss_rows] = scored[inverse.reshape(-1)]
+            self._store([keys[i] for i in unique_rows], scored)
+
+        if uncacheable_rows.size:
+            results[uncacheable_rows] = np.asarray(
+                predict_fn(X[uncacheable_rows]), dtype=object
+            )
+
+        return results
+
+    def _store(self, keys, values):
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "quantum": self.steps.tolist(),
+            }
@@ -0,0 +1,278 @@
+"""
+Confidence-gated model cascade.
+
+    python cascade.py crop_recommendation_model.joblib --thresholds 0.5,0.7,0.8,0.9,0.95
+
+The training notebook exports a small random forest (``fast_model``)
+alongside the tuned XGBoost pipeline. With CASCADE_THRESHOLD set, every
+row of a batch is scored by the small forest first. Rows whose top-class
+probability reaches the threshold keep its answer, and only the rest are
+scored again by the full engine. Both steps are vectorised over the
+batch.
+
+The forest is evaluated with NumPy: all rows and all trees descend one
+level per step, so a confident row never touches pandas, scikit-learn or
+xgboost. It is parity-checked against the sklearn pipeline at load time,
+and the cascade is disabled if the check fails.
+
+Rows answered by the small model carry its probabilities (averaged tree
+votes, less sharp than xgboost's), which is what top_k reports for them.
+
+The command above reports the trade-off on the notebook's test split: the
+share of rows the small model answers, the accuracy, and the time per row
+in a batch and for single rows, for each threshold and for the full model
+alone.
+"""
+import threading
+import time
+
+import numpy as np
+
+from contract import FEATURE_COLUMNS
+from inference import (
+    PipelinePredictor,
+    ScaledPredictor,
+    check_parity,
+    parity_sample,
+    scaler_params,
+)
+
+
+class ForestPredictor(ScaledPredictor):
+    """A fitted sklearn decision tree or random forest, evaluated with NumPy."""
+
+    name = "forest"
+
+    def __init__(self, mean, scale, classes, feature, threshold, left, right, value, roots,
+                 max_depth):
+        super().__init__(mean, scale, classes)
+        self.feature = np.ascontiguousarray(feature, dtype=np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.left = np.ascontiguousarray(left, dtype=np.intp)
+        self.right = np.ascontiguousarray(right, dtype=np.intp)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)     # (n_nodes, n_classes)
+        self.roots = np.ascontiguousarray(roots, dtype=np.intp)
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_pipeline(cls, pipeline, label_encoder, feature_columns):
+        """Build from a fitted Pipeline(preprocessor, tree or forest classifier)."""
+        classifier = pipeline.named_steps["classifier"]
+        mean, scale = scaler_params(pipeline, feature_columns)
+        trees = getattr(classifier, "estimators_", [classifier])
+
+        feature, threshold, left, right, value, roots = [], [], [], [], [], []
+        offset, max_depth = 0, 0
+        for estimator in trees:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            leaf = tree.children_left < 0
+            # Leaves point at themselves, so extra descent steps are no-ops
+            feature.append(np.where(leaf, 0, tree.feature))
+            threshold.append(np.where(leaf, np.inf, tree.threshold))
+            left.append(np.where(leaf, nodes, tree.children_left) + offset)
+            right.append(np.where(leaf, nodes, tree.children_right) + offset)
+            counts = tree.value[:, 0, :]
+            value.append(counts / counts.sum(axis=1, keepdims=True))
+            roots.append(offset)
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            mean, scale, label_encoder.classes_,
+            np.concatenate(feature), np.concatenate(threshold),
+            np.concatenate(left), np.concatenate(right), np.concatenate(value),
+            roots, max_depth,
+        )
+
+    def predict_proba(self, X):
+        # Scaled like the pipeline, then compared in float32 like sklearn trees
+        Xs = self.transform(X)
+        rows = np.arange(len(Xs))[:, None]
+        node = np.broadcast_to(self.roots, (len(Xs), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            go_left = Xs[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+
+        proba = np.zeros((len(Xs), self.value.shape[1]))
+        for t in range(len(self.roots)):
+            proba += self.value[node[:, t]]
+        return proba / len(self.roots)
+
+
+class CascadeStats:
+    """Rows scored by a cascade, and how many of them needed the full model."""
+
+    def __init__(self):
+        self.rows = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    def add(self, rows, escalated):
+        with self._lock:
+            self.rows += rows
+            self.escalated += escalated
+
+
+class CascadePredictor:
+    """Small model first; rows below the confidence threshold go to the full engine."""
+
+    name = "cascade"
+
+    def __init__(self, fast, full, threshold, stats=None):
+        self.fast = fast
+        self.full = full
+        self.threshold = float(threshold)
+        self.classes = full.classes
+        self.mean, self.scale = fast.mean, fast.scale
+        self.stats = stats if stats is not None else CascadeStats()
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        proba = self.fast.predict_proba(X)
+        unsure = proba.max(axis=1) < self.threshold
+        n_unsure = int(unsure.sum())
+        if n_unsure:
+            proba[unsure] = self.full.predict_proba(X[unsure])
+        self.stats.add(len(X), n_unsure)
+        return proba
+
+    def predict(self, X):
+        return np.argmax(self.predict_proba(X), axis=1)
+
+    def decode(self, indices):
+        return self.full.decode(indices)
+
+    def predict_labels(self, X):
+        return self.decode(self.predict(X))
+
+    def with_threads(self, nthread):
+        """The same cascade with the full engine on nthread threads (see thread_policy.py)."""
+        full = self.full.with_threads(nthread) if hasattr(self.full, "with_threads") else self.full
+        return CascadePredictor(self.fast, full, self.threshold, self.stats)
+
+    def describe(self):
+        rows, escalated = self.stats.rows, self.stats.escalated
+        return {
+            "cascade": {
+                "threshold": self.threshold,
+                "full_engine": self.full.name,
+                "rows": rows,
+                "escalated_rows": escalated,
+                "escalated_share": round(escalated / rows, 4) if rows else None,
+            }
+        }
+
+
+def build_cascade(artifacts, full, threshold, feature_columns, logger=None):
+    """
+    Put the artifact's fast_model in front of the full engine. Returns the
+    full engine unchanged if there is no fast model or it fails parity.
+    """
+    fast_pipeline = artifacts.get("fast_model")
+    if fast_pipeline is None:
+        if logger is not None:
+            logger.warning("CASCADE_THRESHOLD ignored: the artifact has no fast_model")
+        return full
+
+    try:
+        fast = ForestPredictor.from_pipeline(
+            fast_pipeline, artifacts["label_encoder"], feature_columns
+        )
+        reference = PipelinePredictor(fast_pipeline, artifacts["label_encoder"], feature_columns)
+        check_parity(fast, reference, parity_sample(fast.mean, fast.scale))
+    except (ValueError, AssertionError, KeyError, AttributeError) as e:
+        if logger is not None:
+            logger.warning("Cascade disabled, the fast model cannot be compiled: %s", e)
+        return full
+    return CascadePredictor(fast, full, threshold)
+
+
+# --------------------------------------------------
+# Accuracy / latency trade-off
+# --------------------------------------------------
+def _seconds_per_row(predictor, X, single_rows=100, repeats=3):
+    """(best batch seconds per row, mean seconds for one single-row call)."""
+    batch = min(_timed(lambda: predictor.predict_proba(X)) for _ in range(repeats)) / len(X)
+    singles = X[:single_rows]
+    single = _timed(lambda: [predictor.predict_proba(row[None, :]) for row in singles])
+    return batch, single / len(singles)
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def tradeoff(fast, full, X, y, thresholds):
+    """
+    One entry per threshold (plus threshold None for the full model
+    alone): fast_share, accuracy, batch_us_per_row, single_row_ms.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    results = []
+    for threshold in [None] + sorted(thresholds):
+        predictor = full if threshold is None else CascadePredictor(fast, full, threshold)
+        predictor.predict_proba(X[:1])                      # warm up
+        predicted = np.argmax(predictor.predict_proba(X), axis=1)
+        batch, single = _seconds_per_row(predictor, X)
+        fast_share = 0.0
+        if threshold is not None:
+            fast_share = float((fast.predict_proba(X).max(axis=1) >= threshold).mean())
+        results.append({
+            "threshold": threshold,
+            "fast_share": round(fast_share, 4),
+            "accuracy": round(float((predicted == np.asarray(y)).mean()), 4),
+            "batch_us_per_row": round(batch * 1e6, 2),
+            "single_row_ms": round(single * 1e3, 3),
+        })
+    return results
+
+
+def format_tradeoff(results):
+    lines = [f"{'threshold':>10} {'fast share':>11} {'accuracy':>9} "
+             f"{'batch us/row':>13} {'single ms':>10}"]
+    for r in results:
+        threshold = "full only" if r["threshold"] is None else f"{r['threshold']:.2f}"
+        lines.append(f"{threshold:>10} {r['fast_share']:>11.1%} {r['accuracy']:>9.4f} "
+                     f"{r['batch_us_per_row']:>13.2f} {r['single_row_ms']:>10.3f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    import joblib
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+
+    from inference import ENGINES, build_predictor
+
+    parser = argparse.ArgumentParser(description="Accuracy/latency trade-off of the cascade")
+    parser.add_argument("artifact", help="crop_recommendation_model.joblib with a fast_model")
+    parser.add_argument("--dataset", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "model", "Crop_recommendation.csv"))
+    parser.add_argument("--thresholds", default="0.5,0.7,0.8,0.9,0.95")
+    parser.add_argument("--engine", choices=ENGINES,
+                        default=os.environ.get("INFERENCE_ENGINE", "pipeline"),
+                        help="engine for the escalated rows")
+    args = parser.parse_args()
+
+    artifacts = joblib.load(args.artifact)
+    if "fast_model" not in artifacts:
+        parser.error(f"{args.artifact} has no fast_model; re-export it from the notebook")
+    label_encoder = artifacts["label_encoder"]
+
+    # The notebook's test split
+    df = pd.read_csv(args.dataset)
+    y = label_encoder.transform(df["label"])
+    _, X_test, _, y_test = train_test_split(
+        df[FEATURE_COLUMNS], y, test_size=0.20, stratify=y, random_state=42
+    )
+
+    full = build_predictor(args.engine, artifacts["model"], label_encoder, FEATURE_COLUMNS)
+    fast = ForestPredictor.from_pipeline(artifacts["fast_model"], label_encoder, FEATURE_COLUMNS)
+    thresholds = [float(t) for t in args.thresholds.split(",") if t]
+    print(format_tradeoff(tradeoff(fast, full, X_test.to_numpy(), y_test, thresholds)))
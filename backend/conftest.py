@@ -0,0 +1,6 @@
+# pytest loads this before collecting tests under backend/ and puts this
+# directory on sys.path, so tests import the modules as the app does
+# (`from tree_engine import ...`).
+
+# A manual client for a running server, not a test
+collect_ignore = ["test_client.py"]
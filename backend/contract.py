@@ -0,0 +1,56 @@
+"""
+Input and output columns of the crop recommendation model, shared by the
+server (app.py) and the offline tools (bulk_score.py, train.py, ...).
+
+Inputs are the FEATURE_COLUMNS, in this order. A batch of predictions has
+a recommended_crop column and, when top-k is requested, top{i}_crop and
+top{i}_probability for i = 1..k. Rows failing validation (see
+validation.py) keep their place with no crop (None), NaN probabilities
+and an "error" column saying which fields failed.
+
+Imports nothing but NumPy, so any module can use it without loading the
+server or the model.
+"""
+import numpy as np
+
+FEATURE_COLUMNS = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
+
+
+def prediction_column_names(k=None):
+    names = ["recommended_crop"]
+    for i in range(1, (k or 0) + 1):
+        names += [f"top{i}_crop", f"top{i}_probability"]
+    return names
+
+
+def top_k_columns(labels, probabilities):
+    """Prediction columns from top_k()'s (n_rows, k) labels and probabilities."""
+    columns = {"recommended_crop": labels[:, 0]}
+    for i in range(labels.shape[1]):
+        columns[f"top{i + 1}_crop"] = labels[:, i]
+        columns[f"top{i + 1}_probability"] = probabilities[:, i]
+    return columns
+
+
+def output_columns(validation, scored, k=None, errors=False):
+    """
+    Output columns of a validated batch (see validation.validate_frame):
+    the prediction columns over all rows, from `scored`, the columns of
+    its valid rows (None when there are none). With errors, also the
+    "error" column naming the failed fields (empty for valid rows).
+    """
+    if scored is not None and not validation.n_invalid:
+        columns = scored
+    else:
+        columns = {}
+        for name in prediction_column_names(k):
+            if name.endswith("_probability"):
+                values = np.full(validation.n_rows, np.nan)
+            else:
+                values = np.full(validation.n_rows, None, dtype=object)
+            if scored is not None:
+                values[validation.valid] = scored[name]
+            columns[name] = values
+    if errors:
+        columns["error"] = validation.messages()
+    return columns
@@ -0,0 +1,86 @@
+"""
+Pre-fork multi-worker deployment:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app (and with it the model) is loaded once in the master before
+forking, so workers share the model pages copy-on-write instead of each
+unpickling a private copy. Workers recycled after GUNICORN_MAX_REQUESTS
+are forked again from the already-loaded master; nothing is re-read from
+disk.
+
+Each worker runs a warm-up prediction after the fork and only then starts
+accepting connections; GET /ready reports its startup timings.
+
+With CPU_AFFINITY=1 each worker is pinned to its own share of the cores
+(worker slots are reused when a worker is replaced), and
+INFERENCE_THREADS sizes xgboost's thread use to that share; see
+thread_policy.py.
+
+Per-worker memory is logged when a worker starts and exits, served by
+GET /memory in each worker, and summarised for the whole group with
+`python memory.py <master-pid>`.
+"""
+import gc
+import itertools
+import os
+import sys
+
+from memory import format_memory, process_memory
+from thread_policy import pin_cpus, worker_cpus
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# The app sizes its per-call thread budget by the number of workers
+os.environ.setdefault("WEB_CONCURRENCY", str(workers))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+
+preload_app = True
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+
+# The cyclic GC writes to every tracked object it visits, which would
+# copy shared pages into each worker. Keep it off while the master loads
+# the app, freeze what was loaded, and turn it back on in each worker.
+gc.disable()
+
+
+def when_ready(server):
+    gc.freeze()
+    server.log.info("Master loaded app: %s", format_memory(process_memory()))
+
+
+def pre_fork(server, worker):
+    # The lowest CPU slot no live worker holds (runs in the master)
+    taken = {getattr(w, "cpu_slot", None) for w in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in itertools.count() if slot not in taken)
+
+
+def post_fork(server, worker):
+    gc.enable()
+    app_module = sys.modules.get("app")
+    # Pin before the warm-up starts xgboost's threads; they inherit the mask
+    if app_module is not None and app_module.CPU_AFFINITY:
+        cpus = worker_cpus(worker.cpu_slot, server.num_workers)
+        if pin_cpus(cpus):
+            server.log.info("Worker %s pinned to CPUs %s", worker.pid, cpus)
+    # Each worker warms up its own copy of the model before it accepts
+    # connections, and counts its cold start from the fork.
+    if app_module is not None:
+        app_module.startup.reset()
+        app_module.warm_up()
+        # The model watcher thread stayed behind in the master
+        if app_module.watcher is not None:
+            app_module.watcher.start()
+        # Adopts batch jobs left unfinished by a crashed or recycled worker
+        app_module.job_queue.start()
+
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s ready: %s", worker.pid, format_memory(process_memory()))
+
+
+def worker_exit(server, worker):
+    server.log.info("Worker %s exiting: %s", worker.pid, format_memory(process_memory()))
@@ -0,0 +1,270 @@
+"""
+Inference engines for the crop recommendation model.
+
+Every engine exposes the same small interface over a 2D array of rows in
+FEATURE_COLUMNS order:
+
+    predict_proba(X)   -> (n_rows, n_classes) probabilities
+    predict(X)         -> (n_rows,) encoded class indices
+    decode(indices)    -> crop names for encoded class indices
+    predict_labels(X)  -> (n_rows,) crop names
+    classes            -> crop name for each probability column
+
+The xgboost engines also have with_threads(nthread), a copy of the engine
+whose booster runs on nthread threads (see thread_policy.py).
+
+"pipeline" runs the saved sklearn Pipeline as-is. "compiled" pulls the
+StandardScaler statistics and the fitted booster out of the pipeline at
+load time and calls the booster directly on a float32 NumPy array, which
+skips pandas and the sklearn validation layers entirely. "numpy" flattens
+the boosted trees into arrays and evaluates them without xgboost (see
+tree_engine.py).
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class PipelinePredictor:
+    """Reference engine: the sklearn Pipeline exactly as it was trained."""
+
+    name = "pipeline"
+
+    def __init__(self, pipeline, label_encoder, feature_columns):
+        self.pipeline = pipeline
+        self.label_encoder = label_encoder
+        self.feature_columns = list(feature_columns)
+        self.classes = label_encoder.classes_
+
+    def _frame(self, X):
+        import pandas as pd     # already loaded along with the pipeline
+
+        if isinstance(X, pd.DataFrame):
+            return X[self.feature_columns]
+        return pd.DataFrame(X, columns=self.feature_columns)
+
+    def predict_proba(self, X):
+        return self.pipeline.predict_proba(self._frame(X))
+
+    def predict(self, X):
+        return self.pipeline.predict(self._frame(X))
+
+    def decode(self, indices):
+        return self.label_encoder.inverse_transform(indices)
+
+    def predict_labels(self, X):
+        return self.decode(self.predict(X))
+
+    def with_threads(self, nthread):
+        """A copy of this engine whose booster runs on nthread threads."""
+        import copy
+
+        pipeline = copy.deepcopy(self.pipeline)
+        classifier = pipeline.named_steps["classifier"]
+        classifier.set_params(n_jobs=nthread)
+        classifier.get_booster().set_param("nthread", nthread)
+        return PipelinePredictor(pipeline, self.label_encoder, self.feature_columns)
+
+
+def scaler_params(pipeline, feature_columns):
+    """
+    Return (mean, scale) of the StandardScaler inside a fitted
+    Pipeline(preprocessor, classifier). Raises ValueError if the
+    preprocessor is not a single StandardScaler over FEATURE_COLUMNS.
+    """
+    preprocessor = pipeline.named_steps["preprocessor"]
+
+    transformers = [
+        t for t in preprocessor.transformers_ if t[0] != "remainder"
+    ]
+    if len(transformers) != 1:
+        raise ValueError("Expected exactly one transformer in the preprocessor")
+
+    _, scaler, columns = transformers[0]
+    if list(columns) != list(feature_columns):
+        raise ValueError(
+            f"Preprocessor columns {list(columns)} do not match {list(feature_columns)}"
+        )
+
+    n_features = len(feature_columns)
+    mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+    scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+    return mean, scale
+
+
+def booster_iteration_range(classifier):
+    """Trees XGBClassifier.predict would use: up to best_iteration if set."""
+    try:
+        return (0, classifier.best_iteration + 1)
+    except AttributeError:
+        return (0, 0)   # no early stopping: use every tree
+
+
+class ScaledPredictor(ABC):
+    """
+    Shared plumbing for engines that apply the StandardScaler themselves
+    and decode class indices straight from the LabelEncoder classes.
+    Subclasses must implement predict_proba; one that does not cannot be
+    instantiated.
+    """
+
+    name = None
+
+    def __init__(self, mean, scale, classes):
+        self.mean = np.ascontiguousarray(mean, dtype=np.float64)
+        self.scale = np.ascontiguousarray(scale, dtype=np.float64)
+        self.classes = np.asarray(classes)
+
+    def transform(self, X):
+        """Scale rows and return a C-contiguous float32 matrix."""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        # Scale in float64 like StandardScaler does, then cast once so the
+        # trees see bit-identical inputs to the sklearn pipeline.
+        return np.ascontiguousarray((X - self.mean) / self.scale, dtype=np.float32)
+
+    @abstractmethod
+    def predict_proba(self, X):
+        """(n_rows, n_classes) probabilities for raw (unscaled) rows."""
+
+    def predict(self, X):
+        return np.argmax(self.predict_proba(X), axis=1)
+
+    def decode(self, indices):
+        return self.classes[indices]
+
+    def predict_labels(self, X):
+        return self.decode(self.predict(X))
+
+
+class CompiledPredictor(ScaledPredictor):
+    """
+    Pandas-free engine: standard scaling in NumPy followed by a direct
+    ``Booster.inplace_predict`` call.
+    """
+
+    name = "compiled"
+
+    def __init__(self, mean, scale, booster, classes, iteration_range=(0, 0)):
+        super().__init__(mean, scale, classes)
+        self.booster = booster
+        self.iteration_range = tuple(iteration_range)
+
+    @classmethod
+    def from_pipeline(cls, pipeline, label_encoder, feature_columns):
+        """Build the engine from a fitted Pipeline(preprocessor, classifier)."""
+        classifier = pipeline.named_steps["classifier"]
+        mean, scale = scaler_params(pipeline, feature_columns)
+
+        return cls(
+            mean,
+            scale,
+            classifier.get_booster(),
+            label_encoder.classes_,
+            iteration_range=booster_iteration_range(classifier),
+        )
+
+    def predict_proba(self, X):
+        proba = self.booster.inplace_predict(
+            self.transform(X), iteration_range=self.iteration_range
+        )
+        return proba.reshape(proba.shape[0], -1)
+
+    def with_threads(self, nthread):
+        """A copy of this engine whose booster runs on nthread threads."""
+        booster = self.booster.copy()
+        booster.set_param("nthread", nthread)
+        return CompiledPredictor(self.mean, self.scale, booster, self.classes,
+                                 iteration_range=self.iteration_range)
+
+
+def top_k(proba, classes, k):
+    """
+    The k most likely classes per row, best first.
+
+    Uses a partial sort over the whole (n_rows, n_classes) matrix, so the
+    cost is one argpartition plus a sort of k columns.
+    Returns (labels, probabilities), both shaped (n_rows, k).
+    """
+    k = min(int(k), proba.shape[1])
+    index = np.argpartition(-proba, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(proba, index, axis=1)
+
+    order = np.argsort(-top, axis=1, kind="stable")
+    index = np.take_along_axis(index, order, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return np.asarray(classes)[index], top
+
+
+# --------------------------------------------------
+# Parity check
+# --------------------------------------------------
+def parity_sample(mean, scale, n_rows=256, seed=0):
+    """Deterministic probe rows spread around the training distribution."""
+    rng = np.random.default_rng(seed)
+    return mean + scale * rng.uniform(-3.0, 3.0, size=(n_rows, len(mean)))
+
+
+def check_parity(candidate, reference, X, atol=1e-5):
+    """
+    Compare a candidate engine against the reference pipeline on X.
+    Raises AssertionError describing the first mismatch, if any.
+    """
+    expected = reference.predict_proba(X)
+    actual = candidate.predict_proba(X)
+
+    if actual.shape != expected.shape:
+        raise AssertionError(
+            f"{candidate.name}: probability shape {actual.shape} != {expected.shape}"
+        )
+
+    diff = np.abs(actual - expected)
+    if diff.max() > atol:
+        row = int(np.unravel_index(diff.argmax(), diff.shape)[0])
+        raise AssertionError(
+            f"{candidate.name}: max probability difference {diff.max():.2e} "
+            f"exceeds {atol:.0e} (row {row})"
+        )
+
+    mismatched = np.flatnonzero(
+        np.argmax(actual, axis=1) != np.argmax(expected, axis=1)
+    )
+    if mismatched.size:
+        raise AssertionError(
+            f"{candidate.name}: {mismatched.size} predicted classes differ "
+            f"(first at row {int(mismatched[0])})"
+        )
+
+
+ENGINES = ("pipeline", "compiled", "numpy")
+
+
+def _compile(engine, pipeline, label_encoder, feature_columns):
+    if engine == "compiled":
+        return CompiledPredictor.from_pipeline(pipeline, label_encoder, feature_columns)
+
+    from tree_engine import NumpyTreePredictor
+    return NumpyTreePredictor.from_pipeline(pipeline, label_encoder, feature_columns)
+
+
+def build_predictor(engine, pipeline, label_encoder, feature_columns, logger=None):
+    """
+    Create the requested engine and verify it against the pipeline.
+    Falls back to the pipeline engine if compilation or parity fails.
+    """
+    reference = PipelinePredictor(pipeline, label_encoder, feature_columns)
+    if engine == "pipeline":
+        return reference
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown INFERENCE_ENGINE {engine!r}; expected one of {ENGINES}")
+
+    try:
+        candidate = _compile(engine, pipeline, label_encoder, feature_columns)
+        check_parity(candidate, reference, parity_sample(candidate.mean, candidate.scale))
+    except (ValueError, AssertionError, KeyError) as e:
+        if logger is not None:
+            logger.warning("Inference engine %r disabled, using pipeline: %s", engine, e)
+        return reference
+
+    return candidate
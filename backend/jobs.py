@@ -0,0 +1,301 @@
+"""
+Asynchronous batch jobs with results spooled to disk.
+
+    POST   /jobs                 upload a file, get a job id back (202)
+    GET    /jobs/<id>            state and progress
+    GET    /jobs/<id>/result     download the scored file once done
+    DELETE /jobs/<id>            cancel and remove
+
+Each job lives in its own directory under JOB_DIR:
+
+    job.json       state, options and progress (replaced atomically)
+    input          the uploaded file, as received
+    result.csv     scored rows, appended one chunk at a time (or .ndjson)
+    lock           flock()ed by the process working on the job
+
+Jobs run in a small thread pool inside each server process; there is no
+broker. After every chunk the result file is flushed and job.json records
+how many chunks and result bytes are complete. A process that finds an
+unfinished job whose lock is free (its worker crashed or was recycled)
+truncates the result to the last recorded size and carries on from the
+next chunk. The lock keeps two processes from working on the same job.
+"""
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ACTIVE_STATES = ("queued", "running")
+
+
+class UnknownJobError(LookupError):
+    """No job with this id (or it has been removed)."""
+
+
+class JobNotReadyError(RuntimeError):
+    """The job has no result (yet)."""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, job_dir, read_chunks, score_chunk, max_workers=2,
+                 rescan_interval=10.0, retention=86400.0, logger=None):
+        """
+        read_chunks : callable(stream, job) -> iterator of DataFrame chunks
+        score_chunk : callable(chunk, job, first) -> encoded text for the
+                      result file (first is True for the job's first chunk)
+        """
+        self.job_dir = job_dir
+        self.read_chunks = read_chunks
+        self.score_chunk = score_chunk
+        self.max_workers = int(max_workers)
+        self.rescan_interval = float(rescan_interval)
+        self.retention = float(retention)
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._scheduled = set()     # job ids queued or running in this process
+        os.makedirs(job_dir, exist_ok=True)
+
+    # --------------------------------------------------
+    # Public API
+    # --------------------------------------------------
+    def submit(self, upload, options, check=None):
+        """
+        Spool an upload (a FileStorage) to disk and queue it.
+        options : JSON-serialisable dict; at least "format" (csv|ndjson),
+                  passed to read_chunks / score_chunk as part of the job.
+        check   : optional callable(input_path, options) run before the job
+                  is queued; whatever it raises is passed on and the job
+                  is discarded. May add entries to options.
+        """
+        job_id = uuid.uuid4().hex
+        path = self._path(job_id)
+        os.makedirs(path)
+        upload.save(os.path.join(path, "input"))
+
+        if check is not None:
+            try:
+                check(os.path.join(path, "input"), options)
+            except Exception:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+
+        job = dict(options)
+        job.update({
+            "job_id": job_id,
+            "state": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "attempts": 0,
+            "chunks_done": 0,
+            "rows_done": 0,
+            "result_bytes": 0,
+            "error": None,
+        })
+        self._write(job)
+        self._schedule(job_id)
+        return job
+
+    def status(self, job_id):
+        job = self._read(job_id)
+        rows_total = job.get("rows_total")
+        if job["state"] == "done":
+            job["progress"] = 1.0
+        elif rows_total:
+            job["progress"] = round(min(job["rows_done"] / rows_total, 1.0), 4)
+        else:
+            job["progress"] = None
+        return job
+
+    def result_path(self, job_id):
+        job = self._read(job_id)
+        if job["state"] != "done":
+            raise JobNotReadyError(f"Job {job_id} is {job['state']}")
+        return os.path.join(self._path(job_id), _result_name(job))
+
+    def delete(self, job_id):
+        """Remove a job; a running job is cancelled before its next chunk."""
+        self._read(job_id)                                  # raises if unknown
+        path = self._path(job_id)
+        try:
+            open(os.path.join(path, "cancel"), "w").close()
+        except OSError:
+            raise UnknownJobError(job_id)
+
+        lock = _try_lock(path)
+        if lock is not None:                                # nobody is working on it
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                lock.close()
+
+    def start(self):
+        """
+        Start this process's worker pool and rescan thread, and adopt any
+        unfinished jobs. Threads do not survive fork(), so each pre-forked
+        worker calls this for itself (safe to call repeatedly).
+        """
+        pid = os.getpid()
+        if self._pool_pid == pid:
+            return
+        with self._lock:
+            if self._pool_pid == pid:
+                return
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="batch-job")
+            self._pool_pid = pid
+            self._scheduled = set()
+        threading.Thread(target=self._rescan_loop, name="job-rescan", daemon=True).start()
+
+    def rescan(self):
+        """Queue unfinished jobs nobody is working on; drop expired ones."""
+        now = time.time()
+        for job_id in os.listdir(self.job_dir):
+            try:
+                job = self._read(job_id)
+            except UnknownJobError:
+                continue
+            if job["state"] in ACTIVE_STATES:
+                self._schedule(job_id)
+            elif job["finished_at"] and now - job["finished_at"] > self.retention:
+                path = self._path(job_id)
+                lock = _try_lock(path)
+                if lock is not None:
+                    shutil.rmtree(path, ignore_errors=True)
+                    lock.close()
+
+    # --------------------------------------------------
+    # Worker
+    # --------------------------------------------------
+    def _schedule(self, job_id):
+        self.start()
+        with self._lock:
+            if job_id in self._scheduled:
+                return
+            self._scheduled.add(job_id)
+        self._pool.submit(self._run, job_id)
+
+    def _rescan_loop(self):
+        while True:
+            try:
+                self.rescan()
+            except OSError as e:
+                self._log("warning", "Job rescan failed: %s", e)
+            time.sleep(self.rescan_interval)
+
+    def _run(self, job_id):
+        path = self._path(job_id)
+        lock = None
+        try:
+            lock = _try_lock(path)
+            if lock is None:
+                return                      # another process has it
+            job = self._read(job_id)
+            if job["state"] not in ACTIVE_STATES:
+                return
+            self._process(job)
+        except UnknownJobError:
+            pass
+        except JobCancelled:
+            shutil.rmtree(path, ignore_errors=True)
+        except Exception as e:
+            self._log("exception", "Batch job %s failed", job_id)
+            try:
+                job = self._read(job_id)
+                job.update(state="failed", error=str(e), finished_at=time.time())
+                self._write(job)
+            except (UnknownJobError, OSError):
+                pass
+        finally:
+            if lock is not None:
+                lock.close()
+            with self._lock:
+                self._scheduled.discard(job_id)
+
+    def _process(self, job):
+        path = self._path(job["job_id"])
+        resume_from = job["chunks_done"]
+        job.update(state="running", attempts=job["attempts"] + 1)
+        job["started_at"] = job["started_at"] or time.time()
+        self._write(job)
+        if resume_from:
+            self._log("info", "Resuming batch job %s at chunk %d", job["job_id"], resume_from)
+
+        with open(os.path.join(path, "input"), "rb") as source, \
+                open(os.path.join(path, _result_name(job)), "ab") as result:
+            # Drop anything written after the last chunk recorded as done
+            result.truncate(job["result_bytes"])
+            result.seek(job["result_bytes"])
+
+            for index, chunk in enumerate(self.read_chunks(source, job)):
+                if index < resume_from:
+                    continue
+                if os.path.exists(os.path.join(path, "cancel")):
+                    raise JobCancelled()
+
+                data = self.score_chunk(chunk, job, index == 0).encode("utf-8")
+                result.write(data)
+                result.flush()
+
+                job["chunks_done"] = index + 1
+                job["rows_done"] += len(chunk)
+                job["result_bytes"] += len(data)
+                self._write(job)
+
+        job.update(state="done", finished_at=time.time())
+        self._write(job)
+
+    # --------------------------------------------------
+    # Storage
+    # --------------------------------------------------
+    def _path(self, job_id):
+        # Job ids are uuid4 hex; anything else cannot name a job directory
+        if not (len(job_id) == 32 and all(c in "0123456789abcdef" for c in job_id)):
+            raise UnknownJobError(job_id)
+        return os.path.join(self.job_dir, job_id)
+
+    def _read(self, job_id):
+        try:
+            with open(os.path.join(self._path(job_id), "job.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UnknownJobError(job_id)
+
+    def _write(self, job):
+        path = os.path.join(self._path(job["job_id"]), "job.json")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, path)
+
+    def _log(self, level, *args):
+        if self.logger is not None:
+            getattr(self.logger, level)(*args)
+
+
+def _result_name(job):
+    return f"result.{job['format']}"
+
+
+def _try_lock(path):
+    """Open and flock path/lock without blocking; None if someone holds it."""
+    try:
+        f = open(os.path.join(path, "lock"), "a")
+    except OSError:
+        return None
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
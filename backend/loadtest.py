@@ -0,0 +1,396 @@
+"""
+Load test and latency benchmark for a running backend.
+
+    python loadtest.py predict --concurrency 1,8,32 --duration 10
+    python loadtest.py predict --rate 100,200,400 --concurrency 64
+    python loadtest.py batch --batch-sizes 1,100,10000 --concurrency 4
+    python loadtest.py replay --mix recorded.jsonl --concurrency 8
+    python loadtest.py predict --output after.json --compare before.json
+
+Every combination of --concurrency, --rate and --batch-sizes is one run.
+Each run reports throughput, rows/s and p50/p95/p99 latency, and
+--output saves everything (plus the server's model version and engine
+from GET /ready) as JSON. --compare prints the change against an earlier
+results file, run by run.
+
+Without --rate the test is closed-loop: each of --concurrency clients
+sends its next request as soon as the previous one returns. With
+--rate the requests are sent on a fixed schedule (open loop) and
+latency is counted from when a request was due, so a server that falls
+behind shows up as queueing time, not as fewer requests.
+
+A --mix file replays recorded requests in order (cycling), one JSON
+object per line:
+
+    {"path": "/predict", "json": {"N": 90, "P": 42, ...}}
+    {"path": "/batch_predict?top_k=3", "file": "sample_batch.csv"}
+
+Requests are sent with http.client over one keep-alive connection per
+client thread, so the harness adds little latency of its own.
+"""
+import argparse
+import csv
+import http.client
+import itertools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+SCENARIOS = ("predict", "batch", "replay")
+
+
+def parse_list(value, cast=int):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+# --------------------------------------------------
+# Requests
+# --------------------------------------------------
+class Request:
+    def __init__(self, method, path, body=b"", content_type=None, rows=1):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = {"Content-Type": content_type} if content_type else {}
+        self.rows = rows
+
+
+def multipart(filename, data, content_type="text/csv"):
+    """Encode one file field called 'file'; returns (body, content type)."""
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def with_params(path, params):
+    if not params:
+        return path
+    return path + ("&" if "?" in path else "?") + urlencode(params)
+
+
+def load_sample_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def predict_requests(rows, params):
+    """One /predict request per sample row, cycled."""
+    path = with_params("/predict", params)
+    return [
+        Request("POST", path, json.dumps({k: float(v) for k, v in row.items()}).encode(),
+                "application/json")
+        for row in rows
+    ]
+
+
+def batch_requests(rows, batch_size, params):
+    """A single /batch_predict upload of batch_size rows (sample rows repeated)."""
+    columns = list(rows[0])
+    lines = [",".join(columns)]
+    for row in itertools.islice(itertools.cycle(rows), batch_size):
+        lines.append(",".join(row[c] for c in columns))
+    body, content_type = multipart("batch.csv", ("\n".join(lines) + "\n").encode())
+    return [Request("POST", with_params("/batch_predict", params), body, content_type,
+                    rows=batch_size)]
+
+
+def replay_requests(mix_path, params):
+    """Requests recorded in a --mix file (see module docstring)."""
+    base = os.path.dirname(os.path.abspath(mix_path))
+    requests = []
+    with open(mix_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            path = with_params(record["path"], params)
+            method = record.get("method", "POST")
+            if "file" in record:
+                file_path = os.path.join(base, record["file"])
+                with open(file_path, "rb") as upload:
+                    data = upload.read()
+                body, content_type = multipart(os.path.basename(file_path), data)
+                rows = max(data.count(b"\n") - 1, 1)
+                requests.append(Request(method, path, body, content_type, rows))
+            elif "json" in record:
+                requests.append(Request(method, path, json.dumps(record["json"]).encode(),
+                                        "application/json"))
+            else:
+                requests.append(Request(method, path))
+    if not requests:
+        raise ValueError(f"{mix_path} has no requests")
+    return requests
+
+
+# --------------------------------------------------
+# Load generation
+# --------------------------------------------------
+class Client:
+    """One keep-alive connection, reopened after errors."""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.conn = None
+
+    def send(self, request):
+        """Returns the status code, or 0 if the request failed outright."""
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.conn.request(request.method, self.prefix + request.path,
+                              body=request.body or None, headers=request.headers)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def run_load(url, requests, concurrency, duration, rate=None, max_requests=None, timeout=60.0):
+    """
+    Drive requests (cycled) at the server for duration seconds.
+    Returns a list of (latency seconds, status, rows) and the elapsed time.
+    """
+    counter = itertools.count()
+    results = []
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker():
+        client = Client(url, timeout)
+        local = []
+        while True:
+            i = next(counter)
+            if max_requests is not None and i >= max_requests:
+                break
+            due = start + i / rate if rate else time.perf_counter()
+            if due >= deadline:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            request = requests[i % len(requests)]
+            status = client.send(request)
+            # Open loop: latency includes any time the request waited for a client
+            local.append((time.perf_counter() - due, status, request.rows))
+        client.close()
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    latencies = np.array([r[0] for r in results]) * 1000
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [r for r in results if 200 <= r[1] < 300]
+
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "status_counts": statuses,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "rows_per_second": round(sum(r[2] for r in ok) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": None,
+    }
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary["latency_ms"] = {
+            "mean": round(float(latencies.mean()), 3),
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+            "max": round(float(latencies.max()), 3),
+        }
+    return summary
+
+
+# --------------------------------------------------
+# Reporting
+# --------------------------------------------------
+def run_key(run):
+    return (run["scenario"], run["batch_size"], run["concurrency"], run["rate"],
+            json.dumps(run["params"], sort_keys=True))
+
+
+def describe_run(run):
+    label = run["scenario"]
+    if run["batch_size"] is not None:
+        label += f" rows={run['batch_size']}"
+    label += f" c={run['concurrency']}"
+    if run["rate"]:
+        label += f" rate={run['rate']:g}/s"
+    return label
+
+
+def format_run(run):
+    latency = run["latency_ms"] or {}
+    return (
+        f"{describe_run(run):<32} {run['throughput_rps']:>9.1f} req/s "
+        f"{run['rows_per_second']:>11.0f} rows/s  "
+        f"p50 {latency.get('p50', float('nan')):>8.2f}  "
+        f"p95 {latency.get('p95', float('nan')):>8.2f}  "
+        f"p99 {latency.get('p99', float('nan')):>8.2f} ms  "
+        f"errors {run['errors']}"
+    )
+
+
+def compare(previous, runs):
+    """Print the change of each run against the matching run of an earlier results file."""
+    before = {run_key(run): run for run in previous["runs"]}
+    print(f"\nCompared with {previous.get('created_at', 'previous run')}:")
+    for run in runs:
+        old = before.get(run_key(run))
+        if old is None or not old["latency_ms"] or not run["latency_ms"]:
+            print(f"{describe_run(run):<32} (no matching run)")
+            continue
+
+        def change(new, prev):
+            return f"{(new - prev) / prev * 100:+6.1f}%" if prev else "   n/a"
+
+        print(
+            f"{describe_run(run):<32} "
+            f"throughput {change(run['throughput_rps'], old['throughput_rps'])}  "
+            f"p50 {change(run['latency_ms']['p50'], old['latency_ms']['p50'])}  "
+            f"p99 {change(run['latency_ms']['p99'], old['latency_ms']['p99'])}"
+        )
+
+
+def server_info(url, timeout=5.0):
+    """Model version, fingerprint and engine from GET /ready (None if unavailable)."""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+    try:
+        conn.request("GET", parts.path.rstrip("/") + "/ready")
+        info = json.loads(conn.getresponse().read())
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
+    keys = ("model_version", "model_fingerprint", "inference_engine", "ready")
+    return {key: info.get(key) for key in keys}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a running Crop Recommendation API")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", default="8",
+                        help="client threads; comma-separated to sweep (default 8)")
+    parser.add_argument("--rate", default="",
+                        help="requests/s for an open-loop test; comma-separated to sweep "
+                             "(default: closed loop)")
+    parser.add_argument("--batch-sizes", default="1,10,100,1000,10000",
+                        help="rows per /batch_predict upload (batch scenario)")
+    parser.add_argument("--mix", help="recorded requests to replay, JSON lines (replay scenario)")
+    parser.add_argument("--sample", default=os.path.join(os.path.dirname(__file__),
+                                                         "sample_batch.csv"),
+                        help="CSV the predict/batch payloads are built from")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra query parameter, e.g. top_k=3 or format=columnar")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--requests", type=int, help="stop each run after this many requests")
+    parser.add_argument("--warmup", type=float, default=2.0,
+                        help="seconds of unrecorded load before each run")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    params = dict(p.split("=", 1) for p in args.param)
+    concurrencies = parse_list(args.concurrency)
+    rates = parse_list(args.rate, float) or [None]
+
+    if args.scenario == "predict":
+        workloads = [(None, predict_requests(load_sample_rows(args.sample), params))]
+    elif args.scenario == "batch":
+        rows = load_sample_rows(args.sample)
+        workloads = [(size, batch_requests(rows, size, params))
+                     for size in parse_list(args.batch_sizes)]
+    else:
+        if not args.mix:
+            parser.error("the replay scenario needs --mix")
+        workloads = [(None, replay_requests(args.mix, params))]
+
+    server = server_info(args.url)
+    if server is None:
+        sys.exit(f"No server answering GET {args.url}/ready")
+    print(f"Server: {server['model_version']} ({server['inference_engine']}) at {args.url}")
+
+    runs = []
+    for (batch_size, requests), concurrency, rate in itertools.product(
+            workloads, concurrencies, rates):
+        if args.warmup > 0:
+            run_load(args.url, requests, concurrency, args.warmup, rate, timeout=args.timeout)
+        results, elapsed = run_load(args.url, requests, concurrency, args.duration, rate,
+                                    args.requests, args.timeout)
+        run = {
+            "scenario": args.scenario,
+            "batch_size": batch_size,
+            "concurrency": concurrency,
+            "rate": rate,
+            "params": params,
+        }
+        run.update(summarize(results, elapsed))
+        runs.append(run)
+        print(format_run(run), flush=True)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "url": args.url,
+        "server": server,
+        "client": {
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {
+            "duration": args.duration,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "mix": args.mix,
+        },
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), runs)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Process memory accounting for pre-fork deployments.
+
+RSS counts pages shared copy-on-write with the master as if every worker
+owned them. The figures that matter for "what does one more worker cost"
+are PSS (shared pages split between the processes mapping them) and
+private memory (pages only this process has touched).
+
+Report the master and all of its workers:
+
+    python memory.py <master-pid>
+"""
+import os
+import resource
+
+
+def process_memory(pid="self"):
+    """RSS / PSS / shared / private bytes of one process (Linux smaps_rollup)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        # No /proc (e.g. macOS): peak RSS of this process is all we can get
+        if pid != "self":
+            raise
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {"rss": usage.ru_maxrss * 1024}
+
+    kb = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == "kB":
+            kb[parts[0].rstrip(":")] = int(parts[1]) * 1024
+
+    return {
+        "rss": kb.get("Rss", 0),
+        "pss": kb.get("Pss", 0),
+        "shared": kb.get("Shared_Clean", 0) + kb.get("Shared_Dirty", 0),
+        "private": kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0),
+    }
+
+
+def format_memory(stats):
+    return ", ".join(f"{name}={value / 2**20:.1f}MiB" for name, value in stats.items())
+
+
+def child_pids(pid):
+    """Direct children of pid, found by scanning /proc/*/stat."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Fields after the parenthesised command name: state, ppid, ...
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        if ppid == int(pid):
+            children.append(int(entry))
+    return sorted(children)
+
+
+def report(master_pid):
+    """Memory of the master and each worker, plus the average worker cost."""
+    master = process_memory(master_pid)
+    workers = {pid: process_memory(pid) for pid in child_pids(master_pid)}
+    private = [stats["private"] for stats in workers.values()]
+
+    return {
+        "master": master,
+        "workers": workers,
+        "total_pss": master["pss"] + sum(stats["pss"] for stats in workers.values()),
+        "mean_private_per_worker": sum(private) / len(private) if private else 0,
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        sys.exit("usage: python memory.py <master-pid>")
+
+    summary = report(sys.argv[1])
+    print(f"master {sys.argv[1]}: {format_memory(summary['master'])}")
+    for pid, stats in summary["workers"].items():
+        print(f"worker {pid}: {format_memory(stats)}")
+    print(f"total PSS: {summary['total_pss'] / 2**20:.1f}MiB")
+    print(f"extra memory per worker (mean private): "
+          f"{summary['mean_private_per_worker'] / 2**20:.1f}MiB")
@@ -0,0 +1,199 @@
+"""
+In-process request metrics in the Prometheus text exposition format.
+
+Counters, gauges and fixed-bucket histograms are plain dicts behind a lock
+(an observation is one bisect plus a few additions), cheap enough to leave
+on in production. Each process keeps its own figures: with pre-forked
+workers every scrape of /metrics is answered by whichever worker gets it,
+labelled with its pid.
+
+Per-stage timing works through ``stages()``: while it is active, code
+anywhere below it (e.g. the model call) can ``mark("predict")`` to book
+the time since the previous mark to that stage. Stages are summed per
+request and observed once when the block ends; outside a timed block
+``mark`` does nothing.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds: 0.5ms .. 30s
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield self.name, self.labelnames, labelvalues, value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}       # labelvalues -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        # Index of the first bucket with upper bound >= value (or +Inf)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self._values.items()]
+
+        bucket_names = self.labelnames + ("le",)
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                yield (f"{self.name}_bucket", bucket_names,
+                       labelvalues + (_format_value(bound),), cumulative)
+            yield f"{self.name}_sum", self.labelnames, labelvalues, total
+            yield f"{self.name}_count", self.labelnames, labelvalues, count
+
+
+class MetricsRegistry:
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(f"{self.namespace}_{name}", documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(f"{self.namespace}_{name}", documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(
+            Histogram(f"{self.namespace}_{name}", documentation, labelnames, buckets)
+        )
+
+    def render(self):
+        """All metrics in the Prometheus text format (version 0.0.4)."""
+        pid = str(os.getpid())
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labelnames, labelvalues, value in metric.samples():
+                labels = _format_labels(labelnames + ("pid",), labelvalues + (pid,))
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# --------------------------------------------------
+# Per-stage timing
+# --------------------------------------------------
+class StageTimer:
+    def __init__(self, histogram, endpoint):
+        self.histogram = histogram
+        self.endpoint = endpoint
+        self.durations = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        """Book the time since the previous mark to stage."""
+        now = time.perf_counter()
+        self.durations[stage] = self.durations.get(stage, 0.0) + (now - self._last)
+        self._last = now
+
+    def finish(self):
+        for stage, seconds in self.durations.items():
+            self.histogram.observe(seconds, self.endpoint, stage)
+        self.durations = {}
+
+
+_current_timer = ContextVar("stage_timer", default=None)
+
+
+def start_stages(histogram, endpoint):
+    """Begin timing stages in the current context."""
+    _current_timer.set(StageTimer(histogram, endpoint))
+
+
+def finish_stages(last_stage=None):
+    """Close the last stage (if any stage was marked), record all stages and stop timing."""
+    timer = _current_timer.get()
+    _current_timer.set(None)
+    if timer is None or not timer.durations:
+        return
+    if last_stage is not None:
+        timer.mark(last_stage)
+    timer.finish()
+
+
+@contextmanager
+def stages(histogram, endpoint):
+    start_stages(histogram, endpoint)
+    try:
+        yield
+    finally:
+        finish_stages()
+
+
+def mark(stage):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.mark(stage)
@@ -0,0 +1,166 @@
+"""
+Latency-budgeted model selection.
+
+A hyperparameter search ranks candidates by their cross-validated score
+alone, yet the chosen model is paid for on every request. This module
+refits each candidate of a finished RandomizedSearchCV / GridSearchCV and
+measures what it costs to serve, through the same inference engine the
+backend would use:
+
+    single_row_ms      median time of one single-row predict_proba call
+    batch_us_per_row   time per row of a BATCH_ROWS-row predict_proba call
+    size_bytes         size of the pickled pipeline
+    n_trees            trees in the booster
+
+pareto_front() keeps the candidates no other candidate beats on both
+score and latency. select_model() returns the cheapest candidate whose
+score is within `tolerance` of the best:
+
+    candidates = evaluate_search(search, X_train, y_train, X_test, y_test, label_encoder, features)
+    print(format_candidates(pareto_front(candidates)))
+    chosen = select_model(candidates, tolerance=0.005)
+    pipeline = chosen["pipeline"]
+
+"score" is the search's cross-validated score (its `scoring`, f1_macro in
+the notebook). When evaluation labels are given, test accuracy is reported
+as well, but it is not used for the choice.
+"""
+import pickle
+import time
+
+import numpy as np
+
+from inference import build_predictor
+
+BATCH_ROWS = 1024
+SINGLE_CALLS = 200
+LATENCY_KEYS = ("single_row_ms", "batch_us_per_row")
+
+
+def measure(pipeline, label_encoder, X, feature_columns, engine="compiled"):
+    """Serving cost of a fitted pipeline on rows drawn from X."""
+    predictor = build_predictor(engine, pipeline, label_encoder, feature_columns)
+    X = np.asarray(X, dtype=np.float64)
+    batch = np.resize(X, (BATCH_ROWS, X.shape[1]))
+    singles = [X[i % len(X)][None, :] for i in range(SINGLE_CALLS)]
+
+    predictor.predict_proba(batch[:8])                  # lazy setup
+    single = []
+    for row in singles:
+        start = time.perf_counter()
+        predictor.predict_proba(row)
+        single.append(time.perf_counter() - start)
+    batch_seconds = []
+    for _ in range(3):
+        start = time.perf_counter()
+        predictor.predict_proba(batch)
+        batch_seconds.append(time.perf_counter() - start)
+
+    classifier = pipeline.named_steps["classifier"]
+    booster = classifier.get_booster()
+    n_trees = booster.num_boosted_rounds() * max(len(label_encoder.classes_), 1)
+    return {
+        "engine": predictor.name,
+        "single_row_ms": round(float(np.median(single)) * 1e3, 4),
+        "batch_us_per_row": round(min(batch_seconds) / BATCH_ROWS * 1e6, 3),
+        "size_bytes": len(pickle.dumps(pipeline, protocol=pickle.HIGHEST_PROTOCOL)),
+        "n_trees": int(n_trees),
+    }
+
+
+def evaluate_search(search, X_train, y_train, X_eval, y_eval, label_encoder, feature_columns,
+                    engine="compiled", log=print, indices=None, fit=None):
+    """
+    Refit candidates of a finished search on the training data and measure
+    them. Returns one dict per candidate: params, score, score_std,
+    test_accuracy (None without y_eval), the pipeline and measure()'s keys.
+
+    indices limits this to some rows of cv_results_ (default: all of them);
+    fit(params) returns the fitted pipeline for a candidate (default: the
+    search's estimator with those params, fitted on X_train).
+    """
+    from sklearn.base import clone
+
+    results = search.cv_results_
+    if indices is None:
+        indices = range(len(results["params"]))
+    candidates = []
+    for n, i in enumerate(indices):
+        params = results["params"][i]
+        if fit is not None:
+            pipeline = fit(params)
+        elif i == search.best_index_ and getattr(search, "refit", False):
+            pipeline = search.best_estimator_
+        else:
+            pipeline = clone(search.estimator).set_params(**params).fit(X_train, y_train)
+
+        candidate = {
+            "params": params,
+            "score": float(results["mean_test_score"][i]),
+            "score_std": float(results["std_test_score"][i]),
+            "test_accuracy": None,
+            "pipeline": pipeline,
+        }
+        if y_eval is not None:
+            predicted = pipeline.predict(X_eval)
+            candidate["test_accuracy"] = float((predicted == np.asarray(y_eval)).mean())
+        candidate.update(measure(pipeline, label_encoder, X_eval, feature_columns, engine))
+        candidates.append(candidate)
+        if log is not None:
+            log(f"[{n + 1}/{len(indices)}] score={candidate['score']:.4f} "
+                f"single={candidate['single_row_ms']:.3f}ms "
+                f"batch={candidate['batch_us_per_row']:.2f}us/row trees={candidate['n_trees']}")
+    return candidates
+
+
+def pareto_front(candidates, latency="single_row_ms"):
+    """Candidates not beaten on both score and latency by another one, fastest first."""
+    if latency not in LATENCY_KEYS:
+        raise ValueError(f"latency must be one of {LATENCY_KEYS}")
+    front = []
+    best_score = -np.inf
+    # Fastest first; a candidate is on the front if it scores better than
+    # every faster one
+    for candidate in sorted(candidates, key=lambda c: (c[latency], -c["score"])):
+        if candidate["score"] > best_score:
+            front.append(candidate)
+            best_score = candidate["score"]
+    return front
+
+
+def select_model(candidates, tolerance=0.005, latency="single_row_ms"):
+    """The fastest candidate whose score is at most `tolerance` below the best score."""
+    if latency not in LATENCY_KEYS:
+        raise ValueError(f"latency must be one of {LATENCY_KEYS}")
+    best = max(candidate["score"] for candidate in candidates)
+    eligible = [c for c in candidates if c["score"] >= best - tolerance]
+    return min(eligible, key=lambda c: (c[latency], -c["score"]))
+
+
+def format_candidates(candidates):
+    lines = [f"{'score':>7} {'test acc':>9} {'single ms':>10} {'batch us/row':>13} "
+             f"{'size KiB':>9} {'trees':>6}  params"]
+    for c in candidates:
+        accuracy = "-" if c["test_accuracy"] is None else f"{c['test_accuracy']:.4f}"
+        params = ", ".join(f"{key.split('__')[-1]}={value}"
+                           for key, value in sorted(c["params"].items()))
+        lines.append(f"{c['score']:>7.4f} {accuracy:>9} {c['single_row_ms']:>10.3f} "
+                     f"{c['batch_us_per_row']:>13.2f} {c['size_bytes'] / 1024:>9.0f} "
+                     f"{c['n_trees']:>6}  {params}")
+    return "\n".join(lines)
+
+
+def search_report(candidates, chosen, tolerance, latency="single_row_ms"):
+    """JSON-serialisable summary: every candidate (without pipelines), the front, the choice."""
+    def strip(candidate):
+        return {key: value for key, value in candidate.items() if key != "pipeline"}
+
+    front = pareto_front(candidates, latency)
+    return {
+        "tolerance": tolerance,
+        "latency": latency,
+        "best_score": max(c["score"] for c in candidates),
+        "chosen": strip(chosen),
+        "pareto_front": [strip(c) for c in front],
+        "candidates": [strip(c) for c in candidates],
+    }
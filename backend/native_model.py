@@ -0,0 +1,106 @@
+"""
+Native model export for fast cold starts.
+
+    python native_model.py crop_recommendation_model.joblib model_native/
+
+Unpickling the sklearn Pipeline imports pandas, scikit-learn and xgboost
+and rebuilds every estimator object. The export step writes the parts the
+serving engines actually use into MODEL_NATIVE_DIR instead:
+
+    booster.ubj      the XGBoost booster in xgboost's native binary format
+                     (INFERENCE_ENGINE=compiled)
+    trees.npz        the same trees flattened for INFERENCE_ENGINE=numpy,
+                     which loads with NumPy alone
+    preprocess.npz   StandardScaler mean/scale, label classes, feature
+                     names and the booster iteration range
+
+Both engines are parity-checked against the pipeline before anything is
+written, so the serving process does not need the pipeline to check them.
+"""
+import os
+
+import numpy as np
+
+from inference import CompiledPredictor, PipelinePredictor, check_parity, parity_sample
+
+BOOSTER_FILE = "booster.ubj"
+TREES_FILE = "trees.npz"
+PREPROCESS_FILE = "preprocess.npz"
+
+
+def native_files(model_dir, engine):
+    """Files the given engine loads from model_dir."""
+    model_file = TREES_FILE if engine == "numpy" else BOOSTER_FILE
+    return [os.path.join(model_dir, PREPROCESS_FILE), os.path.join(model_dir, model_file)]
+
+
+def export_native(artifacts, model_dir, feature_columns):
+    from tree_engine import NumpyTreePredictor
+
+    pipeline, label_encoder = artifacts["model"], artifacts["label_encoder"]
+    reference = PipelinePredictor(pipeline, label_encoder, feature_columns)
+    compiled = CompiledPredictor.from_pipeline(pipeline, label_encoder, feature_columns)
+    trees = NumpyTreePredictor.from_pipeline(pipeline, label_encoder, feature_columns)
+
+    probe = parity_sample(compiled.mean, compiled.scale)
+    check_parity(compiled, reference, probe)
+    check_parity(trees, reference, probe)
+
+    os.makedirs(model_dir, exist_ok=True)
+    compiled.booster.save_model(os.path.join(model_dir, BOOSTER_FILE))
+    trees.save(os.path.join(model_dir, TREES_FILE))
+    np.savez(
+        os.path.join(model_dir, PREPROCESS_FILE),
+        mean=compiled.mean,
+        scale=compiled.scale,
+        classes=np.asarray(compiled.classes, dtype=str),
+        feature_columns=np.asarray(feature_columns, dtype=str),
+        iteration_range=np.asarray(compiled.iteration_range),
+    )
+
+
+def load_native(model_dir, engine, feature_columns):
+    """
+    Build a predictor from an exported directory. "numpy" needs only NumPy;
+    any other engine loads booster.ubj, importing xgboost at this point.
+    """
+    with np.load(os.path.join(model_dir, PREPROCESS_FILE), allow_pickle=False) as data:
+        preprocess = {name: data[name] for name in data.files}
+
+    if list(preprocess["feature_columns"]) != list(feature_columns):
+        raise ValueError(
+            f"Exported model expects {list(preprocess['feature_columns'])}, "
+            f"not {list(feature_columns)}"
+        )
+
+    if engine == "numpy":
+        from tree_engine import NumpyTreePredictor
+        return NumpyTreePredictor.load(os.path.join(model_dir, TREES_FILE))
+
+    import xgboost
+
+    booster = xgboost.Booster()
+    booster.load_model(os.path.join(model_dir, BOOSTER_FILE))
+    return CompiledPredictor(
+        preprocess["mean"],
+        preprocess["scale"],
+        booster,
+        preprocess["classes"],
+        iteration_range=tuple(int(i) for i in preprocess["iteration_range"]),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import joblib
+
+    from contract import FEATURE_COLUMNS
+
+    parser = argparse.ArgumentParser(description="Export the model for fast cold starts")
+    parser.add_argument("artifact", help="crop_recommendation_model.joblib")
+    parser.add_argument("model_dir", help="output directory (MODEL_NATIVE_DIR)")
+    args = parser.parse_args()
+
+    export_native(joblib.load(args.artifact), args.model_dir, FEATURE_COLUMNS)
+    print(f"Exported {args.artifact} to {args.model_dir}")
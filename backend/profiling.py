@@ -0,0 +1,280 @@
+"""
+On-demand profiling of individual requests.
+
+A request is profiled when it carries the admin header
+``X-Profile-Token: <PROFILE_TOKEN>``, or when it is picked at random with
+probability PROFILE_SAMPLE_RATE. With neither configured the profiled
+views are not even wrapped, so profiling costs nothing when it is off.
+
+Two profilers are available (PROFILE_MODE):
+
+    cprofile   deterministic: every call is recorded (cProfile). Precise
+               call counts, but adds noticeable overhead to Python-heavy
+               code. Saved as <request_id>.prof for pstats / snakeviz.
+    sample     a background thread records the request thread's stack
+               every PROFILE_SAMPLE_INTERVAL_MS. Cheap, and shows where
+               wall time goes (including waits). Saved as <request_id>.txt
+               in the collapsed-stack format read by flamegraph.pl and
+               speedscope.
+
+Each profile is written to PROFILE_DIR with a <request_id>.json sidecar
+(endpoint, status, duration, ...). Only the newest PROFILE_KEEP profiles
+are kept. For streamed responses the profiler is switched on while each
+chunk is produced, and the profile is saved when the stream ends.
+
+Only one request per process is profiled at a time: sampled requests
+arriving meanwhile are served normally.
+
+The /admin/profiles routes require PROFILE_TOKEN. Without it they answer
+404, even when PROFILE_SAMPLE_RATE saves profiles.
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+PROFILE_MODES = ("cprofile", "sample")
+
+# Request ids name files, so only a conservative alphabet is accepted
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+_EXTENSIONS = {"cprofile": ".prof", "sample": ".txt"}
+
+
+class UnknownProfileError(LookupError):
+    """No saved profile with this request id."""
+
+
+# --------------------------------------------------
+# Sampling profiler
+# --------------------------------------------------
+class SamplingProfiler:
+    """Samples the stack of the thread that enabled it; same interface as cProfile.Profile."""
+
+    def __init__(self, interval=0.005):
+        self.interval = float(interval)
+        self.stacks = Counter()
+        self._thread_id = None
+        self._sampler = None
+        self._running = False       # sampling (between enable and disable)
+        self._stopped = False       # sampler thread asked to exit
+
+    def enable(self):
+        self._thread_id = threading.get_ident()
+        self._running = True
+        if self._sampler is None:
+            # One thread for the whole profile; a streamed response
+            # enables and disables the profiler for every chunk
+            self._sampler = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def disable(self):
+        self._running = False
+
+    def _run(self):
+        while not self._stopped:
+            if self._running:
+                frame = sys._current_frames().get(self._thread_id)
+                if frame is not None:
+                    self.stacks[_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._running = False
+        self._stopped = True
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def dump_stats(self, path):
+        self.stop()
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _collapse(frame):
+    """Root-first 'function (file:line);...' for one stack."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# --------------------------------------------------
+# Profile storage
+# --------------------------------------------------
+class ProfileStore:
+    def __init__(self, directory, keep=50):
+        self.directory = directory
+        self.keep = max(int(keep), 1)
+
+    def save(self, profile, meta):
+        """Write a finished profile and its metadata, then drop the oldest profiles."""
+        request_id = meta["request_id"]
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(self._file(request_id, meta["mode"]))
+
+        path = self._file(request_id, "json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+        self.prune()
+
+    def list(self):
+        """Metadata of the saved profiles, newest first."""
+        profiles = []
+        if not os.path.isdir(self.directory):
+            return profiles
+        for entry in os.listdir(self.directory):
+            if entry.endswith(".json"):
+                try:
+                    profiles.append(self.meta(entry[:-len(".json")]))
+                except UnknownProfileError:
+                    continue                # removed meanwhile
+        return sorted(profiles, key=lambda meta: meta["started_at"], reverse=True)
+
+    def meta(self, request_id):
+        try:
+            with open(self._file(request_id, "json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UnknownProfileError(request_id)
+
+    def path(self, request_id):
+        """(path, mode) of a saved profile."""
+        mode = self.meta(request_id)["mode"]
+        path = self._file(request_id, mode)
+        if not os.path.exists(path):
+            raise UnknownProfileError(request_id)
+        return path, mode
+
+    def text(self, request_id, sort="cumulative", limit=40):
+        """A readable report: the pstats table for cProfile, the collapsed stacks otherwise."""
+        path, mode = self.path(request_id)
+        if mode != "cprofile":
+            with open(path) as f:
+                return f.read()
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def prune(self):
+        for meta in self.list()[self.keep:]:
+            for suffix in (meta["mode"], "json"):
+                try:
+                    os.remove(self._file(meta["request_id"], suffix))
+                except OSError:
+                    pass
+
+    def _file(self, request_id, kind):
+        if not _REQUEST_ID.match(request_id or ""):
+            raise UnknownProfileError(request_id)
+        return os.path.join(self.directory, request_id + _EXTENSIONS.get(kind, "." + kind))
+
+
+# --------------------------------------------------
+# Request selection
+# --------------------------------------------------
+class RequestProfiler:
+    def __init__(self, store, token=None, sample_rate=0.0, mode="cprofile", interval=0.005):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown PROFILE_MODE {mode!r}; expected one of {PROFILE_MODES}")
+        self.store = store
+        self.token = token or None
+        self.sample_rate = float(sample_rate)
+        self.mode = mode
+        self.interval = float(interval)
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.token is not None or self.sample_rate > 0
+
+    def authorized(self, token):
+        """Whether an admin token is valid (never, when no PROFILE_TOKEN is set)."""
+        if self.token is None:
+            return False
+        return token is not None and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def start(self, token=None):
+        """
+        Begin profiling this request if it asked for it with the admin token
+        or is sampled. Returns an enabled profiler, or None (then call
+        nothing else).
+        """
+        asked = self.authorized(token)
+        if not asked and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile() if self.mode == "cprofile" else SamplingProfiler(self.interval)
+        profile.enable()
+        return profile
+
+    def finish(self, profile, meta):
+        """Stop and save a profile started by start(); meta must carry request_id."""
+        try:
+            profile.disable()
+            meta.update(mode=self.mode, pid=os.getpid())
+            self.store.save(profile, meta)
+        finally:
+            self._busy.release()
+
+
+def request_id(header_value=None):
+    """The caller's X-Request-ID when it is usable as a file name, else a new id."""
+    if header_value and _REQUEST_ID.match(header_value):
+        return header_value
+    return uuid.uuid4().hex
+
+
+class ProfiledChunks:
+    """
+    A streamed response body with the profiler on only while each chunk is
+    produced. on_close() runs once, when the stream ends or is closed (even
+    before the first chunk, e.g. on a client disconnect).
+    """
+
+    def __init__(self, chunks, profile, on_close):
+        self._iterator = iter(chunks)
+        self.profile = profile
+        self.on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.profile.enable()
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self.profile.disable()
+            self.close()
+            raise
+        finally:
+            self.profile.disable()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._iterator, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self.on_close()
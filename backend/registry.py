@@ -0,0 +1,408 @@
+"""
+Resident model versions, hot reload and traffic routing.
+
+Every loaded model is a ``ModelVersion``. A request picks its version once,
+at the start, and keeps that object for its whole lifetime (including a
+streamed response), so swapping the default never changes the model under
+an in-flight request; the old version is simply dropped once nothing
+references it.
+
+``ArtifactWatcher`` polls MODEL_WATCH_DIR for new or changed artifacts:
+``*.joblib`` files and native model directories (see native_model.py).
+Each is loaded and checked against the golden input set in the watcher
+thread, and only registered once it passes. Write artifacts under a
+temporary name and rename them into place; other names are ignored.
+
+The same directory may hold a ``routing.json``:
+
+    {
+        "default": "crop_recommendation_model_v2",
+        "split": {"version": "crop_recommendation_model_v3",
+                  "percent": 10, "mode": "canary"}
+    }
+
+"default" pins the version served when a request does not ask for one
+(otherwise the newest version loaded is the default). "split" sends the
+given percentage of those requests to another version: "canary" serves
+them from it, "shadow" serves them from the default and scores them
+again on the split version in the background, counting agreement.
+"""
+import csv
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from cascade import build_cascade
+from inference import build_predictor
+from native_model import load_native, native_files
+
+ROUTING_FILE = "routing.json"
+SPLIT_MODES = ("canary", "shadow")
+
+
+class UnknownVersionError(LookupError):
+    """A request asked for a model version that is not loaded."""
+
+
+class ModelValidationError(ValueError):
+    """A new model version failed the golden input check."""
+
+
+class ModelVersion:
+    def __init__(self, name, predictor, fingerprint, source):
+        self.name = name
+        self.predictor = predictor
+        self.fingerprint = fingerprint
+        self.source = source
+        self.loaded_at = time.time()
+        self.batcher = None         # created on first micro-batched request
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def describe(self):
+        info = {
+            "version": self.name,
+            "fingerprint": self.fingerprint,
+            "inference_engine": self.predictor.name,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+        }
+        # Engines with their own statistics (the cascade) add them here
+        describe = getattr(self.predictor, "describe", None)
+        if describe is not None:
+            info.update(describe())
+        return info
+
+
+def version_name(path):
+    """Version name of an artifact: its file or directory name without extension."""
+    name = os.path.basename(os.path.normpath(path))
+    return os.path.splitext(name)[0]
+
+
+def artifact_fingerprint(*paths):
+    """Short content hash identifying a model artifact."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def load_artifact(path, engine, feature_columns, cascade_threshold=None, logger=None):
+    """
+    Load a joblib artifact or an exported native directory.
+    Returns (predictor, fingerprint). With a cascade_threshold, the
+    artifact's fast_model answers confident rows first (see cascade.py).
+    """
+    if os.path.isdir(path):
+        if cascade_threshold is not None and logger is not None:
+            logger.warning("CASCADE_THRESHOLD ignored for native model %s", path)
+        # Parity was checked when the directory was exported; there is no
+        # pipeline here to fall back on, so "pipeline" means "compiled".
+        predictor = load_native(path, engine, feature_columns)
+        return predictor, artifact_fingerprint(*native_files(path, engine))
+
+    import joblib
+
+    artifacts = joblib.load(path)
+    predictor = build_predictor(
+        engine,
+        artifacts["model"],             # XGBoost pipeline (preprocessor + model)
+        artifacts["label_encoder"],
+        feature_columns,
+        logger=logger,
+    )
+    if cascade_threshold is not None:
+        predictor = build_cascade(
+            artifacts, predictor, cascade_threshold, feature_columns, logger=logger
+        )
+    return predictor, artifact_fingerprint(path)
+
+
+# --------------------------------------------------
+# Golden input check
+# --------------------------------------------------
+def load_golden_set(path, feature_columns):
+    """
+    Read the golden inputs CSV: the feature columns plus an optional
+    expected_crop column. Returns (X, expected or None).
+    """
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise ValueError(f"Golden set {path} has no rows")
+
+    X = np.array([[float(row[col]) for col in feature_columns] for row in rows])
+    expected = None
+    if "expected_crop" in rows[0]:
+        expected = np.array([row["expected_crop"] for row in rows])
+    return X, expected
+
+
+def validate_version(version, X, expected=None, min_accuracy=1.0):
+    """
+    Score the golden inputs and check that the probabilities are sane and
+    that enough predictions match expected_crop. Returns the accuracy (or
+    None without expected labels); raises ModelValidationError.
+    """
+    predictor = version.predictor
+    try:
+        proba = np.asarray(predictor.predict_proba(X))
+    except Exception as e:
+        raise ModelValidationError(f"{version.name}: scoring the golden set failed: {e}")
+
+    if proba.shape != (len(X), len(predictor.classes)):
+        raise ModelValidationError(
+            f"{version.name}: probability shape {proba.shape} does not match "
+            f"{len(X)} rows x {len(predictor.classes)} classes"
+        )
+    if not np.all(np.isfinite(proba)) or not np.allclose(proba.sum(axis=1), 1.0, atol=1e-3):
+        raise ModelValidationError(f"{version.name}: probabilities are not a distribution")
+
+    if expected is None:
+        return None
+
+    labels = np.asarray(predictor.classes)[np.argmax(proba, axis=1)]
+    accuracy = float(np.mean(labels == expected))
+    if accuracy < min_accuracy:
+        raise ModelValidationError(
+            f"{version.name}: golden set accuracy {accuracy:.3f} is below {min_accuracy}"
+        )
+    return accuracy
+
+
+# --------------------------------------------------
+# Registry
+# --------------------------------------------------
+class ModelRegistry:
+    def __init__(self, max_versions=3, logger=None):
+        self.max_versions = max(int(max_versions), 1)
+        self.logger = logger
+        self._versions = OrderedDict()      # name -> ModelVersion, oldest first
+        self._lock = threading.Lock()
+        self._default = None
+        self._pinned_default = None
+        self._split = None                  # (version name, percent, mode)
+        self._shadow = {"rows": 0, "agreed": 0}
+
+    def add(self, version):
+        """Register a validated version, replacing any previous one of that name."""
+        with self._lock:
+            previous = self._versions.pop(version.name, None)
+            self._versions[version.name] = version
+            # The newest version becomes the default unless routing.json
+            # pins another one that is loaded
+            pinned = self._pinned_default
+            if pinned not in self._versions or pinned == version.name:
+                self._default = version
+            evicted = self._evict()
+
+        for old in evicted + ([previous] if previous is not None else []):
+            old.close()
+        if self.logger is not None:
+            self.logger.info("Model version %s (%s) loaded", version.name, version.fingerprint)
+
+    def _evict(self):
+        protected = {self._default.name if self._default else None}
+        if self._split is not None:
+            protected.add(self._split[0])
+
+        evicted = []
+        for name in list(self._versions):
+            if len(self._versions) <= self.max_versions:
+                break
+            if name not in protected:
+                evicted.append(self._versions.pop(name))
+        return evicted
+
+    def get(self, name):
+        try:
+            return self._versions[name]
+        except KeyError:
+            raise UnknownVersionError(
+                f"Unknown model_version {name!r}; loaded: {', '.join(self._versions)}"
+            )
+
+    @property
+    def default(self):
+        return self._default
+
+    def versions(self):
+        return list(self._versions.values())
+
+    def apply_routing(self, routing):
+        """Apply a routing.json document (see module docstring)."""
+        default = routing.get("default")
+        split = routing.get("split")
+        if split:
+            mode = split.get("mode", "canary")
+            if mode not in SPLIT_MODES:
+                raise ValueError(f"Unknown split mode {mode!r}; expected one of {SPLIT_MODES}")
+            percent = float(split.get("percent", 0))
+            if not 0 <= percent <= 100:
+                raise ValueError("Split percent must be between 0 and 100")
+            split = (split["version"], percent, mode)
+
+        with self._lock:
+            self._pinned_default = default
+            if default in self._versions:
+                self._default = self._versions[default]
+            elif default is not None and self.logger is not None:
+                self.logger.warning("routing.json default %r is not loaded (yet)", default)
+            if split != self._split:
+                self._shadow = {"rows": 0, "agreed": 0}
+            self._split = split
+
+    def route(self, requested=None):
+        """
+        Pick the version for one request. Returns (version, shadow) where
+        shadow is a version to re-score the request on in the background,
+        or None.
+        """
+        if requested:
+            return self.get(requested), None
+
+        default, split = self._default, self._split
+        if split is None:
+            return default, None
+
+        name, percent, mode = split
+        candidate = self._versions.get(name)
+        if candidate is None or candidate is default or random.random() * 100 >= percent:
+            return default, None
+        if mode == "canary":
+            return candidate, None
+        return default, candidate
+
+    def record_shadow(self, rows, agreed):
+        with self._lock:
+            self._shadow["rows"] += rows
+            self._shadow["agreed"] += agreed
+
+    def describe(self):
+        with self._lock:
+            versions = [version.describe() for version in self._versions.values()]
+            split = self._split
+            shadow = dict(self._shadow)
+
+        result = {
+            "default": self._default.name if self._default else None,
+            "versions": versions,
+            "split": None,
+        }
+        if split is not None:
+            name, percent, mode = split
+            result["split"] = {"version": name, "percent": percent, "mode": mode}
+            if mode == "shadow":
+                shadow["agreement"] = (
+                    round(shadow["agreed"] / shadow["rows"], 4) if shadow["rows"] else None
+                )
+                result["shadow"] = shadow
+        return result
+
+
+# --------------------------------------------------
+# Directory watcher
+# --------------------------------------------------
+class ArtifactWatcher:
+    def __init__(self, directory, load_fn, registry, interval=5.0, logger=None):
+        """
+        load_fn : callable taking an artifact path and returning a validated
+                  ModelVersion (raising on failure).
+        """
+        self.directory = directory
+        self.load_fn = load_fn
+        self.registry = registry
+        self.interval = float(interval)
+        self.logger = logger
+        self._seen = {}             # path -> signature already handled
+        self._thread = None
+        self._thread_pid = None
+
+    def mark_loaded(self, path):
+        """Record an artifact loaded elsewhere so it is not loaded again."""
+        path = os.path.abspath(path)
+        self._seen[path] = _signature(path)
+
+    def candidates(self):
+        """Artifacts in the directory, oldest first."""
+        paths = []
+        for entry in sorted(os.listdir(self.directory)):
+            path = os.path.abspath(os.path.join(self.directory, entry))
+            if entry.endswith(".joblib") and os.path.isfile(path):
+                paths.append(path)
+            elif os.path.isfile(os.path.join(path, "preprocess.npz")):
+                paths.append(path)
+        return sorted(paths, key=os.path.getmtime)
+
+    def scan(self):
+        """Load every new or changed artifact, then re-apply routing.json."""
+        try:
+            paths = self.candidates()
+        except OSError as e:
+            self._log("warning", "Cannot list %s: %s", self.directory, e)
+            return
+
+        for path in paths:
+            signature = _signature(path)
+            if signature is None or self._seen.get(path) == signature:
+                continue
+            # Recorded before loading so a broken artifact is not retried
+            # until it changes again
+            self._seen[path] = signature
+            try:
+                self.registry.add(self.load_fn(path))
+            except Exception as e:
+                self._log("warning", "Rejected model artifact %s: %s", path, e)
+
+        routing_path = os.path.join(self.directory, ROUTING_FILE)
+        if os.path.exists(routing_path):
+            try:
+                with open(routing_path) as f:
+                    self.registry.apply_routing(json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                self._log("warning", "Ignoring %s: %s", routing_path, e)
+
+    def start(self):
+        # Threads do not survive fork(), so each pre-forked worker starts
+        # its own watcher (see gunicorn.conf.py).
+        pid = os.getpid()
+        if self._thread is not None and self._thread_pid == pid:
+            return
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+        self._thread_pid = pid
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.scan()
+
+    def _log(self, level, *args):
+        if self.logger is not None:
+            getattr(self.logger, level)(*args)
+
+
+def _signature(path):
+    """(mtime, size) of a file, or of every file in a native model directory."""
+    try:
+        if os.path.isdir(path):
+            return tuple(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in sorted(os.scandir(path), key=lambda e: e.name)
+                if entry.is_file()
+            )
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
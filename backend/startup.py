@@ -0,0 +1,73 @@
+"""
+Cold-start accounting.
+
+Measures from the moment the process was created (not from when this
+module was imported, which misses interpreter start-up and the imports
+before it) through each loading phase to the first request served.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def process_start_time():
+    """Wall-clock time this process was created (Linux /proc), else now."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesised command name
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.time()
+    return time.time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+class StartupTracker:
+    def __init__(self):
+        self.started_at = process_start_time()
+        self.phases = {}
+        self.ready = False
+        self.ready_after = None
+        self.first_request_after = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a named loading step."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - t0, 4)
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_after = round(time.time() - self.started_at, 4)
+
+    def reset(self):
+        """Start counting again in a freshly forked worker."""
+        self.started_at = time.time()
+        self.ready = False
+        self.ready_after = None
+        self.first_request_after = None
+
+    def request_served(self):
+        """Record the first request served; returns its delay, once only."""
+        if self.first_request_after is not None or not self.ready:
+            return None
+        with self._lock:
+            if self.first_request_after is not None:
+                return None
+            self.first_request_after = round(time.time() - self.started_at, 4)
+            return self.first_request_after
+
+    def summary(self):
+        return {
+            "ready": self.ready,
+            "pid": os.getpid(),
+            "phases": dict(self.phases),
+            "seconds_to_ready": self.ready_after,
+            "seconds_to_first_request": self.first_request_after,
+        }
@@ -0,0 +1,113 @@
+"""
+What-if sensitivity sweeps.
+
+A sweep starts from one base input and varies one or two features over a
+range. The full grid is built as a single NumPy matrix, scored in one
+batched call, and returned as a compact decision map: a legend of the
+crops that appear plus a grid of legend indices (and optionally the
+winning probability per cell).
+"""
+import numpy as np
+
+
+class SweepError(ValueError):
+    """The sweep request is malformed or too large."""
+
+
+def _axis_length(axis):
+    """Number of values on an axis, checked before anything is allocated."""
+    if "values" in axis:
+        values = axis["values"]
+        if not isinstance(values, (list, tuple)) or not values:
+            raise SweepError("'values' must be a non-empty list of numbers")
+        return len(values)
+    try:
+        float(axis["start"]), float(axis["stop"])
+        steps = int(axis.get("steps", 20))
+    except KeyError as e:
+        raise SweepError(f"Axis needs 'values' or 'start' and 'stop' (missing {e})")
+    if steps < 1:
+        raise SweepError("'steps' must be at least 1")
+    return steps
+
+
+def _axis_values(axis, base_value):
+    if "values" in axis:
+        values = np.asarray(axis["values"], dtype=np.float64)
+        if values.ndim != 1:
+            raise SweepError("'values' must be a non-empty list of numbers")
+    else:
+        values = np.linspace(float(axis["start"]), float(axis["stop"]), int(axis.get("steps", 20)))
+
+    # relative=true means the range is a multiplier of the base value,
+    # e.g. start=0.8, stop=1.2 for "20% lower to 20% higher"
+    if axis.get("relative"):
+        values = values * base_value
+    return values
+
+
+def build_grid(base, axes, feature_columns, max_cells):
+    """
+    Build the sweep matrix.
+
+    base : dict with every feature in feature_columns
+    axes : list of 1 or 2 dicts {"feature", "start", "stop", "steps"} or
+           {"feature", "values"}, each optionally "relative": true
+
+    Returns (X, axis_values) where X has one row per grid cell in
+    row-major order over the axes.
+    """
+    if not isinstance(base, dict):
+        raise SweepError("'base' must be an object with every feature")
+    missing = [col for col in feature_columns if col not in base]
+    if missing:
+        raise SweepError(f"Base input is missing fields: {', '.join(missing)}")
+    if not isinstance(axes, list) or not 1 <= len(axes) <= 2:
+        raise SweepError("'vary' must list one or two features")
+
+    base_row = np.array([base[col] for col in feature_columns], dtype=np.float64)
+
+    positions, shape = [], []
+    for axis in axes:
+        if not isinstance(axis, dict):
+            raise SweepError(f"Each entry of 'vary' must be an object, got {axis!r}")
+        feature = axis.get("feature")
+        if feature not in feature_columns:
+            raise SweepError(f"Unknown feature to vary: {feature!r}")
+        position = feature_columns.index(feature)
+        if position in positions:
+            raise SweepError(f"Feature {feature!r} is varied twice")
+        positions.append(position)
+        shape.append(_axis_length(axis))
+
+    # Python ints: the size is checked before any axis or grid is allocated
+    n_cells = 1
+    for length in shape:
+        n_cells *= length
+    if n_cells > max_cells:
+        raise SweepError(f"Sweep has {n_cells} cells; the limit is {max_cells}")
+
+    axis_values = [
+        _axis_values(axis, base_row[position]) for axis, position in zip(axes, positions)
+    ]
+
+    X = np.tile(base_row, (n_cells, 1))
+    for position, grid in zip(positions, np.meshgrid(*axis_values, indexing="ij")):
+        X[:, position] = grid.ravel()
+
+    return X, axis_values
+
+
+def decision_map(proba, classes, shape, include_probabilities=False):
+    """Compress per-cell probabilities into a crop legend and index grid."""
+    best = np.argmax(proba, axis=1)
+    used, cell_index = np.unique(best, return_inverse=True)
+
+    result = {
+        "crops": np.asarray(classes)[used].tolist(),
+        "grid": cell_index.reshape(shape).tolist(),
+    }
+    if include_probabilities:
+        winning = proba[np.arange(len(best)), best].astype(np.float64)
+        result["probability"] = np.round(winning, 4).reshape(shape).tolist()
+    return result
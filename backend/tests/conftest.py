@@ -0,0 +1,50 @@
+"""Fixtures shared by the backend tests: the Crop data, a small model and the app."""
+import importlib
+import os
+
+import joblib
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+from xgboost import XGBClassifier
+
+from contract import FEATURE_COLUMNS
+from train import DEFAULT_DATASET, TARGET, make_pipeline
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def crop_data():
+    """(X, labels) of model/Crop_recommendation.csv."""
+    df = pd.read_csv(DEFAULT_DATASET)
+    return df[FEATURE_COLUMNS], df[TARGET].to_numpy()
+
+
+@pytest.fixture(scope="session")
+def crop_artifacts(crop_data):
+    """A small pipeline fitted on all of the Crop data, laid out like the saved artifact."""
+    X, labels = crop_data
+    label_encoder = LabelEncoder().fit(labels)
+    model = make_pipeline(XGBClassifier(
+        objective="multi:softprob", n_estimators=20, max_depth=4,
+        random_state=0, n_jobs=1,
+    ))
+    model.fit(X, label_encoder.transform(labels))
+    return {"model": model, "label_encoder": label_encoder}
+
+
+@pytest.fixture(scope="session")
+def client(crop_artifacts, tmp_path_factory):
+    """Flask test client of app.py serving crop_artifacts."""
+    directory = tmp_path_factory.mktemp("server")
+    model_path = str(directory / "crop_recommendation_model.joblib")
+    joblib.dump(crop_artifacts, model_path)
+    # app.py reads its configuration once, at import
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("MODEL_PATH", model_path)
+        patch.setenv("GOLDEN_SET_PATH", os.path.join(BACKEND_DIR, "golden_inputs.csv"))
+        patch.setenv("JOB_DIR", str(directory / "jobs"))
+        patch.setenv("PROFILE_DIR", str(directory / "profiles"))
+        app = importlib.import_module("app")
+    return app.app.test_client()
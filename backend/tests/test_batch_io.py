@@ -0,0 +1,94 @@
+"""Malformed uploads are reported as bad requests, not server errors."""
+import io
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from batch_io import InputFormatError, count_rows, read_chunks, read_frame  # noqa: E402
+from contract import FEATURE_COLUMNS  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def table(crop_data):
+    X, _ = crop_data
+    return pa.Table.from_pandas(X.iloc[:500], preserve_index=False)
+
+
+def parquet_bytes(table):
+    sink = io.BytesIO()
+    pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+def arrow_bytes(table, file_format=False):
+    sink = io.BytesIO()
+    new = pa.ipc.new_file if file_format else pa.ipc.new_stream
+    with new(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=100)
+    return sink.getvalue()
+
+
+def truncated(data):
+    return data[:len(data) // 2]
+
+
+@pytest.fixture(scope="module")
+def malformed(table):
+    """(format, upload bytes) pairs that pyarrow cannot read."""
+    return [
+        ("parquet", b"PAR1garbage"),
+        ("parquet", truncated(parquet_bytes(table))),
+        ("arrow", truncated(arrow_bytes(table))),
+        ("arrow", truncated(arrow_bytes(table, file_format=True))),
+    ]
+
+
+def test_readers_raise_input_format_error(malformed):
+    for fmt, data in malformed:
+        with pytest.raises(InputFormatError):
+            read_frame(io.BytesIO(data), fmt, FEATURE_COLUMNS)
+        with pytest.raises(InputFormatError):
+            list(read_chunks(io.BytesIO(data), fmt, 100, FEATURE_COLUMNS))
+        if fmt == "parquet":
+            with pytest.raises(InputFormatError):
+                count_rows(io.BytesIO(data), fmt)
+
+
+def test_readers_accept_complete_uploads(table):
+    for fmt, data in [("parquet", parquet_bytes(table)), ("arrow", arrow_bytes(table)),
+                      ("arrow", arrow_bytes(table, file_format=True))]:
+        assert len(read_frame(io.BytesIO(data), fmt, FEATURE_COLUMNS)) == 500
+        chunks = list(read_chunks(io.BytesIO(data), fmt, 64, FEATURE_COLUMNS))
+        assert sum(len(chunk) for chunk in chunks) == 500
+
+
+UPLOAD_NAMES = ["upload.parquet", "upload.parquet", "upload.arrow", "upload.arrow"]
+
+
+@pytest.mark.parametrize("index", range(len(UPLOAD_NAMES)))
+def test_batch_predict_rejects_malformed_upload(client, malformed, index):
+    _, data = malformed[index]
+    response = client.post("/batch_predict",
+                           data={"file": (io.BytesIO(data), UPLOAD_NAMES[index])})
+    assert response.status_code == 400, response.get_data(as_text=True)
+    assert "Invalid" in response.get_json()["error"]
+
+
+# A truncated Arrow IPC stream can only fail after its first batches have
+# been streamed (or a job started); Parquet and the Arrow file format
+# fail when opened
+@pytest.mark.parametrize("index", [0, 1, 3])
+def test_streamed_batch_predict_rejects_malformed_upload(client, malformed, index):
+    _, data = malformed[index]
+    response = client.post("/batch_predict?stream=csv",
+                           data={"file": (io.BytesIO(data), UPLOAD_NAMES[index])})
+    assert response.status_code == 400, response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize("index", [1, 3])
+def test_jobs_reject_malformed_upload(client, malformed, index):
+    _, data = malformed[index]
+    response = client.post("/jobs", data={"file": (io.BytesIO(data), UPLOAD_NAMES[index])})
+    assert response.status_code == 400, response.get_data(as_text=True)
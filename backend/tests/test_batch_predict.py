@@ -0,0 +1,37 @@
+"""Inputs echoed by /batch_predict when some rows fail validation."""
+import io
+import json
+
+import pytest
+
+MIXED_CSV = (
+    "N,P,K,temperature,humidity,ph,rainfall\n"
+    "90,42,43,20.8,82,6.5,202.9\n"
+    "x,42,43,20.8,82,99,202.9\n"
+    "20,60,20,25,60,6,100\n"
+)
+
+
+def post(client, query=""):
+    return client.post("/batch_predict" + query,
+                       data={"file": (io.BytesIO(MIXED_CSV.encode()), "mixed.csv")})
+
+
+def test_partial_batch_echoes_numbers(client):
+    response = post(client)
+    assert response.status_code == 200
+    rows = response.get_json()
+    assert [row["N"] for row in rows] == [90.0, None, 20.0]
+    assert rows[1]["error"] == "N: not_a_number; ph: out_of_range"
+    assert rows[1]["recommended_crop"] is None
+
+
+@pytest.mark.parametrize("query", ["?stream=ndjson", "?format=columnar"])
+def test_partial_batch_echoes_numbers_in_other_formats(client, query):
+    response = post(client, query)
+    assert response.status_code == 200
+    if query == "?stream=ndjson":
+        values = [json.loads(line)["N"] for line in response.get_data(as_text=True).splitlines()]
+    else:
+        values = response.get_json()["N"]
+    assert values == [90.0, None, 20.0]
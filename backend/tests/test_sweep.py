@@ -0,0 +1,41 @@
+"""Malformed /sweep requests are answered with 400."""
+import pytest
+
+from contract import FEATURE_COLUMNS
+from sweep import SweepError, build_grid
+
+BASE = {"N": 50, "P": 40, "K": 40, "temperature": 25.0, "humidity": 80.0,
+        "ph": 6.5, "rainfall": 120.0}
+
+
+def test_build_grid():
+    X, axis_values = build_grid(
+        BASE, [{"feature": "rainfall", "start": 100, "stop": 200, "steps": 3},
+               {"feature": "ph", "values": [6, 7]}],
+        FEATURE_COLUMNS, max_cells=100,
+    )
+    assert X.shape == (6, len(FEATURE_COLUMNS))
+    assert [values.tolist() for values in axis_values] == [[100, 150, 200], [6, 7]]
+
+
+@pytest.mark.parametrize("base, axes", [
+    (BASE, [5]),
+    (BASE, ["rainfall"]),
+    (BASE, [{"feature": "rainfall", "values": [1]}, None]),
+    ([1, 2, 3], [{"feature": "rainfall", "values": [1]}]),
+    (BASE, [{"feature": "rainfall", "start": 0, "stop": 1, "steps": 10 ** 9}]),
+])
+def test_build_grid_rejects_malformed_axes(base, axes):
+    with pytest.raises(SweepError):
+        build_grid(base, axes, FEATURE_COLUMNS, max_cells=100)
+
+
+@pytest.mark.parametrize("body", [
+    {"base": BASE, "vary": [5]},
+    {"base": BASE, "vary": [{"feature": "rainfall", "start": "low", "stop": 1}]},
+    {"base": "N=50", "vary": [{"feature": "rainfall", "values": [1]}]},
+    [BASE],
+])
+def test_sweep_rejects_malformed_request(client, body):
+    response = client.post("/sweep", json=body)
+    assert response.status_code == 400, response.get_data(as_text=True)
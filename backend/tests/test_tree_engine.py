@@ -0,0 +1,117 @@
+"""Parity of the NumPy tree engine with the sklearn pipeline it replaces."""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+from xgboost import XGBClassifier
+
+from contract import FEATURE_COLUMNS
+from train import make_pipeline
+from tree_engine import NumpyTreePredictor
+
+ATOL = 1e-5
+
+
+def synthetic_crops(n_rows=600, seed=0):
+    """Integer-valued features (many ties, like the Crop data) and four labels."""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.integers(0, 60, size=(n_rows, len(FEATURE_COLUMNS))).astype(np.float64),
+                     columns=FEATURE_COLUMNS)
+    score = X["N"] - X["P"] + 0.5 * X["rainfall"] + rng.normal(0, 5, n_rows)
+    labels = np.array(["rice", "maize", "apple", "mango"])[np.digitize(score, [10, 25, 40])]
+    return X, labels
+
+
+@pytest.fixture(scope="module", params=[1, 4], ids=["stumps", "depth4"])
+def fitted(request):
+    X, labels = synthetic_crops()
+    label_encoder = LabelEncoder().fit(labels)
+    pipeline = make_pipeline(XGBClassifier(
+        objective="multi:softprob", n_estimators=25, max_depth=request.param,
+        learning_rate=0.3, random_state=0, n_jobs=1,
+    ))
+    pipeline.fit(X, label_encoder.transform(labels))
+    engine = NumpyTreePredictor.from_pipeline(pipeline, label_encoder, FEATURE_COLUMNS)
+    return pipeline, engine, X
+
+
+def split_points(pipeline):
+    """(feature index, float32 threshold) of every split in the booster."""
+    booster = pipeline.named_steps["classifier"].get_booster()
+    model = json.loads(bytes(booster.save_raw(raw_format="json")))
+    points = set()
+    for tree in model["learner"]["gradient_booster"]["model"]["trees"]:
+        for node, left in enumerate(tree["left_children"]):
+            if left != -1:
+                points.add((tree["split_indices"][node], np.float32(tree["split_conditions"][node])))
+    return sorted(points)
+
+
+def raw_value_at(threshold, mean, scale):
+    """A raw input that the scaler maps exactly onto `threshold` in float32, or None."""
+    x = float(threshold) * scale + mean
+    for _ in range(64):
+        scaled = np.float32((x - mean) / scale)
+        if scaled == threshold:
+            return x
+        x = np.nextafter(x, np.inf if scaled < threshold else -np.inf)
+    return None
+
+
+def assert_matches(pipeline, engine, X):
+    expected = pipeline.predict_proba(pd.DataFrame(X, columns=FEATURE_COLUMNS))
+    np.testing.assert_allclose(engine.predict_proba(X), expected, rtol=0, atol=ATOL)
+
+
+def test_matches_pipeline(fitted):
+    pipeline, engine, X = fitted
+    assert_matches(pipeline, engine, X.to_numpy())
+
+
+def test_matches_pipeline_on_split_thresholds(fitted):
+    pipeline, engine, X = fitted
+    base = X.to_numpy()[:20]
+    rows = []
+    for feature, threshold in split_points(pipeline):
+        value = raw_value_at(threshold, engine.mean[feature], engine.scale[feature])
+        if value is None:
+            continue
+        on_threshold = base.copy()
+        on_threshold[:, feature] = value
+        rows.append(on_threshold)
+    # Most splits must be reachable exactly, or the test proves nothing
+    assert len(rows) >= len(split_points(pipeline)) // 2
+    assert_matches(pipeline, engine, np.concatenate(rows))
+
+
+def test_matches_pipeline_on_missing_values(fitted):
+    pipeline, engine, X = fitted
+    rows = X.to_numpy()[:50].copy()
+    rows[::2, 0] = np.nan
+    rows[1::3, -1] = np.nan
+    assert_matches(pipeline, engine, rows)
+
+
+def test_matches_pipeline_across_chunks(fitted, monkeypatch):
+    import tree_engine
+
+    pipeline, engine, X = fitted
+    monkeypatch.setattr(tree_engine, "MIN_CHUNK_ROWS", 7)
+    monkeypatch.setattr(tree_engine, "MAX_CHUNK_ROWS", 7)
+    assert_matches(pipeline, engine, X.to_numpy()[:100])
+
+
+def test_matches_pipeline_on_crop_data(crop_data, crop_artifacts):
+    """The make_pipeline model fitted on model/Crop_recommendation.csv, on all of its rows."""
+    X, _ = crop_data
+    pipeline, label_encoder = crop_artifacts["model"], crop_artifacts["label_encoder"]
+    engine = NumpyTreePredictor.from_pipeline(pipeline, label_encoder, FEATURE_COLUMNS)
+    rows = X.to_numpy(dtype=np.float64)
+
+    assert len(rows) == 2200
+    np.testing.assert_allclose(engine.predict_proba(rows), pipeline.predict_proba(X),
+                               rtol=0, atol=ATOL)
+    np.testing.assert_array_equal(engine.predict_labels(rows),
+                                  label_encoder.inverse_transform(pipeline.predict(X)))
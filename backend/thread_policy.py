@@ -0,0 +1,209 @@
+"""
+Per-call xgboost thread counts, and CPU pinning of pre-forked workers.
+
+xgboost uses every core by default. With several gunicorn workers (each
+with several request threads) that oversubscribes the machine, and a
+single-row call pays for waking a whole thread team it cannot use, while a
+large batch in a worker limited to one thread leaves cores idle.
+
+A ``ThreadPolicy`` maps batch size to a thread count:
+
+    1:1,512:2,8192:4    1-511 rows on 1 thread, 512-8191 on 2, 8192+ on 4
+
+``ThreadTunedPredictor`` wraps an engine and keeps one copy of it per
+thread count in the policy (boosters are copied, not shared, so calls
+with different thread counts can run concurrently). Each call is
+dispatched on its row count.
+
+The policy is either given (INFERENCE_THREADS=<policy>) or calibrated at
+startup (INFERENCE_THREADS=auto): predict_proba is timed for a few batch
+sizes and thread counts up to the worker's budget (its share of the
+cores), and each size gets the fastest count. More threads must win by
+at least CALIBRATION_MARGIN to be chosen, since idle cores are worth more
+to concurrent requests than a marginal speed-up.
+
+With CPU_AFFINITY=1 every gunicorn worker is pinned to its own share of
+the cores (see gunicorn.conf.py), so workers do not migrate between
+cores or compete for the same ones.
+"""
+import os
+import time
+
+from inference import parity_sample, scaler_params
+
+CALIBRATION_SIZES = (1, 64, 1024, 4096)
+CALIBRATION_MARGIN = 0.10
+
+
+class ThreadPolicy:
+    def __init__(self, tiers):
+        """tiers: (min_rows, nthread) pairs; the smallest min_rows covers everything below it."""
+        self.tiers = sorted((int(rows), int(nthread)) for rows, nthread in tiers)
+        if not self.tiers:
+            raise ValueError("A thread policy needs at least one tier")
+        if any(nthread < 1 for _, nthread in self.tiers):
+            raise ValueError("Thread counts must be at least 1")
+
+    def threads_for(self, n_rows):
+        nthread = self.tiers[0][1]
+        for min_rows, tier_threads in self.tiers:
+            if n_rows < min_rows:
+                break
+            nthread = tier_threads
+        return nthread
+
+    def thread_counts(self):
+        return sorted({nthread for _, nthread in self.tiers})
+
+    def describe(self):
+        return [{"min_rows": rows, "nthread": nthread} for rows, nthread in self.tiers]
+
+    def __str__(self):
+        return ",".join(f"{rows}:{nthread}" for rows, nthread in self.tiers)
+
+
+def parse_policy(spec):
+    """
+    "1:1,512:2,8192:4" (min_rows:nthread pairs), or a bare "4" for the
+    same thread count at every batch size.
+    """
+    tiers = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        rows, _, nthread = item.rpartition(":")
+        try:
+            tiers.append((int(rows or 1), int(nthread)))
+        except ValueError:
+            raise ValueError(f"Invalid INFERENCE_THREADS entry {item!r}; expected min_rows:nthread")
+    return ThreadPolicy(tiers)
+
+
+# --------------------------------------------------
+# CPU budget and pinning
+# --------------------------------------------------
+def available_cpus():
+    """CPUs this process may run on (its affinity mask where supported)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def thread_budget(workers):
+    """Threads one call may use when `workers` processes share the CPUs."""
+    return max(len(available_cpus()) // max(int(workers), 1), 1)
+
+
+def worker_cpus(slot, workers, cpus=None):
+    """The CPUs worker number `slot` (0-based) is pinned to: its share, wrapping around."""
+    cpus = available_cpus() if cpus is None else cpus
+    share = max(len(cpus) // max(int(workers), 1), 1)
+    start = (slot * share) % len(cpus)
+    return [cpus[(start + i) % len(cpus)] for i in range(share)]
+
+
+def pin_cpus(cpus):
+    """Pin the calling process (threads it starts later inherit the mask). False if unsupported."""
+    if not hasattr(os, "sched_setaffinity"):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+# --------------------------------------------------
+# Calibration
+# --------------------------------------------------
+def calibration_rows(predictor, feature_columns, n_rows):
+    """Probe rows spread around the training distribution."""
+    if hasattr(predictor, "mean"):
+        mean, scale = predictor.mean, predictor.scale
+    else:
+        mean, scale = scaler_params(predictor.pipeline, feature_columns)
+    return parity_sample(mean, scale, n_rows)
+
+
+def _best_times(fns, min_rounds=2, max_rounds=10, min_time=0.3):
+    """
+    Best seconds per call of each fn, timed in interleaved rounds so that
+    drift (CPU frequency, caches warming up) does not favour any of them.
+    """
+    best = {key: float("inf") for key in fns}
+    total, rounds = 0.0, 0
+    while rounds < min_rounds or (rounds < max_rounds and total < min_time):
+        for key, fn in fns.items():
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            best[key] = min(best[key], elapsed)
+            total += elapsed
+        rounds += 1
+    return best
+
+
+def calibrate(predictor, feature_columns, budget, sizes=CALIBRATION_SIZES,
+              margin=CALIBRATION_MARGIN):
+    """
+    Time predict_proba for every size in `sizes` on 1, 2, 4, ... up to
+    `budget` threads. Returns (policy, timings) where timings maps
+    "rows/nthread" to the best seconds per call.
+    """
+    if budget <= 1:
+        return ThreadPolicy([(1, 1)]), {}
+
+    counts = sorted({min(2 ** i, budget) for i in range(budget.bit_length() + 1)})
+    variants = {nthread: predictor.with_threads(nthread) for nthread in counts}
+    X = calibration_rows(predictor, feature_columns, max(sizes))
+    for variant in variants.values():
+        variant.predict_proba(X[:1])            # lazy setup, thread team start
+
+    tiers, timings = [], {}
+    chosen = 1
+    for size in sorted(sizes):
+        batch = X[:size]
+        seconds = _best_times({
+            nthread: (lambda variant=variant: variant.predict_proba(batch))
+            for nthread, variant in variants.items()
+        })
+        for nthread in counts:
+            timings[f"{size}/{nthread}"] = round(seconds[nthread], 6)
+        # Never fewer threads for a bigger batch; more only if clearly faster
+        for nthread in counts:
+            if nthread > chosen and seconds[nthread] < seconds[chosen] * (1 - margin):
+                chosen = nthread
+        if not tiers or tiers[-1][1] != chosen:
+            tiers.append((size, chosen))
+    return ThreadPolicy(tiers), timings
+
+
+# --------------------------------------------------
+# Engine wrapper
+# --------------------------------------------------
+class ThreadTunedPredictor:
+    """An engine whose calls each run on the thread count the policy picks for their size."""
+
+    def __init__(self, predictor, policy):
+        self.base = predictor
+        self.policy = policy
+        self.name = predictor.name
+        self.classes = predictor.classes
+        self.variants = {n: predictor.with_threads(n) for n in policy.thread_counts()}
+
+    def _variant(self, X):
+        return self.variants[self.policy.threads_for(len(X))]
+
+    def predict_proba(self, X):
+        return self._variant(X).predict_proba(X)
+
+    def predict(self, X):
+        return self._variant(X).predict(X)
+
+    def decode(self, indices):
+        return self.base.decode(indices)
+
+    def predict_labels(self, X):
+        return self._variant(X).predict_labels(X)
+
+    def __getattr__(self, name):
+        # Everything else (mean, scale, pipeline, ...) comes from the wrapped engine
+        return getattr(self.base, name)
@@ -0,0 +1,328 @@
+"""
+Scripted training: the notebook's model, reproducibly and in a fraction of the time.
+
+    python train.py
+    python train.py --dataset fields.csv --output registry/crop_recommendation_model_v3.joblib
+    python train.py --cache-dir ~/.cache/crop-train --jobs 4
+
+Writes the artifact the notebook saves ({"model", "fast_model",
+"label_encoder"}, loaded by the backend as is), from the same split
+(80/20, stratified, random_state 42) and the same pipeline (StandardScaler
+then XGBClassifier). The notebook's RandomizedSearchCV fits 30 candidates
+x 5 folds, each refitting the scaler and boosting up to 500 rounds. Here:
+
+- Successive halving (HalvingRandomSearchCV) over the boosting rounds:
+  --candidates candidates are cross-validated with MIN_ROUNDS rounds, and
+  the best third of them moves on to three times as many rounds, up to
+  MAX_ROUNDS.
+- Early stopping: each booster holds out VALIDATION_FRACTION of its
+  training fold and stops after EARLY_STOPPING_ROUNDS rounds without
+  improvement.
+- The scaler is fitted once per fold and cached (joblib.Memory in
+  --cache-dir), not once per candidate. A persistent --cache-dir is reused
+  by later runs on the same data.
+- Folds run in --jobs processes with --threads-per-fit xgboost threads
+  each, within the CPUs available, so processes and xgboost threads are
+  never nested beyond the core count.
+
+Of the candidates within --tolerance of the best CV score, the fastest to
+serve is exported (see model_search.py). It is refitted on the whole
+training split with the number of rounds early stopping found.
+
+The artifact is written under a temporary name and renamed into place, so
+training straight into MODEL_WATCH_DIR is safe. A JSON report (timings,
+search summary, test metrics) is written next to it. The exit status is
+non-zero on failure, for use from cron or another scheduler.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Memory
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+from sklearn.model_selection import HalvingRandomSearchCV, train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+from xgboost import XGBClassifier
+
+from contract import FEATURE_COLUMNS
+from model_search import evaluate_search, format_candidates, pareto_front, search_report, select_model
+from registry import artifact_fingerprint
+from thread_policy import available_cpus
+
+TARGET = "label"
+
+DEFAULT_DATASET = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "model", "Crop_recommendation.csv"
+)
+
+# The notebook's search space; the number of rounds is the halving resource
+PARAM_DISTRIBUTIONS = {
+    "classifier__max_depth": [2, 3, 4, 5, 6, 8, 10],
+    "classifier__learning_rate": [0.01, 0.05, 0.1, 0.2],
+    "classifier__subsample": [0.6, 0.8, 1.0],
+    "classifier__colsample_bytree": [0.6, 0.8, 1.0],
+    "classifier__gamma": [0, 0.1, 0.2],
+}
+
+MIN_ROUNDS = 18
+MAX_ROUNDS = 486            # 18, 54, 162, 486 rounds: 27, 9, 3, 1 candidates by default
+HALVING_FACTOR = 3
+CV_FOLDS = 5
+
+EARLY_STOPPING_ROUNDS = 20
+VALIDATION_FRACTION = 0.1
+
+
+class EarlyStoppingXGBClassifier(XGBClassifier):
+    """XGBClassifier that holds out part of its training data to stop boosting early."""
+
+    def __init__(self, *, validation_fraction=VALIDATION_FRACTION, **kwargs):
+        super().__init__(**kwargs)
+        self.validation_fraction = validation_fraction
+
+    def get_xgb_params(self):
+        params = super().get_xgb_params()
+        params.pop("validation_fraction", None)
+        return params
+
+    def fit(self, X, y, **fit_params):
+        X_fit, X_val, y_fit, y_val = train_test_split(
+            X, y, test_size=self.validation_fraction, stratify=y, random_state=self.random_state
+        )
+        return super().fit(X_fit, y_fit, eval_set=[(X_val, y_val)], verbose=False, **fit_params)
+
+
+def make_pipeline(classifier, memory=None):
+    preprocessor = ColumnTransformer(
+        transformers=[("num", StandardScaler(), FEATURE_COLUMNS)]
+    )
+    return Pipeline(
+        steps=[("preprocessor", preprocessor), ("classifier", classifier)],
+        memory=memory,
+    )
+
+
+def xgb_params(seed, threads=None):
+    # As in the notebook; n_jobs=None (all cores) is what the artifact keeps
+    return {
+        "objective": "multi:softprob",
+        "eval_metric": "mlogloss",
+        "random_state": seed,
+        "n_jobs": threads,
+    }
+
+
+def load_dataset(path, seed):
+    df = pd.read_csv(path)
+    missing = [column for column in FEATURE_COLUMNS + [TARGET] if column not in df.columns]
+    if missing:
+        raise ValueError(f"{path} has no column {', '.join(missing)}")
+
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(df[TARGET])
+    X_train, X_test, y_train, y_test = train_test_split(
+        df[FEATURE_COLUMNS], y, test_size=0.20, stratify=y, random_state=seed
+    )
+    return X_train, X_test, y_train, y_test, label_encoder
+
+
+def run_search(X_train, y_train, candidates, jobs, threads, memory, seed):
+    classifier = EarlyStoppingXGBClassifier(
+        early_stopping_rounds=EARLY_STOPPING_ROUNDS, **xgb_params(seed, threads)
+    )
+    search = HalvingRandomSearchCV(
+        estimator=make_pipeline(classifier, memory),
+        param_distributions=PARAM_DISTRIBUTIONS,
+        n_candidates=candidates,
+        factor=HALVING_FACTOR,
+        resource="classifier__n_estimators",
+        min_resources=MIN_ROUNDS,
+        max_resources=MAX_ROUNDS,
+        scoring="f1_macro",
+        cv=CV_FOLDS,
+        refit=False,
+        n_jobs=jobs,
+        random_state=seed,
+    )
+    search.fit(X_train, y_train)
+    return search
+
+
+def fit_final(params, X_train, y_train, seed):
+    """
+    Early-stopped fit to find the number of rounds, then a plain
+    XGBClassifier with that many rounds, refitted on all training rows.
+    """
+    probe = make_pipeline(EarlyStoppingXGBClassifier(
+        early_stopping_rounds=EARLY_STOPPING_ROUNDS, **xgb_params(seed)
+    ))
+    probe.set_params(**params).fit(X_train, y_train)
+    rounds = probe.named_steps["classifier"].best_iteration + 1
+
+    final = make_pipeline(XGBClassifier(**xgb_params(seed)))
+    final.set_params(**params)
+    final.set_params(classifier__n_estimators=rounds)
+    return final.fit(X_train, y_train)
+
+
+def fit_fast_model(X_train, y_train, seed):
+    """The small forest in front of the cascade (see cascade.py), as in the notebook."""
+    fast = make_pipeline(RandomForestClassifier(n_estimators=20, max_depth=10, random_state=seed))
+    return fast.fit(X_train, y_train)
+
+
+def test_metrics(pipeline, X_test, y_test):
+    predicted = pipeline.predict(X_test)
+    return {
+        "accuracy": round(accuracy_score(y_test, predicted), 4),
+        "precision_macro": round(precision_score(y_test, predicted, average="macro"), 4),
+        "recall_macro": round(recall_score(y_test, predicted, average="macro"), 4),
+        "f1_macro": round(f1_score(y_test, predicted, average="macro"), 4),
+    }
+
+
+def write_atomic(path, write):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".part")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the crop recommendation model")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="CSV with features and label")
+    parser.add_argument("--output", default="crop_recommendation_model.joblib",
+                        help="artifact to write (renamed into place when complete)")
+    parser.add_argument("--report", default=None,
+                        help="JSON report (default: the output path with .json)")
+    parser.add_argument("--candidates", type=int, default=27,
+                        help="candidates in the first halving round")
+    parser.add_argument("--tolerance", type=float, default=0.005,
+                        help="CV F1-macro to give up for the fastest model (see model_search.py)")
+    parser.add_argument("--engine", default="compiled",
+                        help="inference engine the candidates' latency is measured with")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="CV processes (default: available CPUs / --threads-per-fit)")
+    parser.add_argument("--threads-per-fit", type=int, default=1,
+                        help="xgboost threads in each CV process")
+    parser.add_argument("--cache-dir", default=None,
+                        help="keep the per-fold preprocessing cache here across runs "
+                             "(default: a temporary directory)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    cpus = len(available_cpus())
+    if args.threads_per_fit < 1 or (args.jobs is not None and args.jobs < 1):
+        parser.error("--jobs and --threads-per-fit must be at least 1")
+    jobs = args.jobs or max(cpus // args.threads_per_fit, 1)
+    if jobs * args.threads_per_fit > cpus:
+        print(f"Warning: {jobs} jobs x {args.threads_per_fit} threads exceed the {cpus} "
+              f"CPUs available", file=sys.stderr)
+    report_path = args.report or os.path.splitext(args.output)[0] + ".json"
+
+    timings = {}
+    start = time.perf_counter()
+    try:
+        X_train, X_test, y_train, y_test, label_encoder = load_dataset(args.dataset, args.seed)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    print(f"{len(X_train)} training rows, {len(X_test)} test rows, "
+          f"{len(label_encoder.classes_)} classes")
+
+    cache = args.cache_dir or tempfile.mkdtemp(prefix="crop-train-")
+    memory = Memory(cache, verbose=0)
+    try:
+        phase = time.perf_counter()
+        search = run_search(X_train, y_train, args.candidates, jobs, args.threads_per_fit,
+                            memory, args.seed)
+        timings["search"] = round(time.perf_counter() - phase, 2)
+    finally:
+        if args.cache_dir is None:
+            shutil.rmtree(cache, ignore_errors=True)
+
+    scores = search.cv_results_["mean_test_score"]
+    best_score = float(np.nanmax(scores))
+    eligible = [i for i, score in enumerate(scores) if score >= best_score - args.tolerance]
+    print(f"Search: {search.n_candidates_} candidates at {search.n_resources_} rounds "
+          f"in {timings['search']:.1f}s; best CV F1-macro {best_score:.4f}, "
+          f"{len(eligible)} within {args.tolerance}")
+
+    phase = time.perf_counter()
+    candidates = evaluate_search(
+        search, X_train, y_train, X_test, y_test, label_encoder, FEATURE_COLUMNS,
+        engine=args.engine, log=None, indices=eligible,
+        fit=lambda params: fit_final(params, X_train, y_train, args.seed),
+    )
+    chosen = select_model(candidates, tolerance=args.tolerance)
+    timings["selection"] = round(time.perf_counter() - phase, 2)
+    print(format_candidates(pareto_front(candidates)))
+    print(f"Chosen: {chosen['params']}, {chosen['n_trees']} trees, "
+          f"{chosen['single_row_ms']:.3f} ms per single row")
+
+    phase = time.perf_counter()
+    model = chosen["pipeline"]
+    fast_model = fit_fast_model(X_train, y_train, args.seed)
+    timings["fast_model"] = round(time.perf_counter() - phase, 2)
+
+    metrics = test_metrics(model, X_test, y_test)
+    print("Test: " + ", ".join(f"{key} {value:.4f}" for key, value in metrics.items()))
+
+    model_artifacts = {
+        "model": model,
+        "fast_model": fast_model,
+        "label_encoder": label_encoder,
+    }
+    write_atomic(args.output, lambda tmp: joblib.dump(model_artifacts, tmp))
+    timings["total"] = round(time.perf_counter() - start, 2)
+
+    report = {
+        "dataset": os.path.abspath(args.dataset),
+        "dataset_fingerprint": artifact_fingerprint(args.dataset),
+        "artifact": os.path.abspath(args.output),
+        "artifact_fingerprint": artifact_fingerprint(args.output),
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "options": {
+            "candidates": args.candidates,
+            "tolerance": args.tolerance,
+            "engine": args.engine,
+            "jobs": jobs,
+            "threads_per_fit": args.threads_per_fit,
+            "seed": args.seed,
+        },
+        "timings": timings,
+        "halving": [
+            {"rounds": int(rounds), "candidates": int(n)}
+            for rounds, n in zip(search.n_resources_, search.n_candidates_)
+        ],
+        "test": metrics,
+        "model_search": search_report(candidates, chosen, args.tolerance),
+    }
+
+    def write_report(tmp):
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    write_atomic(report_path, write_report)
+    print(f"Wrote {args.output} and {report_path} in {timings['total']:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+"""
+Vectorized NumPy evaluator for the XGBoost tree ensemble.
+
+The boosted trees are flattened into parallel node arrays (feature index,
+threshold, left/right child, default direction for missing values, leaf
+value). A batch is evaluated by walking every (row, tree) pair one level
+per step with array indexing, so the whole ensemble is scored with a fixed
+number of NumPy operations per chunk of rows.
+
+Leaves point back to themselves, so a tree that reached its leaves stays
+there. Most boosted trees here are shallow, and are not walked at all:
+
+- a single-leaf tree adds a constant to its class margin;
+- a depth-1 tree is a step function of one feature, so all of them
+  together form one step table per feature (sorted thresholds and the
+  cumulative per-class jumps), read with a single searchsorted per row.
+
+The deeper trees are walked deepest first. Each step only touches the trees
+deeper than the current level, and the first step is done column-wise,
+because every tree starts at its own root. Inputs are compared in float32,
+as xgboost does.
+
+The arrays can be saved to a single .npz file; loading it needs only NumPy,
+so a serving image can run the model without importing xgboost.
+
+Parity check against the sklearn pipeline:
+
+    python tree_engine.py crop_recommendation_model.joblib ../model/Crop_recommendation.csv
+"""
+import json
+
+import numpy as np
+
+from inference import ScaledPredictor, booster_iteration_range, scaler_params
+
+# Rows per chunk: about MAX_CELLS_PER_CHUNK (rows x walked trees) node
+# indices, 2 MB that stay in cache between levels, clamped to
+# [MIN_CHUNK_ROWS, MAX_CHUNK_ROWS]. Larger chunks are slower, not faster.
+MAX_CELLS_PER_CHUNK = 1 << 18
+MIN_CHUNK_ROWS = 128
+MAX_CHUNK_ROWS = 4096
+
+
+def _parse_base_margin(learner_model_param, n_classes):
+    # Stored as "5E-1" in older releases and "[v0,v1,...]" (one per class)
+    # in newer ones. Either way it is added to the raw margin.
+    raw = learner_model_param.get("base_score", "0")
+    values = np.asarray(json.loads(raw) if raw.startswith("[") else [float(raw)],
+                        dtype=np.float64)
+    return np.broadcast_to(values, (n_classes,)).copy()
+
+
+def _tree_depth(left, right):
+    deepest = 0
+    stack = [(0, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if left[node] == -1:
+            deepest = max(deepest, depth)
+        else:
+            stack.append((left[node], depth + 1))
+            stack.append((right[node], depth + 1))
+    return deepest
+
+
+def _tree_depths(children, roots):
+    """Depth of every tree in the flattened arrays (0 for a single leaf)."""
+    is_leaf = children[:, 0] == np.arange(len(children))
+    depths = np.zeros(len(roots), dtype=np.int32)
+    node, tree = np.asarray(roots), np.arange(len(roots))
+    level = 0
+    while node.size:
+        inner = ~is_leaf[node]
+        node, tree = children[node[inner]].ravel(), np.repeat(tree[inner], 2)
+        level += 1
+        depths[tree] = level
+    return depths
+
+
+class NumpyTreePredictor(ScaledPredictor):
+    """Multi-class softprob ensemble evaluated with NumPy array operations."""
+
+    name = "numpy"
+
+    ARRAYS = ("feature", "threshold", "children", "default_left", "value",
+              "roots", "tree_class", "base_margin", "mean", "scale", "classes")
+
+    def __init__(self, mean, scale, classes, feature, threshold, children,
+                 default_left, value, roots, tree_class, base_margin, max_depth):
+        super().__init__(mean, scale, classes)
+        self.feature = np.ascontiguousarray(feature, dtype=np.int32)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float32)
+        self.children = np.ascontiguousarray(children, dtype=np.int32)   # (n_nodes, 2)
+        self.default_left = np.ascontiguousarray(default_left, dtype=bool)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.int32)
+        self.tree_class = np.ascontiguousarray(tree_class, dtype=np.int32)
+        self.base_margin = np.asarray(base_margin, dtype=np.float64)
+        self.max_depth = int(max_depth)
+
+        self.n_trees = len(self.roots)
+        depths = _tree_depths(self.children, self.roots)
+        self._prepare_leaves_and_steps(depths)
+        self._prepare_walk(depths)
+
+    def _prepare_leaves_and_steps(self, depths):
+        n_classes = len(self.base_margin)
+        leaves_only = depths == 0
+        stumps = np.flatnonzero(depths == 1)
+        root = self.roots[stumps]
+        stump_class = self.tree_class[stumps]
+        left_value = self.value[self.children[root, 0]]
+        jump = self.value[self.children[root, 1]] - left_value
+        feature = self.feature[root]
+        threshold = self.threshold[root]
+        default_right = ~self.default_left[root]
+
+        # Every stump contributes its left leaf; rows at or above its
+        # threshold get its jump on top
+        self._constant_margin = (
+            self.base_margin
+            + np.bincount(self.tree_class[leaves_only],
+                          weights=self.value[self.roots[leaves_only]], minlength=n_classes)
+            + np.bincount(stump_class, weights=left_value, minlength=n_classes)
+        )
+        self._steps = []
+        for f in np.unique(feature):
+            picked = np.flatnonzero(feature == f)
+            picked = picked[np.argsort(threshold[picked], kind="stable")]
+            cumulative = np.zeros((len(picked) + 1, n_classes))
+            cumulative[np.arange(1, len(picked) + 1), stump_class[picked]] = jump[picked]
+            np.cumsum(cumulative, axis=0, out=cumulative)
+            # Missing values follow each stump's default direction
+            missing = np.bincount(stump_class[picked], weights=jump[picked] * default_right[picked],
+                                  minlength=n_classes)
+            self._steps.append((int(f), threshold[picked], cumulative, missing))
+
+    def _prepare_walk(self, depths):
+        # Deepest first: at level d only the leading _active[d] columns move
+        walked = np.flatnonzero(depths >= 2)
+        order = walked[np.argsort(-depths[walked], kind="stable")]
+        roots = self.roots[order]
+        self._active = [int((depths[order] > level).sum()) for level in range(self.max_depth)]
+        self._root_feature = self.feature[roots]
+        self._root_threshold = self.threshold[roots]
+        self._root_default_right = ~self.default_left[roots]
+        # Walk indices are intp: int32 ones would be converted on every gather
+        self._walk_feature = self.feature.astype(np.intp)
+        self._walk_children = self.children.astype(np.intp).ravel()
+        self._root_left = self.children[roots, 0].astype(np.intp)
+        self._root_step = self.children[roots, 1] - self._root_left   # right - left
+        # Leaf values to per-class margins in one matrix product
+        self._class_matrix = np.zeros((len(order), len(self.base_margin)))
+        self._class_matrix[np.arange(len(order)), self.tree_class[order]] = 1.0
+
+    # --------------------------------------------------
+    # Construction
+    # --------------------------------------------------
+    @classmethod
+    def from_xgboost_json(cls, model_json, mean, scale, classes, iteration_range=(0, 0)):
+        """
+        Flatten a booster saved with ``save_raw("json")`` / ``save_model("*.json")``.
+        Only numeric splits of a multi:softprob gbtree model are supported.
+        """
+        if isinstance(model_json, (bytes, bytearray, str)):
+            model_json = json.loads(model_json)
+
+        learner = model_json["learner"]
+        objective = learner["objective"]["name"]
+        if objective != "multi:softprob":
+            raise ValueError(f"Unsupported objective {objective!r}")
+
+        booster = learner["gradient_booster"]
+        if booster["name"] != "gbtree":
+            raise ValueError(f"Unsupported booster {booster['name']!r}")
+
+        model = booster["model"]
+        n_classes = int(learner["learner_model_param"]["num_class"])
+        trees = model["trees"]
+        tree_info = model["tree_info"]
+
+        begin, end = iteration_range
+        if end > 0:
+            indptr = model["iteration_indptr"]
+            trees = trees[indptr[begin]:indptr[end]]
+            tree_info = tree_info[indptr[begin]:indptr[end]]
+
+        feature, threshold, children, default_left, value, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+
+        for tree in trees:
+            if any(tree["split_type"]):
+                raise ValueError("Categorical splits are not supported")
+
+            left = np.asarray(tree["left_children"], dtype=np.int64)
+            right = np.asarray(tree["right_children"], dtype=np.int64)
+            conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+            node_ids = np.arange(len(left))
+            is_leaf = left == -1
+
+            # Leaves loop back onto themselves
+            left = np.where(is_leaf, node_ids, left) + offset
+            right = np.where(is_leaf, node_ids, right) + offset
+
+            feature.append(np.where(is_leaf, 0, tree["split_indices"]))
+            threshold.append(np.where(is_leaf, np.inf, conditions))
+            children.append(np.stack([left, right], axis=1))
+            default_left.append(np.asarray(tree["default_left"], dtype=bool))
+            value.append(np.where(is_leaf, conditions, 0.0))
+            roots.append(offset)
+
+            max_depth = max(max_depth, _tree_depth(tree["left_children"],
+                                                   tree["right_children"]))
+            offset += len(left)
+
+        return cls(
+            mean, scale, classes,
+            feature=np.concatenate(feature),
+            threshold=np.concatenate(threshold),
+            children=np.concatenate(children),
+            default_left=np.concatenate(default_left),
+            value=np.concatenate(value),
+            roots=np.asarray(roots),
+            tree_class=np.asarray(tree_info),
+            base_margin=_parse_base_margin(learner["learner_model_param"], n_classes),
+            max_depth=max_depth,
+        )
+
+    @classmethod
+    def from_pipeline(cls, pipeline, label_encoder, feature_columns):
+        """Build the engine from a fitted Pipeline(preprocessor, classifier)."""
+        classifier = pipeline.named_steps["classifier"]
+        mean, scale = scaler_params(pipeline, feature_columns)
+        model_json = classifier.get_booster().save_raw(raw_format="json")
+
+        return cls.from_xgboost_json(
+            bytes(model_json), mean, scale, label_encoder.classes_,
+            iteration_range=booster_iteration_range(classifier),
+        )
+
+    def save(self, path):
+        """Write all arrays to one .npz file (no pickle, no xgboost needed to load)."""
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        arrays["classes"] = np.asarray(self.classes, dtype=str)
+        np.savez(path, max_depth=self.max_depth, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            kwargs = {name: data[name] for name in cls.ARRAYS}
+            return cls(max_depth=int(data["max_depth"]), **kwargs)
+
+    # --------------------------------------------------
+    # Evaluation
+    # --------------------------------------------------
+    def _margins(self, X):
+        n_rows, n_features = X.shape
+        rows = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        flat_x = X.ravel()
+        has_missing = np.isnan(flat_x).any()
+
+        margin = np.tile(self._constant_margin, (n_rows, 1))
+        for f, thresholds, cumulative, missing_margin in self._steps:
+            x = X[:, f]
+            margin += cumulative[np.searchsorted(thresholds, x, side="right")]
+            if has_missing:
+                nan = np.isnan(x)
+                margin[nan] += missing_margin - cumulative[-1]    # NaN sorts last
+
+        # First level: every walked tree is at its own root
+        x = X[:, self._root_feature]
+        go_right = x >= self._root_threshold
+        if has_missing:
+            go_right = np.where(np.isnan(x), self._root_default_right, go_right)
+        node = go_right * self._root_step
+        node += self._root_left
+
+        for active in self._active[1:]:
+            walking = node[:, :active]
+            x = flat_x[rows + self._walk_feature[walking]]
+            # Missing values compare False here and are redirected below
+            go_right = x >= self.threshold[walking]
+            if has_missing:
+                missing = np.isnan(x)
+                go_right[missing] = ~self.default_left[walking[missing]]
+            walking *= 2
+            walking += go_right
+            node[:, :active] = self._walk_children[walking]
+
+        margin += self.value[node] @ self._class_matrix
+        return margin
+
+    def predict_proba(self, X):
+        X = self.transform(X)
+        chunk = MAX_CELLS_PER_CHUNK // max(len(self._class_matrix), 1)
+        chunk = min(max(chunk, MIN_CHUNK_ROWS), MAX_CHUNK_ROWS)
+
+        proba = np.empty((X.shape[0], len(self.base_margin)))
+        for start in range(0, X.shape[0], chunk):
+            margin = self._margins(X[start:start + chunk])
+            margin -= margin.max(axis=1, keepdims=True)
+            np.exp(margin, out=margin)
+            margin /= margin.sum(axis=1, keepdims=True)
+            proba[start:start + chunk] = margin
+
+        return proba
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import joblib
+    import pandas as pd
+
+    from contract import FEATURE_COLUMNS
+    from inference import PipelinePredictor, check_parity
+
+    parser = argparse.ArgumentParser(
+        description="Check the NumPy tree engine against the sklearn pipeline "
+                    "and optionally export it to .npz"
+    )
+    parser.add_argument("artifact", help="crop_recommendation_model.joblib")
+    parser.add_argument("csv", help="CSV with FEATURE_COLUMNS, e.g. Crop_recommendation.csv")
+    parser.add_argument("--export", help="write the flattened ensemble to this .npz path")
+    args = parser.parse_args()
+
+    artifacts = joblib.load(args.artifact)
+    reference = PipelinePredictor(
+        artifacts["model"], artifacts["label_encoder"], FEATURE_COLUMNS
+    )
+    engine = NumpyTreePredictor.from_pipeline(
+        artifacts["model"], artifacts["label_encoder"], FEATURE_COLUMNS
+    )
+
+    X = pd.read_csv(args.csv)[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    check_parity(engine, reference, X)
+
+    start = time.perf_counter()
+    engine.predict_proba(X)
+    elapsed = time.perf_counter() - start
+    print(f"Parity OK on {len(X)} rows, {engine.n_trees} trees, depth {engine.max_depth} "
+          f"({len(X) / elapsed:,.0f} rows/s)")
+
+    if args.export:
+        engine.save(args.export)
+        print(f"Saved {args.export}")
@@ -0,0 +1,225 @@
+"""
+Incremental update of a trained artifact with new labelled observations.
+
+    python update_model.py new_observations.csv
+    python update_model.py new_observations.csv --model crop_recommendation_model.joblib \
+        --output registry/crop_recommendation_model_v4.joblib --rounds 20 --replay 2
+
+Instead of a full search and refit (train.py), the existing XGBoost model
+keeps boosting: --rounds more rounds are fitted on the new rows, plus
+--replay times as many rows drawn from the training split of --dataset
+(the history), so that the new trees do not forget the old data. The
+fitted scaler, the LabelEncoder classes and the other hyperparameters
+are kept as they are. New rows with a crop the model does not know are
+refused (that needs a full retrain with train.py), and rows failing the
+input checks (see validation.py) are dropped. The small cascade model
+(fast_model) is copied unchanged.
+
+The update is accepted only if accuracy on the holdout does not fall by
+more than --max-regression. The holdout is the test split of --dataset
+together with --holdout of the new rows, which are not trained on.
+Accepted updates are written under a temporary name and renamed into
+place, so the default of updating --model in place is safe with
+MODEL_WATCH_DIR. A JSON report is written next to the output either way,
+and the exit status is 1 when the update is rejected.
+
+The cost is --rounds rounds over len(new rows) x (1 + --replay) rows, so
+it depends on the amount of new data, not the length of the history.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+
+from contract import FEATURE_COLUMNS
+from registry import artifact_fingerprint
+from train import DEFAULT_DATASET, TARGET, load_dataset, test_metrics, write_atomic
+from validation import parse_ranges, validate_frame
+
+
+def load_new_rows(path, label_encoder, feature_ranges=None):
+    """(X, y, dropped): the new rows that pass validation, labels encoded with the model's classes."""
+    df = pd.read_csv(path)
+    missing = [column for column in FEATURE_COLUMNS + [TARGET] if column not in df.columns]
+    if missing:
+        raise ValueError(f"{path} has no column {', '.join(missing)}")
+
+    unknown = sorted(set(df[TARGET].dropna()) - set(label_encoder.classes_))
+    if unknown:
+        raise ValueError(f"{path} has crops the model does not know ({', '.join(map(str, unknown))}); "
+                         f"run train.py for a full retrain")
+
+    low, high = parse_ranges(feature_ranges, FEATURE_COLUMNS)
+    validation = validate_frame(df[FEATURE_COLUMNS], FEATURE_COLUMNS, low, high)
+    keep = validation.valid & df[TARGET].notna().to_numpy()
+    X = pd.DataFrame(validation.X[keep], columns=FEATURE_COLUMNS)
+    y = label_encoder.transform(df.loc[keep, TARGET])
+    return X, y, int((~keep).sum())
+
+
+def split_holdout(X, y, fraction, seed):
+    """(X_fit, y_fit, X_holdout, y_holdout); stratified where every crop has enough rows."""
+    if fraction <= 0 or len(X) * fraction < 1:
+        return X, y, X.iloc[:0], y[:0]
+    _, counts = np.unique(y, return_counts=True)
+    stratify = y if counts.min() >= 2 and len(X) * fraction >= len(counts) else None
+    X_fit, X_holdout, y_fit, y_holdout = train_test_split(
+        X, y, test_size=fraction, stratify=stratify, random_state=seed
+    )
+    return X_fit, y_fit, X_holdout, y_holdout
+
+
+def replay_sample(X_history, y_history, n_rows, seed):
+    """n_rows rows of the history (all of it if it is smaller), drawn without replacement."""
+    n_rows = min(int(n_rows), len(X_history))
+    rows = np.random.default_rng(seed).choice(len(X_history), size=n_rows, replace=False)
+    return X_history.iloc[rows], y_history[rows]
+
+
+def continue_boosting(pipeline, X, y, rounds, n_classes):
+    """
+    A copy of the pipeline whose booster has `rounds` more rounds, fitted
+    on X, y as scaled by the pipeline's already fitted preprocessor.
+    """
+    updated = copy.deepcopy(pipeline)
+    classifier = updated.named_steps["classifier"]
+    X_scaled = updated.named_steps["preprocessor"].transform(X)
+
+    params = classifier.get_xgb_params()
+    # Fixed by the existing model, even when some crops have no new rows
+    params["num_class"] = n_classes
+    booster = xgb.train(
+        params, xgb.DMatrix(X_scaled, label=y), num_boost_round=rounds,
+        xgb_model=classifier.get_booster(),
+    )
+    classifier.load_model(booster.save_raw("ubj"))
+    classifier.set_params(n_estimators=booster.num_boosted_rounds())
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Continue boosting the model on new observations")
+    parser.add_argument("new_data", help="CSV of new labelled observations (features and label)")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "crop_recommendation_model.joblib"),
+                        help="artifact to update (default: MODEL_PATH)")
+    parser.add_argument("--output", default=None, help="updated artifact (default: --model)")
+    parser.add_argument("--report", default=None,
+                        help="JSON report (default: the output path with .json)")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET,
+                        help="the data the model was trained on: replay rows and holdout")
+    parser.add_argument("--rounds", type=int, default=10, help="boosting rounds to add")
+    parser.add_argument("--replay", type=float, default=1.0,
+                        help="history rows per new row mixed into the update (0 for new rows only)")
+    parser.add_argument("--holdout", type=float, default=0.2,
+                        help="share of the new rows kept out for the regression check")
+    parser.add_argument("--max-regression", type=float, default=0.0,
+                        help="largest accepted drop in holdout accuracy")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.rounds < 1:
+        parser.error("--rounds must be at least 1")
+    if args.replay < 0 or not 0 <= args.holdout < 1:
+        parser.error("--replay must be at least 0 and --holdout between 0 and 1")
+    output = args.output or args.model
+    report_path = args.report or os.path.splitext(output)[0] + ".json"
+
+    start = time.perf_counter()
+    try:
+        model_fingerprint = artifact_fingerprint(args.model)
+        artifacts = joblib.load(args.model)
+        label_encoder = artifacts["label_encoder"]
+        X_new, y_new, dropped = load_new_rows(
+            args.new_data, label_encoder, os.environ.get("FEATURE_RANGES")
+        )
+        # Same split (and seed) the model was trained with: its test rows were never seen
+        X_history, X_test, y_history, y_test, history_encoder = load_dataset(args.dataset, args.seed)
+    except (OSError, KeyError, ValueError) as e:
+        parser.error(str(e))
+    if list(history_encoder.classes_) != list(label_encoder.classes_):
+        parser.error(f"{args.dataset} does not have the model's crops; is it the training data?")
+    if not len(X_new):
+        parser.error(f"{args.new_data} has no valid rows")
+
+    X_fit, y_fit, X_holdout, y_holdout = split_holdout(X_new, y_new, args.holdout, args.seed)
+    X_replay, y_replay = replay_sample(X_history, y_history, len(X_fit) * args.replay, args.seed)
+    X_update = pd.concat([X_fit, X_replay], ignore_index=True)
+    y_update = np.concatenate([y_fit, y_replay])
+    print(f"{len(X_new)} new rows ({dropped} dropped as invalid): {len(X_fit)} to train on, "
+          f"{len(X_holdout)} held out; {len(X_replay)} replayed history rows")
+
+    model = artifacts["model"]
+    phase = time.perf_counter()
+    updated = continue_boosting(model, X_update, y_update, args.rounds, len(label_encoder.classes_))
+    fit_seconds = time.perf_counter() - phase
+
+    X_check = pd.concat([X_test, X_holdout], ignore_index=True)
+    y_check = np.concatenate([y_test, y_holdout])
+    before = test_metrics(model, X_check, y_check)
+    after = test_metrics(updated, X_check, y_check)
+    accepted = after["accuracy"] >= before["accuracy"] - args.max_regression
+    print(f"Holdout accuracy {before['accuracy']:.4f} -> {after['accuracy']:.4f} "
+          f"({len(X_check)} rows); {'accepted' if accepted else 'rejected'}")
+
+    if accepted:
+        artifacts = dict(artifacts, model=updated)
+        write_atomic(output, lambda tmp: joblib.dump(artifacts, tmp))
+
+    classifier = updated.named_steps["classifier"]
+    report = {
+        "model": os.path.abspath(args.model),
+        "model_fingerprint": model_fingerprint,
+        "new_data": os.path.abspath(args.new_data),
+        "new_data_fingerprint": artifact_fingerprint(args.new_data),
+        "accepted": bool(accepted),
+        "artifact": os.path.abspath(output) if accepted else None,
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "options": {
+            "rounds": args.rounds,
+            "replay": args.replay,
+            "holdout": args.holdout,
+            "max_regression": args.max_regression,
+            "seed": args.seed,
+        },
+        "rows": {
+            "new": len(X_new),
+            "dropped": dropped,
+            "trained": len(X_fit),
+            "replayed": len(X_replay),
+            "holdout": len(X_check),
+        },
+        "boosted_rounds": classifier.get_booster().num_boosted_rounds(),
+        "timings": {
+            "fit": round(fit_seconds, 3),
+            "total": round(time.perf_counter() - start, 3),
+        },
+        "holdout_before": before,
+        "holdout_after": after,
+    }
+    if accepted:
+        report["artifact_fingerprint"] = artifact_fingerprint(output)
+
+    def write_report(tmp):
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=2)
+
+    write_atomic(report_path, write_report)
+    if not accepted:
+        print(f"Not written: holdout accuracy fell by more than {args.max_regression}; "
+              f"see {report_path}", file=sys.stderr)
+        return 1
+    print(f"Wrote {output} ({report['boosted_rounds']} rounds) and {report_path} "
+          f"in {report['timings']['total']:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
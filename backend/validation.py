@@ -0,0 +1,193 @@
+"""
+Row-level validation of feature tables.
+
+Every check works on whole columns (pandas/NumPy); the only Python loops
+run over the feature columns, never over rows, so validating a file
+costs about as much as parsing it.
+
+Each cell gets one error code:
+
+    missing        empty cell or NaN
+    not_a_number   a value that does not parse as a number (e.g. "acidic")
+    infinite       +/-inf
+    out_of_range   outside the physically possible range in FEATURE_RANGES
+
+A row is valid when none of its feature cells has an error. Valid rows
+are scored; the others are reported per row.
+"""
+import numpy as np
+
+# Physically possible values, deliberately wider than the training data:
+# unusual-but-real inputs are scored, impossible ones are rejected.
+FEATURE_RANGES = {
+    "N": (0.0, 1000.0),             # kg/ha
+    "P": (0.0, 1000.0),             # kg/ha
+    "K": (0.0, 1000.0),             # kg/ha
+    "temperature": (-50.0, 70.0),   # degrees C
+    "humidity": (0.0, 100.0),       # %
+    "ph": (0.0, 14.0),
+    "rainfall": (0.0, 15000.0),     # mm
+}
+
+OK, MISSING, NOT_A_NUMBER, INFINITE, OUT_OF_RANGE = range(5)
+REASONS = ("ok", "missing", "not_a_number", "infinite", "out_of_range")
+
+
+def parse_ranges(spec, feature_columns):
+    """
+    Parse FEATURE_RANGES overrides ("ph=3:10,rainfall=0:5000") on top of
+    the defaults. Returns (low, high) arrays in feature_columns order.
+    """
+    ranges = {col: FEATURE_RANGES.get(col, (-np.inf, np.inf)) for col in feature_columns}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, bounds = item.partition("=")
+        name = name.strip()
+        if name not in ranges:
+            raise ValueError(f"Unknown feature {name!r} in FEATURE_RANGES")
+        low, _, high = bounds.partition(":")
+        ranges[name] = (float(low), float(high))
+
+    low = np.array([ranges[col][0] for col in feature_columns], dtype=np.float64)
+    high = np.array([ranges[col][1] for col in feature_columns], dtype=np.float64)
+    if (low > high).any():
+        raise ValueError("FEATURE_RANGES lower bounds must not exceed upper bounds")
+    return low, high
+
+
+# --------------------------------------------------
+# Coercion
+# --------------------------------------------------
+def coerce_frame(df, feature_columns):
+    """
+    The feature columns of a DataFrame as a float64 matrix, plus a mask of
+    cells that held something other than a number.
+    """
+    import pandas as pd
+
+    X = np.empty((len(df), len(feature_columns)), dtype=np.float64)
+    not_a_number = np.zeros(X.shape, dtype=bool)
+    for j, col in enumerate(feature_columns):
+        values = df[col]
+        if values.dtype.kind in "fiu":
+            X[:, j] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            continue
+        # Text (or mixed) column: anything that does not parse becomes NaN
+        numbers = pd.to_numeric(values, errors="coerce")
+        X[:, j] = numbers.to_numpy(dtype=np.float64, na_value=np.nan)
+        not_a_number[:, j] = numbers.isna().to_numpy() & values.notna().to_numpy()
+    return X, not_a_number
+
+
+def coerce_values(values):
+    """One row of JSON values (numbers or numeric strings) as a (1, n) matrix."""
+    X = np.full((1, len(values)), np.nan)
+    not_a_number = np.zeros(X.shape, dtype=bool)
+    for j, value in enumerate(values):
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            not_a_number[0, j] = True
+            continue
+        try:
+            X[0, j] = float(value)
+        except (TypeError, ValueError):
+            not_a_number[0, j] = True
+    return X, not_a_number
+
+
+# --------------------------------------------------
+# Checks
+# --------------------------------------------------
+def error_codes(X, low, high, not_a_number=None):
+    """(n_rows, n_features) int8 matrix of error codes (see module docstring)."""
+    codes = np.zeros(X.shape, dtype=np.int8)
+    codes[np.isnan(X)] = MISSING
+    if not_a_number is not None:
+        codes[not_a_number] = NOT_A_NUMBER
+    infinite = np.isinf(X)
+    codes[infinite] = INFINITE
+    with np.errstate(invalid="ignore"):
+        out_of_range = ((X < low) | (X > high)) & ~infinite
+    codes[out_of_range] = OUT_OF_RANGE
+    return codes
+
+
+class ValidationResult:
+    def __init__(self, X, codes, feature_columns):
+        self.X = X
+        self.codes = codes
+        self.feature_columns = list(feature_columns)
+        self.valid = ~codes.any(axis=1)
+        self.n_rows = len(X)
+        self.n_valid = int(self.valid.sum())
+        self.n_invalid = self.n_rows - self.n_valid
+
+    def valid_rows(self):
+        return self.X if not self.n_invalid else self.X[self.valid]
+
+    def summary(self):
+        """Invalid row count and, per column, how many cells failed for which reason."""
+        errors = {}
+        for j, col in enumerate(self.feature_columns):
+            counts = np.bincount(self.codes[:, j], minlength=len(REASONS))
+            failed = {REASONS[code]: int(n) for code, n in enumerate(counts) if code and n}
+            if failed:
+                errors[col] = failed
+        return {"total_rows": self.n_rows, "invalid_rows": self.n_invalid, "errors": errors}
+
+    def row_errors(self, limit=100, offset=0):
+        """The first `limit` invalid rows as {"row": index + offset, "errors": {column: reason}}."""
+        rows = np.flatnonzero(~self.valid)[:limit]
+        report = []
+        for row, codes in zip(rows, self.codes[rows]):
+            report.append({
+                "row": int(row) + offset,
+                "errors": {
+                    self.feature_columns[j]: REASONS[code]
+                    for j, code in enumerate(codes) if code
+                },
+            })
+        return report
+
+    def report(self, limit=100, offset=0):
+        """summary() plus the first invalid rows; for responses that reject the batch."""
+        result = self.summary()
+        result["rows"] = self.row_errors(limit, offset)
+        result["truncated"] = self.n_invalid > limit
+        return result
+
+    def messages(self):
+        """
+        One message per row, e.g. "ph: not_a_number; rainfall: missing",
+        and None for valid rows. Built column by column.
+        """
+        messages = np.full(self.n_rows, None, dtype=object)
+        if not self.n_invalid:
+            return messages
+
+        invalid = np.flatnonzero(~self.valid)
+        text = np.full(len(invalid), "", dtype=object)
+        for j, col in enumerate(self.feature_columns):
+            codes = self.codes[invalid, j]
+            if not codes.any():
+                continue
+            labels = np.array(["" if code == OK else f"{col}: {REASONS[code]}"
+                               for code in range(len(REASONS))], dtype=object)
+            part = labels[codes]
+            has_error = codes > 0
+            separator = np.where((text != "") & has_error, "; ", "")
+            text = text + separator + part
+        messages[invalid] = text
+        return messages
+
+
+def validate_frame(df, feature_columns, low, high):
+    X, not_a_number = coerce_frame(df, feature_columns)
+    return ValidationResult(X, error_codes(X, low, high, not_a_number), feature_columns)
+
+
+def validate_values(values, feature_columns, low, high):
+    X, not_a_number = coerce_values(values)
+    return ValidationResult(X, error_codes(X, low, high, not_a_number), feature_columns)
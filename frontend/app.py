@@ -1,5 +1,6 @@
 import io
 import os
+import time
 import requests
 import pandas as pd
 import streamlit as st
@@ -14,6 +15,44 @@ BACKEND_URL = os.getenv(
 
 SINGLE_PREDICT_ENDPOINT = f"{BACKEND_URL}/predict"
 BATCH_PREDICT_ENDPOINT = f"{BACKEND_URL}/batch_predict"
+JOBS_ENDPOINT = f"{BACKEND_URL}/jobs"
+JOB_POLL_SECONDS = 1.0
+
+
+def run_batch_prediction(files, progress):
+    """
+    Score an uploaded CSV as a backend job: submit, poll until done, then
+    download the result, so large files are not cut off by a request
+    timeout. Backends without /jobs get a single /batch_predict call.
+
+    Returns (response, records); records is None if the backend answered
+    with an error status (see response).
+    """
+    resp = requests.post(JOBS_ENDPOINT, files=files, timeout=60)
+    if resp.status_code == 404:
+        resp = requests.post(BATCH_PREDICT_ENDPOINT, files=files, timeout=60)
+        return resp, resp.json() if resp.status_code == 200 else None
+    if resp.status_code != 202:
+        return resp, None
+
+    job = resp.json()
+    while job["state"] in ("queued", "running"):
+        time.sleep(JOB_POLL_SECONDS)
+        resp = requests.get(f"{BACKEND_URL}{job['status_url']}", timeout=20)
+        if resp.status_code != 200:
+            return resp, None
+        job = resp.json()
+        progress.progress(
+            job["progress"] or 0.0, text=f"🔄 Scored {job['rows_done']:,} records..."
+        )
+
+    if job["state"] != "done":
+        raise RuntimeError(f"Batch job {job['state']}: {job.get('error')}")
+
+    resp = requests.get(f"{BACKEND_URL}{job['result_url']}", timeout=60)
+    if resp.status_code != 200:
+        return resp, None
+    return resp, pd.read_csv(io.BytesIO(resp.content)).to_dict(orient="records")
 
 # ===========================================
 # PAGE CONFIGURATION
@@ -704,21 +743,29 @@ with tab_batch:
                 }
 
                 try:
-                    with st.spinner("🔄 Processing your batch predictions... This may take a moment."):
-                        resp = requests.post(BATCH_PREDICT_ENDPOINT, files=files, timeout=60)
-
-                    if resp.status_code == 200:
-                        result = resp.json()
+                    progress = st.progress(
+                        0.0, text="🔄 Processing your batch predictions... This may take a moment."
+                    )
+                    resp, result = run_batch_prediction(files, progress)
+                    progress.empty()
 
+                    if result is not None:
                         # Backend returns a list of dicts: [ {cols..., "recommended_crop": ...}, ... ]
                         if isinstance(result, list):
                             df_result = pd.DataFrame(result)
                             desired_order = [
                                 "N", "P", "K",
                                 "temperature", "humidity", "ph", "rainfall",
-                                "recommended_crop"
+                                "recommended_crop", "error"
                             ]
 
+                            # Rows with invalid values come back unscored, with an error
+                            n_invalid = 0
+                            if "error" in df_result.columns:
+                                n_invalid = int(df_result["error"].notna().sum())
+                                if not n_invalid:
+                                    df_result = df_result.drop(columns="error")
+
                             # Keep only columns that actually exist
                             existing_cols = [c for c in desired_order if c in df_result.columns]
                             df_result = df_result[existing_cols]
@@ -734,6 +781,12 @@ with tab_batch:
                             </div>
                             """, unsafe_allow_html=True)
 
+                            if n_invalid:
+                                st.warning(
+                                    f"⚠️ {n_invalid} records had invalid values and were not "
+                                    "scored; see the error column."
+                                )
+
                             st.markdown("""
                             <div class="info-card">
                                 <h4 style="color: #2e7d32; margin-top: 0;">📊 Prediction Results</h4>